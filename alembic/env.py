@@ -5,7 +5,7 @@ from sqlalchemy import pool
 
 from alembic import context
 from modules.models import Base
-from modules.models import engine as target_metadata
+from modules.params import DB_URL
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -16,11 +16,15 @@ config = context.config
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
+# Use the same database as the bots when DB_URL is set
+if DB_URL:
+    config.set_main_option("sqlalchemy.url", DB_URL)
+
 # add your model's MetaData object here
 # for 'autogenerate' support
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
-target_metadata = None
+target_metadata = Base.metadata
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
@@ -0,0 +1,26 @@
+"""index users subscription_expiry
+
+Revision ID: 3f1a9c2b7d10
+Revises: 
+Create Date: 2026-10-18 09:12:44.301522
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1a9c2b7d10'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_users_subscription_expiry', 'users', ['subscription_expiry', 'user_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_subscription_expiry', table_name='users')
@@ -0,0 +1,40 @@
+"""add subscription reminders
+
+Revision ID: 4d6f0b9e1a27
+Revises: e2a7b4c8d913
+Create Date: 2026-10-18 15:47:26.310982
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4d6f0b9e1a27'
+down_revision: Union[str, None] = 'e2a7b4c8d913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'subscription_reminders',
+        sa.Column('reminder_id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('user_id', sa.BigInteger(), sa.ForeignKey('users.user_id'), nullable=False),
+        sa.Column('expiry', sa.Date(), nullable=False),
+        sa.Column('offset_days', sa.Integer(), nullable=False),
+        sa.Column('due_at', sa.DateTime(), nullable=False),
+        sa.Column('sent_at', sa.DateTime()),
+    )
+    op.create_index('ix_subscription_reminders_due', 'subscription_reminders', ['due_at'],
+                    postgresql_where=sa.text('sent_at IS NULL'), sqlite_where=sa.text('sent_at IS NULL'))
+    op.create_index('ix_subscription_reminders_user_id', 'subscription_reminders', ['user_id'])
+    # Existing subscriptions get their reminders with: python -m modules.reminders
+
+
+def downgrade() -> None:
+    op.drop_index('ix_subscription_reminders_user_id', table_name='subscription_reminders')
+    op.drop_index('ix_subscription_reminders_due', table_name='subscription_reminders')
+    op.drop_table('subscription_reminders')
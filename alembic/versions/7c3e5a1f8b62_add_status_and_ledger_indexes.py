@@ -0,0 +1,28 @@
+"""add status and ledger indexes
+
+Revision ID: 7c3e5a1f8b62
+Revises: 4d6f0b9e1a27
+Create Date: 2026-10-18 16:25:53.871406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c3e5a1f8b62'
+down_revision: Union[str, None] = '4d6f0b9e1a27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_users_status', 'users', ['user_id', 'subscription_status', 'subscription_expiry'])
+    op.create_index('ix_subscriptions_user_id_end_date', 'subscriptions', ['user_id', 'end_date'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_subscriptions_user_id_end_date', table_name='subscriptions')
+    op.drop_index('ix_users_status', table_name='users')
@@ -0,0 +1,46 @@
+"""add broadcast tables
+
+Revision ID: 8b42e6d1c0a5
+Revises: 3f1a9c2b7d10
+Create Date: 2026-10-18 10:03:17.552108
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b42e6d1c0a5'
+down_revision: Union[str, None] = '3f1a9c2b7d10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'broadcasts',
+        sa.Column('broadcast_id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('text', sa.String(), nullable=False),
+        sa.Column('status', sa.String()),
+        sa.Column('cursor_user_id', sa.BigInteger()),
+        sa.Column('sent_count', sa.Integer()),
+        sa.Column('failed_count', sa.Integer()),
+        sa.Column('created_by', sa.BigInteger()),
+        sa.Column('created_at', sa.DateTime()),
+        sa.Column('finished_at', sa.DateTime()),
+    )
+    op.create_table(
+        'broadcast_deliveries',
+        sa.Column('broadcast_id', sa.Integer(), sa.ForeignKey('broadcasts.broadcast_id'), primary_key=True),
+        sa.Column('user_id', sa.BigInteger(), primary_key=True),
+        sa.Column('status', sa.String()),
+        sa.Column('error', sa.String()),
+        sa.Column('attempted_at', sa.DateTime()),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('broadcast_deliveries')
+    op.drop_table('broadcasts')
@@ -0,0 +1,30 @@
+"""add payments indexes
+
+Revision ID: a9e4d2c6b058
+Revises: 7c3e5a1f8b62
+Create Date: 2026-10-18 16:58:12.409733
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9e4d2c6b058'
+down_revision: Union[str, None] = '7c3e5a1f8b62'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_payments_user_id_status_date', 'payments', ['user_id', 'payment_status', 'payment_date'])
+    op.create_index('ix_payments_receipt_message_id', 'payments', ['receipt_message_id'],
+                    postgresql_where=sa.text('receipt_message_id IS NOT NULL'),
+                    sqlite_where=sa.text('receipt_message_id IS NOT NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_payments_receipt_message_id', table_name='payments')
+    op.drop_index('ix_payments_user_id_status_date', table_name='payments')
@@ -0,0 +1,32 @@
+"""add admin notifications
+
+Revision ID: b81f3d7e4c19
+Revises: a9e4d2c6b058
+Create Date: 2026-10-18 17:40:08.225196
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b81f3d7e4c19'
+down_revision: Union[str, None] = 'a9e4d2c6b058'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'admin_notifications',
+        sa.Column('payment_id', sa.Integer(), sa.ForeignKey('payments.payment_id'), primary_key=True),
+        sa.Column('admin_id', sa.BigInteger(), primary_key=True),
+        sa.Column('message_id', sa.BigInteger(), nullable=False),
+        sa.Column('sent_at', sa.DateTime()),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('admin_notifications')
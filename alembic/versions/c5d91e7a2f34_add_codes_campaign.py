@@ -0,0 +1,28 @@
+"""add codes campaign
+
+Revision ID: c5d91e7a2f34
+Revises: 8b42e6d1c0a5
+Create Date: 2026-10-18 14:21:40.118734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d91e7a2f34'
+down_revision: Union[str, None] = '8b42e6d1c0a5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('codes', sa.Column('campaign', sa.String()))
+    op.create_index('ix_codes_campaign', 'codes', ['campaign'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_codes_campaign', table_name='codes')
+    op.drop_column('codes', 'campaign')
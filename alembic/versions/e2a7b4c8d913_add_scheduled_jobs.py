@@ -0,0 +1,41 @@
+"""add scheduled jobs
+
+Revision ID: e2a7b4c8d913
+Revises: c5d91e7a2f34
+Create Date: 2026-10-18 15:02:11.604521
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a7b4c8d913'
+down_revision: Union[str, None] = 'c5d91e7a2f34'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'scheduled_jobs',
+        sa.Column('name', sa.String(), primary_key=True),
+        sa.Column('cron', sa.String(), nullable=False),
+        sa.Column('next_run_at', sa.DateTime(), nullable=False),
+        sa.Column('locked_by', sa.String()),
+        sa.Column('locked_until', sa.DateTime()),
+        sa.Column('last_started_at', sa.DateTime()),
+        sa.Column('last_finished_at', sa.DateTime()),
+        sa.Column('last_duration', sa.Float()),
+        sa.Column('last_status', sa.String()),
+        sa.Column('last_error', sa.String()),
+        sa.Column('run_count', sa.Integer()),
+        sa.Column('failure_count', sa.Integer()),
+        sa.Column('misfire_count', sa.Integer()),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('scheduled_jobs')
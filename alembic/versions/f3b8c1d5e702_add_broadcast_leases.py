@@ -0,0 +1,28 @@
+"""add broadcast leases
+
+Revision ID: f3b8c1d5e702
+Revises: b81f3d7e4c19
+Create Date: 2026-10-18 19:12:37.480215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b8c1d5e702'
+down_revision: Union[str, None] = 'b81f3d7e4c19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('broadcasts', sa.Column('locked_by', sa.String()))
+    op.add_column('broadcasts', sa.Column('locked_until', sa.DateTime()))
+
+
+def downgrade() -> None:
+    op.drop_column('broadcasts', 'locked_until')
+    op.drop_column('broadcasts', 'locked_by')
@@ -0,0 +1,94 @@
+"""
+Concurrency stress test for payment approvals.
+
+Every pending payment receives --duplicates decisions at once, mostly approvals
+with some denials mixed in, spread over --replicas independent approval
+pipelines as if several admins tapped the buttons on several bot processes
+while Telegram redelivered callbacks. Checks that each payment made exactly one
+transition and that every confirmed payment extended its user's subscription
+exactly once.
+
+    python -m benchmarks.approval_stress --payments 500 --duplicates 8 --workers 64
+    python -m benchmarks.approval_stress --db postgresql://localhost/bench
+"""
+import argparse
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from sqlalchemy.exc import OperationalError
+
+from modules.approvals import ApprovalPipeline
+from modules.database import Database
+from modules.models import Base, User, Payment, Subscription, SubscriptionPlan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='sqlite:///bench_approvals.db')
+    parser.add_argument('--payments', type=int, default=500)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--duplicates', type=int, default=8, help="Decisions fired at every payment")
+    parser.add_argument('--deny-share', type=float, default=0.2)
+    parser.add_argument('--replicas', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=64)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    db = Database(args.db, pool_size=args.workers, max_overflow=0)
+    Base.metadata.drop_all(db.engine)
+    Base.metadata.create_all(db.engine)
+    rng = random.Random(args.seed)
+    with db.session_scope() as session:
+        session.add(SubscriptionPlan(plan_id=1, name='monthly', price=10, duration_days=args.days))
+        session.bulk_insert_mappings(User, [{'user_id': user_id, 'first_name': f'user{user_id}', 'subscription_status': 'inactive'}
+                                            for user_id in range(1, args.users + 1)])
+        session.bulk_insert_mappings(Payment, [
+            {'payment_id': payment_id, 'user_id': rng.randint(1, args.users), 'plan_id': 1, 'amount': 10,
+             'payment_method': 'direct', 'payment_status': 'pending', 'payment_date': date.today()}
+            for payment_id in range(1, args.payments + 1)])
+        session.commit()
+
+    replicas = [ApprovalPipeline(db.session_scope) for _ in range(args.replicas)]
+    decisions = [(payment_id, 'deny' if rng.random() < args.deny_share else 'approve', rng.choice(replicas))
+                 for payment_id in range(1, args.payments + 1) for _ in range(args.duplicates)]
+    rng.shuffle(decisions)
+
+    def decide(payment_id, decision, pipeline):
+        while True:
+            try:
+                return pipeline.decide(payment_id, decision)
+            except OperationalError:
+                # SQLite allows one writer at a time and gives up after its busy timeout; try again
+                time.sleep(0.001)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(lambda decision: decide(*decision), decisions))
+    elapsed = time.perf_counter() - started
+
+    transitions = Counter(result.payment_id for result in results if result.applied)
+    confirmed_by = Counter(result.user_id for result in results if result.applied and result.status == 'confirmed')
+    with db.session_scope() as session:
+        statuses = Counter(status for status, in session.query(Payment.payment_status))
+        ledger = Counter(user_id for user_id, in session.query(Subscription.user_id))
+        expiries = dict(session.query(User.user_id, User.subscription_expiry))
+
+    repeated = [payment_id for payment_id, count in transitions.items() if count > 1]
+    assert not repeated, f"payments decided more than once: {repeated[:10]}"
+    assert len(transitions) == args.payments and statuses['pending'] == 0, statuses
+    assert ledger == confirmed_by, "ledger rows do not match confirmed payments"
+    for user_id, count in confirmed_by.items():
+        assert expiries[user_id] == date.today() + timedelta(days=args.days * count), user_id
+
+    turned_away = sum(replica.stats()['turned_away'] for replica in replicas)
+    print(f"{len(results)} decisions on {args.payments} payments in {elapsed:.2f}s ({len(results) / elapsed:.0f}/s): "
+          f"{statuses['confirmed']} confirmed, {statuses['denied']} denied, each exactly once; "
+          f"{len(results) - args.payments} duplicates rejected, {turned_away} of them without a database round trip")
+
+
+if __name__ == '__main__':
+    main()
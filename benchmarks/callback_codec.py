@@ -0,0 +1,98 @@
+"""
+Callback data decoding: signed struct codec against the legacy string format.
+
+Decodes and dispatches a realistic mix of button presses both ways. The legacy
+path is the old startswith chain with split('_') and int(); the codec path
+verifies the HMAC and looks the handler up by action tag. Also reports the
+size of each button's data against Telegram's 64 byte limit.
+
+    python -m benchmarks.callback_codec --presses 200000
+"""
+import argparse
+import random
+import time
+
+from modules import callbacks
+from modules.callbacks import CallbackRouter, InvalidCallback
+
+
+def legacy_dispatch(data, handlers):
+    # The if/elif chain bot.handle_callback_query used before the router
+    if data.startswith('subscribe_'):
+        handlers['subscribe'](int(data.split('_')[1]))
+    elif data.startswith('pay_online_') or data.startswith('pay_direct_'):
+        payment_method, plan_id = data.split('_')[1:]
+        handlers['pay'](int(plan_id), payment_method)
+    elif data.startswith('approve_') or data.startswith('deny_'):
+        decision, user_id, payment_id = data.split('_')
+        handlers['decision'](int(user_id), int(payment_id), decision)
+    elif data.startswith('delete_'):
+        handlers['delete'](int(data.split('_')[1]))
+
+
+def presses(count, rng):
+    """(action, args, legacy data) for a mix dominated by plan selection."""
+    result = []
+    for _ in range(count):
+        roll = rng.random()
+        plan_id = rng.randint(1, 20)
+        if roll < 0.5:
+            result.append((callbacks.SUBSCRIBE, (plan_id,), f"subscribe_{plan_id}"))
+        elif roll < 0.8:
+            result.append((callbacks.PAY_DIRECT, (plan_id,), f"pay_direct_{plan_id}"))
+        elif roll < 0.98:
+            user_id, payment_id = rng.randint(10 ** 8, 10 ** 10), rng.randint(1, 10 ** 7)
+            result.append((callbacks.APPROVE, (user_id, payment_id), f"approve_{user_id}_{payment_id}"))
+        else:
+            result.append((callbacks.DELETE_PLAN, (plan_id,), f"delete_{plan_id}"))
+    return result
+
+
+def timed(function, items):
+    started = time.perf_counter()
+    for item in items:
+        function(item)
+    elapsed = time.perf_counter() - started
+    return elapsed, len(items) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--presses', type=int, default=200000)
+    parser.add_argument('--mac-size', type=int, default=8)
+    args = parser.parse_args()
+
+    calls = []
+    handlers = {name: lambda *values: calls.append(values) for name in ('subscribe', 'pay', 'decision', 'delete')}
+    router = CallbackRouter('bench-secret', mac_size=args.mac_size)
+    noop = lambda *values: calls.append(values)
+    for action, fields in ((callbacks.SUBSCRIBE, 'i'), (callbacks.PAY_ONLINE, 'i'), (callbacks.PAY_DIRECT, 'i'),
+                           (callbacks.APPROVE, 'qq'), (callbacks.DENY, 'qq'), (callbacks.DELETE_PLAN, 'i')):
+        router.register(action, fields, noop)
+
+    items = presses(args.presses, random.Random(1))
+    legacy = [data for _, _, data in items]
+    signed = [router.encode(action, *values) for action, values, _ in items]
+
+    for (action, values, _), data in zip(items[:1000], signed):
+        assert router.decode(data) == (action, values)
+    forged = signed[0][:-2] + ('AA' if not signed[0].endswith('AA') else 'BB')
+    try:
+        router.decode(forged)
+        raise SystemExit("forged callback data was accepted")
+    except InvalidCallback:
+        pass
+
+    print(f"{'format':<8} {'max bytes':>9} {'mean bytes':>10} {'elapsed':>9} {'presses/s':>12} {'us/press':>9}")
+    for name, data, dispatch in (('legacy', legacy, lambda item: legacy_dispatch(item, handlers)),
+                                 ('signed', signed, router.dispatch)):
+        calls.clear()
+        elapsed, rate = timed(dispatch, data)
+        assert len(calls) == len(data)
+        sizes = [len(item.encode()) for item in data]
+        print(f"{name:<8} {max(sizes):>9} {sum(sizes) / len(sizes):>10.1f} {elapsed:>8.3f}s {rate:>12,.0f} "
+              f"{elapsed / len(data) * 1e6:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Channel enforcement run against the fake Bot API.
+
+Seeds --users users of which --expired-share have lapsed, removes them from
+the channel through bot.py's ban/unban calls and runs the job a second time to
+show it has nothing left to do.
+
+    python -m benchmarks.channel_enforcement --users 100000 --global-rate 30
+"""
+import argparse
+import random
+from datetime import date, timedelta
+
+import telebot
+
+from benchmarks.fake_bot_api import FakeBotApi
+from modules.database import Database
+from modules.dispatcher import OutboundDispatcher, RateLimiter
+from modules.enforcement import ChannelEnforcer
+from modules.models import Base, User
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='sqlite:///bench_enforcement.db')
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--expired-share', type=float, default=0.25)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--global-rate', type=float, default=1000)
+    parser.add_argument('--latency', type=float, default=0.02, help="Fake API round-trip in seconds")
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    Base.metadata.drop_all(db.engine)
+    Base.metadata.create_all(db.engine)
+    rng = random.Random(1)
+    today = date.today()
+    with db.session_scope() as session:
+        for start in range(0, args.users, 10000):
+            session.bulk_insert_mappings(User, [
+                {'user_id': user_id, 'first_name': f'user{user_id}', 'subscription_status': 'active',
+                 'subscription_expiry': today + timedelta(days=rng.randint(-60, -1) if rng.random() < args.expired_share
+                                                          else rng.randint(0, 60))}
+                for user_id in range(start + 1, min(start + 10000, args.users) + 1)
+            ])
+        session.commit()
+        expected = session.query(User).filter(User.subscription_expiry < today).count()
+
+    api = FakeBotApi(latency=args.latency, global_rate=args.global_rate * 1.1).start()
+    telebot.apihelper.API_URL = api.api_url
+    bot = telebot.TeleBot('123456:benchmark', threaded=False)
+
+    def remove(user_id):
+        bot.ban_chat_member(-1001, user_id)
+        bot.unban_chat_member(-1001, user_id, only_if_banned=True)
+
+    outbox = OutboundDispatcher(max_workers=args.workers, limiter=RateLimiter(global_rate=args.global_rate, per_chat_rate=1))
+    enforcer = ChannelEnforcer(db.session_scope)
+    first = enforcer.run(outbox, remove, calls=2)
+    second = enforcer.run(outbox, remove, calls=2)
+    outbox.shutdown()
+    api.stop()
+
+    assert first.removed == first.marked == expected, (first.removed, first.marked, expected)
+    assert second.selected == 0, second.selected
+    print(f"first run:  {first}")
+    print(f"second run: {second}")
+    print(f"API calls: {api.calls}, 429 responses: {api.rate_limited}")
+
+
+if __name__ == '__main__':
+    main()
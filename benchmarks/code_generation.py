@@ -0,0 +1,48 @@
+"""
+Bulk redemption-code generation rate.
+
+Times the chunked generate, uniqueness check, multi-row insert (COPY on
+PostgreSQL with psycopg2) and CSV spooling of CodeBatch.insert, then reading
+the export back.
+
+    python -m benchmarks.code_generation --count 50000
+    python -m benchmarks.code_generation --db postgresql+psycopg2://localhost/bench
+"""
+import argparse
+import time
+
+from modules.codes import CodeBatch
+from modules.database import Database
+from modules.models import Base, Code
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='sqlite:///bench_codes.db')
+    parser.add_argument('--count', type=int, default=50000)
+    parser.add_argument('--days', type=int, default=30)
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    Base.metadata.drop_all(db.engine)
+    Base.metadata.create_all(db.engine)
+
+    batch = CodeBatch(args.count, days=args.days, campaign='benchmark', code_type='campaign')
+    with db.session_scope() as session:
+        started = time.perf_counter()
+        batch.insert(session)
+        inserted = time.perf_counter()
+        export = batch.export().read()
+        exported = time.perf_counter()
+        stored = session.query(Code).filter_by(campaign='benchmark').count()
+
+    assert stored == args.count, stored
+    assert export.count(b'\n') == args.count + 1
+    total = exported - started
+    print(f"{args.count} codes in {total:.2f}s ({args.count / total:.0f} codes/s): "
+          f"generate+check+insert+spool {inserted - started:.2f}s, read export {exported - inserted:.2f}s "
+          f"({len(export) / 1024:.0f} KiB CSV)")
+
+
+if __name__ == '__main__':
+    main()
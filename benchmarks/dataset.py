@@ -0,0 +1,283 @@
+"""
+Deterministic synthetic dataset at production scale.
+
+Generates users with their subscription ledger, payments and expiry reminders,
+redemption codes, plans and admins following the schema in modules/models.py,
+and bulk-loads them: COPY on PostgreSQL through psycopg2, executemany batches
+in one transaction elsewhere. Rows are generated as a stream and written
+--chunk users at a time, so memory stays flat however many millions are
+loaded. The same --seed and --today always produce the same rows.
+
+    python -m benchmarks.dataset --users 1000000 --codes 200000
+    python -m benchmarks.dataset --db postgresql://localhost/bench --users 5000000 --today 2026-01-01
+
+Per user (shares of all users):
+    never subscribed 15%, active 35%, expiring within a week 8%,
+    lapsed up to two years ago 40%, expired but still marked active 2%
+    (what the expiry sweep clears). Subscribers renewed 1 to 12 times, 15% of
+    renewals by a redeemed code, the rest by a confirmed direct payment;
+    4% have a pending payment, half of them with a receipt awaiting approval,
+    1% a denied one. Active users have their 7, 3 and 1 day reminders queued.
+Codes: --codes unused campaign codes, 10% of them already expired, on top of
+    the used codes behind the redemptions above.
+"""
+import argparse
+import csv
+import io
+import random
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import insert, text
+
+from modules.codes import CODE_ALPHABET
+from modules.database import Database
+from modules.models import Base, User, Admin, Payment, Code, Subscription, SubscriptionPlan, SubscriptionReminder
+
+ADMIN_BASE = 10 ** 9  # Admin ids, above every generated user id
+PLANS = [
+    {'plan_id': 1, 'name': 'monthly', 'price': 10, 'duration_days': 30},
+    {'plan_id': 2, 'name': 'quarterly', 'price': 27, 'duration_days': 90},
+    {'plan_id': 3, 'name': 'yearly', 'price': 99, 'duration_days': 365},
+]
+PLAN_WEIGHTS = (0.6, 0.3, 0.1)
+LIFECYCLES = {'never': 0.15, 'active': 0.35, 'expiring': 0.08, 'lapsed': 0.40, 'stale': 0.02}
+REMINDER_OFFSETS = (7, 3, 1)  # days before expiry
+CODE_DAYS = ((7, 30, 90, 365), (0.2, 0.5, 0.2, 0.1))
+CODE_LENGTH = 12
+FIRST_NAMES = ('Ali', 'Sara', 'Reza', 'Maryam', 'John', 'Anna', 'Omid', 'Lena', 'Mohammad', 'Zahra')
+
+
+def code_for(index):
+    """A distinct random-looking code for every index."""
+    # Multiplying by a constant coprime to 36 permutes the 36^12 code space
+    value = index * 0x5DEECE66D % len(CODE_ALPHABET) ** CODE_LENGTH
+    chars = []
+    for _ in range(CODE_LENGTH):
+        value, digit = divmod(value, len(CODE_ALPHABET))
+        chars.append(CODE_ALPHABET[digit])
+    return ''.join(chars)
+
+
+class Dataset:
+    """
+    Row streams for a dataset of a given size.
+
+    customers() yields every user together with its subscriptions, payments,
+    reminders and used codes, so the tables stay consistent with each other
+    without holding more than one user in memory. Each stream draws from its
+    own generator seeded from seed, and ids are assigned in stream order.
+    """
+
+    def __init__(self, users=100000, codes=None, admins=3, seed=1, today=None, pending_share=0.04, receipt_share=0.5,
+                 denied_share=0.01, code_renewal_share=0.15, expired_code_share=0.1):
+        self.users = users
+        self.codes = users // 5 if codes is None else codes
+        self.admins = admins
+        self.seed = seed
+        self.today = today or date.today()
+        self.pending_share = pending_share
+        self.receipt_share = receipt_share
+        self.denied_share = denied_share
+        self.code_renewal_share = code_renewal_share
+        self.expired_code_share = expired_code_share
+
+    def rng(self, stream):
+        return random.Random(f'{self.seed}:{stream}')
+
+    def plan_rows(self):
+        return [dict(plan, subscription_id=None) for plan in PLANS]
+
+    def admin_rows(self):
+        return [{'admin_id': ADMIN_BASE + index, 'username': f'admin{index}', 'first_name': f'Admin{index}',
+                 'last_name': None, 'is_superuser': index == 0} for index in range(self.admins)]
+
+    def customers(self):
+        """Yield (user, subscriptions, payments, reminders, codes) for every user, in user_id order."""
+        rng = self.rng('customers')
+        today, now = self.today, datetime.combine(self.today, datetime.min.time()) + timedelta(hours=12)
+        lifecycles, lifecycle_weights = list(LIFECYCLES), list(LIFECYCLES.values())
+        payment_ids = iter(range(1, 2 ** 62))
+        code_indices = iter(range(0, 2 ** 62, 2))  # odd indices are the unused codes
+        for user_id in range(1, self.users + 1):
+            lifecycle = rng.choices(lifecycles, lifecycle_weights)[0]
+            if lifecycle == 'never':
+                expiry = None
+            elif lifecycle == 'active':
+                expiry = today + timedelta(days=rng.randint(8, 365))
+            elif lifecycle == 'expiring':
+                expiry = today + timedelta(days=rng.randint(0, 7))
+            elif lifecycle == 'lapsed':
+                expiry = today - timedelta(days=rng.randint(1, 720))
+            else:
+                expiry = today - timedelta(days=rng.randint(1, 30))
+            user = {
+                'user_id': user_id,
+                'username': f'user{user_id}' if rng.random() < 0.7 else None,
+                'first_name': rng.choice(FIRST_NAMES),
+                'last_name': f'L{user_id}' if rng.random() < 0.5 else None,
+                'subscription_status': None if expiry is None else 'active' if lifecycle != 'lapsed' else 'inactive',
+                'subscription_expiry': expiry,
+            }
+
+            subscriptions, payments, reminders, codes = [], [], [], []
+            # Walk the renewals back from the current expiry
+            end = expiry
+            for _ in range(0 if expiry is None else min(12, 1 + int(rng.expovariate(0.7)))):
+                if rng.random() < self.code_renewal_share:
+                    days = rng.choices(*CODE_DAYS)[0]
+                    start = end - timedelta(days=days)
+                    subscriptions.append({'user_id': user_id, 'plan_type': 'code', 'start_date': start, 'end_date': end,
+                                          'payment_status': 'redeemed'})
+                    codes.append({'code': code_for(next(code_indices)), 'code_type': 'campaign', 'associated_days': days,
+                                  'discount_amount': None, 'expiry_date': None, 'used_status': True, 'user_id': user_id,
+                                  'campaign': f'campaign{start.year}'})
+                else:
+                    plan = rng.choices(PLANS, PLAN_WEIGHTS)[0]
+                    start = end - timedelta(days=plan['duration_days'])
+                    subscriptions.append({'user_id': user_id, 'plan_type': plan['name'], 'start_date': start, 'end_date': end,
+                                          'payment_status': 'confirmed'})
+                    payments.append(self.payment(next(payment_ids), user_id, plan, 'confirmed', start, rng))
+                end = start
+            subscriptions.reverse()
+            payments.reverse()
+
+            if rng.random() < self.denied_share:
+                payments.append(self.payment(next(payment_ids), user_id, rng.choices(PLANS, PLAN_WEIGHTS)[0], 'denied',
+                                             today - timedelta(days=rng.randint(1, 365)), rng))
+            if rng.random() < self.pending_share:
+                payment = self.payment(next(payment_ids), user_id, rng.choices(PLANS, PLAN_WEIGHTS)[0], 'pending',
+                                       today - timedelta(days=rng.randint(0, 3)), rng)
+                if rng.random() >= self.receipt_share:
+                    payment['receipt_message_id'] = None
+                payments.append(payment)
+
+            if expiry is not None and expiry >= today:
+                for offset in REMINDER_OFFSETS:
+                    due_at = datetime.combine(expiry, datetime.min.time()) - timedelta(days=offset)
+                    reminders.append({'user_id': user_id, 'expiry': expiry, 'offset_days': offset, 'due_at': due_at,
+                                      'sent_at': due_at if due_at <= now else None})
+            yield user, subscriptions, payments, reminders, codes
+
+    @staticmethod
+    def payment(payment_id, user_id, plan, status, payment_date, rng):
+        # Every direct payment came with a receipt, its message id is unique like the payment
+        return {'payment_id': payment_id, 'user_id': user_id, 'plan_id': plan['plan_id'], 'amount': plan['price'],
+                'payment_method': 'direct', 'payment_status': status, 'payment_date': payment_date,
+                'admin_approval_message_id': None, 'receipt_info': None, 'receipt_message_id': payment_id}
+
+    def unused_codes(self):
+        """Yield the campaign codes nobody redeemed yet."""
+        rng = self.rng('codes')
+        for index in range(self.codes):
+            roll = rng.random()
+            if roll < self.expired_code_share:
+                expiry_date = self.today - timedelta(days=rng.randint(1, 180))
+            elif roll < self.expired_code_share + 0.2:
+                expiry_date = self.today + timedelta(days=rng.randint(1, 180))
+            else:
+                expiry_date = None
+            yield {'code': code_for(2 * index + 1), 'code_type': 'campaign', 'associated_days': rng.choices(*CODE_DAYS)[0],
+                   'discount_amount': None, 'expiry_date': expiry_date, 'used_status': False, 'user_id': None,
+                   'campaign': f'campaign{index // 10000:03d}'}
+
+
+def copy_rows(connection, table, rows):
+    """Write rows with COPY ... FROM STDIN, psycopg2 only."""
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if row[column] is None else row[column] for column in columns])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def load(db, dataset, chunk=20000, analyze=True):
+    """
+    Stream dataset into the (empty) tables of db in one transaction.
+
+    Returns the number of rows written per table.
+    """
+    counts = Counter()
+    with db.engine.begin() as connection:
+        if connection.dialect.driver == 'psycopg2':
+            def write(model, rows):
+                if rows:
+                    copy_rows(connection, model.__table__, rows)
+                    counts[model.__tablename__] += len(rows)
+        else:
+            def write(model, rows):
+                if rows:
+                    connection.execute(insert(model), rows)
+                    counts[model.__tablename__] += len(rows)
+
+        write(SubscriptionPlan, dataset.plan_rows())
+        write(Admin, dataset.admin_rows())
+        # Parents before children, one chunk of users at a time
+        batches = ([], [], [], [], [])
+        models = (User, Subscription, Payment, SubscriptionReminder, Code)
+        for rows in dataset.customers():
+            for batch, row in zip(batches, rows):
+                if isinstance(row, list):
+                    batch.extend(row)
+                else:
+                    batch.append(row)
+            if len(batches[0]) >= chunk:
+                for model, batch in zip(models, batches):
+                    write(model, batch)
+                    batch.clear()
+        for model, batch in zip(models, batches):
+            write(model, batch)
+
+        batch = []
+        for row in dataset.unused_codes():
+            batch.append(row)
+            if len(batch) >= chunk:
+                write(Code, batch)
+                batch.clear()
+        write(Code, batch)
+
+        if connection.dialect.name == 'postgresql':
+            # Payment ids were given explicitly, move the sequence past them for the bots' own inserts
+            connection.execute(text("SELECT setval(pg_get_serial_sequence('payments', 'payment_id'), "
+                                    "GREATEST((SELECT max(payment_id) FROM payments), 1))"))
+        if analyze:
+            connection.execute(text('ANALYZE'))
+    return counts
+
+
+def reset(db):
+    Base.metadata.drop_all(db.engine)
+    Base.metadata.create_all(db.engine)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='sqlite:///bench_dataset.db')
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--codes', type=int, help="Unused codes, a fifth of --users by default")
+    parser.add_argument('--admins', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--today', type=date.fromisoformat, help="Date the dataset is generated around, YYYY-MM-DD")
+    parser.add_argument('--chunk', type=int, default=20000, help="Users written per batch")
+    parser.add_argument('--keep', action='store_true', help="Append to the existing tables instead of recreating them")
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    if not args.keep:
+        reset(db)
+    started = time.perf_counter()
+    counts = load(db, Dataset(args.users, codes=args.codes, admins=args.admins, seed=args.seed, today=args.today),
+                  chunk=args.chunk)
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    for table, count in counts.items():
+        print(f"{table:<24} {count:>12,}")
+    print(f"{total:,} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
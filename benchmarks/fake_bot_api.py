@@ -0,0 +1,130 @@
+"""
+Minimal stand-in for the Telegram Bot API used by the benchmarks.
+
+Answers every method with a plausible "ok" result, optionally adds latency and
+returns 429 with retry_after once the configured global rate is exceeded, like
+Telegram does. Updates pushed with add_updates() are served by getUpdates for
+long-polling clients.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeBotApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_method()
+
+    def do_POST(self):
+        self.handle_method()
+
+    def handle_method(self):
+        server = self.server
+        url = urlparse(self.path)
+        method = url.path.rsplit('/', 1)[-1]
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = self.rfile.read(length)
+            if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+                params.update({key: values[0] for key, values in parse_qs(body.decode()).items()})
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        retry_after = server.take_token()
+        if retry_after:
+            self.reply(429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests',
+                             'parameters': {'retry_after': retry_after}})
+            return
+        self.reply(200, {'ok': True, 'result': server.result_for(method, params)})
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeBotApi(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, global_rate=None):
+        super().__init__((host, port), FakeBotApiHandler)
+        self.latency = latency
+        self.global_rate = global_rate
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.rate_limited = 0
+        self.message_id = 0
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.updates = []
+        self.updates_ready = threading.Condition(self.lock)
+
+    @property
+    def api_url(self):
+        """Value for telebot.apihelper.API_URL pointing at this server."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    def add_updates(self, updates):
+        with self.updates_ready:
+            self.updates.extend(updates)
+            self.updates_ready.notify_all()
+
+    def get_updates(self, params):
+        offset = int(params.get('offset', 0) or 0)
+        limit = int(params.get('limit', 100) or 100)
+        timeout = float(params.get('timeout', 0) or 0)
+        with self.updates_ready:
+            # Confirmed updates are the ones below the requested offset
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            if not self.updates and timeout:
+                self.updates_ready.wait(min(timeout, 1))
+            return self.updates[:limit]
+
+    def take_token(self):
+        with self.lock:
+            if not self.global_rate:
+                return 0
+            now = time.monotonic()
+            if now - self.window_start >= 1:
+                self.window_start, self.window_count = now, 0
+            if self.window_count >= self.global_rate:
+                self.rate_limited += 1
+                return 1
+            self.window_count += 1
+            return 0
+
+    def result_for(self, method, params):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.message_id += 1
+            message_id = self.message_id
+        if method == 'getUpdates':
+            return self.get_updates(params)
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if method in ('answerCallbackQuery', 'deleteWebhook', 'setWebhook', 'banChatMember', 'unbanChatMember'):
+            return True
+        chat_id = int(params.get('chat_id', 0) or 0)
+        return {'message_id': message_id, 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='fake-bot-api', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,77 @@
+"""
+Stand-in for the Telethon client and its events used by the benchmarks.
+
+Implements the client methods the bot calls (send_message, send_file,
+edit_message, upload_file, get_input_entity, kick_participant) as coroutines
+that sleep for a configurable round-trip latency and return message-like
+objects, so telethon_bot.Bot runs unchanged without an MTProto connection.
+Events are built with the attributes the bot's handlers read.
+"""
+import asyncio
+import itertools
+import threading
+from types import SimpleNamespace
+
+
+class StubTelegramClient:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.message_ids = itertools.count(1)
+        self.handlers = []
+
+    async def _call(self, method, chat_id=None):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return SimpleNamespace(id=next(self.message_ids), chat_id=chat_id)
+
+    async def send_message(self, entity, message='', **kwargs):
+        return await self._call('send_message', entity)
+
+    async def send_file(self, entity, file, **kwargs):
+        return await self._call('send_file', entity)
+
+    async def edit_message(self, entity, message=None, text=None, **kwargs):
+        return await self._call('edit_message', entity)
+
+    async def upload_file(self, file, **kwargs):
+        return await self._call('upload_file')
+
+    async def get_input_entity(self, peer):
+        # Every user counts as cached, resolving is a local lookup in Telethon too
+        return SimpleNamespace(user_id=peer)
+
+    async def kick_participant(self, entity, user):
+        return await self._call('kick_participant', entity)
+
+    async def start(self, **kwargs):
+        return self
+
+    def on(self, builder):
+        def register(callback):
+            self.handlers.append((builder, callback))
+            return callback
+        return register
+
+
+class StubEvent:
+    """A NewMessage or CallbackQuery event as far as the bot's handlers look at it."""
+
+    def __init__(self, client, sender_id, raw_text='', data=None, media=None, message_id=1, first_name='bench', username=None):
+        self.client = client
+        self.sender_id = self.chat_id = sender_id
+        self.chat = SimpleNamespace(id=sender_id, first_name=first_name, username=username)
+        self.raw_text = raw_text
+        self.data = data.encode() if isinstance(data, str) else data
+        self.message = SimpleNamespace(id=message_id, media=media)
+        self.photo = media
+        self.query = SimpleNamespace(msg_id=message_id)
+
+    async def respond(self, message='', **kwargs):
+        return await self.client.send_message(self.chat_id, message, **kwargs)
+
+    async def answer(self, message=None, **kwargs):
+        return await self.client._call('answer_callback_query', self.chat_id)
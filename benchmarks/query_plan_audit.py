@@ -0,0 +1,134 @@
+"""
+EXPLAIN audit of the bots' hot queries.
+
+Loads the synthetic dataset from benchmarks/dataset.py (700k users and about
+1M payments by default), runs every hot lookup once while capturing the SQL it
+sends, and EXPLAINs each statement. Exits with status 1 when any of them scans
+a large table sequentially, so it can gate schema and query changes.
+
+    python -m benchmarks.query_plan_audit
+    python -m benchmarks.query_plan_audit --db postgresql://localhost/bench --users 2000000
+"""
+import argparse
+import sys
+import time
+from datetime import date, datetime
+
+from sqlalchemy import event
+
+from benchmarks.dataset import Dataset, code_for, load, reset
+from modules.approvals import attach_receipt, decide_payment
+from modules.broadcast import BroadcastEngine
+from modules.database import Database
+from modules.enforcement import ChannelEnforcer
+from modules.reminders import ReminderQueue
+from modules.status_cache import load_status
+from modules.subscriptions import redeem_code
+from modules.sweep import ExpirySweep
+
+# Small configuration tables that are always read whole
+SMALL_TABLES = {'admins', 'subscription_plans', 'scheduled_jobs', 'broadcasts'}
+
+
+def hot_paths(db, users):
+    """(name, callable) pairs reproducing the bots' per-request and per-job queries."""
+    today = date.today()
+    user_id = users // 2
+
+    def receipt_upload():
+        # Receipt photos in both bots, rolled back so the dataset is left as it was
+        with db.session_scope() as session:
+            attach_receipt(session, user_id, 12345)
+            session.flush()
+            session.rollback()
+
+    def payment_approval():
+        # Admin decisions in both bots, see modules/approvals.py
+        with db.session_scope() as session:
+            decide_payment(session, 12345, 'approve')
+            decide_payment(session, 12345, 'approve')
+
+    def status():
+        with db.session_scope() as session:
+            load_status(session, user_id)
+
+    def redemption():
+        with db.session_scope() as session:
+            redeem_code(session, code_for(1), user_id)
+
+    def expiry_sweep_page():
+        next(ExpirySweep(db.session_scope, page_size=100).iter_pages(today))
+
+    def enforcement_page():
+        enforcer = ChannelEnforcer(db.session_scope, page_size=100)
+        rows = enforcer.next_page(None, today)
+        enforcer.next_page((rows[-1].subscription_expiry, rows[-1].user_id), today)
+
+    def reminder_claim():
+        ReminderQueue(db.session_scope, batch_size=100).claim(datetime.utcnow())
+
+    def broadcast_page():
+        BroadcastEngine(db.session_scope, None, None, page_size=100).next_page(1, user_id)
+
+    return [(function.__name__, function) for function in (
+        receipt_upload, payment_approval, status, redemption,
+        expiry_sweep_page, enforcement_page, reminder_claim, broadcast_page)]
+
+
+def sequential_scans(connection, statement, parameters):
+    """Explain one statement and return the large tables it scans sequentially."""
+    if connection.dialect.name == 'sqlite':
+        plan = [row[-1] for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+        scans = [line.split()[1] for line in plan if line.startswith('SCAN ') and ' USING ' not in line]
+    else:
+        plan = [row[0] for row in connection.exec_driver_sql('EXPLAIN ' + statement, parameters)]
+        scans = [line.split('Seq Scan on ')[1].split()[0] for line in plan if 'Seq Scan on ' in line]
+    return [table for table in scans if table not in SMALL_TABLES and table != 'CONSTANT'], plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='sqlite:///bench_query_plans.db')
+    parser.add_argument('--users', type=int, default=700000)
+    parser.add_argument('--verbose', action='store_true', help="Print every plan")
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    reset(db)
+    started = time.perf_counter()
+    counts = load(db, Dataset(args.users))
+    print(f"seeded {counts['users']} users and {counts['payments']} payments in {time.perf_counter() - started:.1f}s")
+
+    captured = []
+
+    def capture(connection, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().split()[0].upper() in ('SELECT', 'UPDATE', 'DELETE'):
+            captured.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    failures = 0
+    for name, function in hot_paths(db, args.users):
+        captured.clear()
+        function()
+        statements = list(captured)
+        failed = False
+        with db.engine.connect() as connection:
+            for statement, parameters in statements:
+                scans, plan = sequential_scans(connection, statement, parameters)
+                if scans or args.verbose:
+                    print(f"  {'sequential scan of ' + ', '.join(scans) if scans else 'plan'}: {' '.join(statement.split())[:160]}")
+                    for line in plan:
+                        print(f"      {line}")
+                failed = failed or bool(scans)
+        failures += failed
+        print(f"{'FAIL' if failed else 'ok':<5} {name} ({len(statements)} statements)")
+    event.remove(db.engine, 'before_cursor_execute', capture)
+
+    if failures:
+        print(f"{failures} hot paths scan a large table sequentially")
+        sys.exit(1)
+    print("no sequential scans on large tables")
+
+
+if __name__ == '__main__':
+    main()
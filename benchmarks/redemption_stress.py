@@ -0,0 +1,88 @@
+"""
+Concurrency stress test for code redemption.
+
+Fires --redemptions parallel redemptions of a small pool of redeemable codes,
+on top of a synthetic dataset (see benchmarks/dataset.py), from many users and
+checks that every code was spent at most once and that each successful
+redemption extended the user's subscription by exactly the code's days.
+
+    python -m benchmarks.redemption_stress --codes 200 --redemptions 5000 --workers 64
+    python -m benchmarks.redemption_stress --db postgresql://localhost/bench
+"""
+import argparse
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from sqlalchemy import or_
+from sqlalchemy.exc import OperationalError
+
+from benchmarks.dataset import Dataset, load, reset
+from modules.database import Database
+from modules.models import Code, User
+from modules.subscriptions import redeem_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='sqlite:///bench_redemption.db')
+    parser.add_argument('--codes', type=int, default=200)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--redemptions', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    db = Database(args.db, pool_size=args.workers, max_overflow=0)
+    reset(db)
+    today = date.today()
+    load(db, Dataset(args.users, codes=args.codes * 2, seed=args.seed, today=today))
+    with db.session_scope() as session:
+        days = dict(session.query(Code.code, Code.associated_days)
+                    .filter(Code.used_status.is_(False), or_(Code.expiry_date.is_(None), Code.expiry_date >= today))
+                    .order_by(Code.code).limit(args.codes))
+        used_before = session.query(Code).filter_by(used_status=True).count()
+        expiries_before = dict(session.query(User.user_id, User.subscription_expiry))
+
+    rng = random.Random(args.seed)
+    pool = sorted(days)
+    attempts = [(rng.choice(pool), rng.randint(1, args.users)) for _ in range(args.redemptions)]
+
+    def attempt(code, user_id):
+        while True:
+            try:
+                with db.session_scope() as session:
+                    return code, user_id, redeem_code(session, code, user_id)
+            except OperationalError:
+                # SQLite allows one writer at a time and gives up after its busy timeout; try again
+                time.sleep(0.001)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(lambda pair: attempt(*pair), attempts))
+    elapsed = time.perf_counter() - started
+
+    wins = Counter(code for code, _, redemption in results if redemption)
+    extended = Counter()
+    for code, user_id, redemption in results:
+        if redemption:
+            extended[user_id] += days[code]
+    with db.session_scope() as session:
+        used = session.query(Code).filter_by(used_status=True).count() - used_before
+        expiries = dict(session.query(User.user_id, User.subscription_expiry))
+
+    double_spent = [code for code, count in wins.items() if count > 1]
+    assert not double_spent, f"double spends: {double_spent[:10]}"
+    assert used == sum(wins.values()) == len(set(code for code, _ in attempts)), (used, sum(wins.values()))
+    for user_id, total in extended.items():
+        start = max(expiries_before[user_id] or today, today)
+        assert expiries[user_id] == start + timedelta(days=total), user_id
+
+    print(f"{args.redemptions} redemptions over {len(pool)} codes in {elapsed:.2f}s "
+          f"({args.redemptions / elapsed:.0f}/s): {used} codes spent once each, no double spends")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+/status lookup latency under a steady request rate.
+
+Requests arrive open-loop at --rate per second (latency is measured from the
+scheduled arrival, so queueing counts) and are served by a worker pool, either
+straight from the database or through the read-through status cache. Users
+come from the synthetic dataset in benchmarks/dataset.py.
+
+    python -m benchmarks.status_latency --users 100000 --rate 1000 --seconds 10
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.dataset import Dataset, load, reset
+from modules.database import Database
+from modules.status_cache import StatusCache, load_status, status_reply
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+def drive(lookup, user_ids, rate, workers):
+    latencies = []
+    lock = threading.Lock()
+
+    def serve(user_id, due):
+        status_reply(lookup(user_id))
+        with lock:
+            latencies.append(time.perf_counter() - due)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        started = time.perf_counter()
+        for n, user_id in enumerate(user_ids):
+            due = started + n / rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(serve, user_id, due)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='sqlite:///bench_status.db')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--rate', type=float, default=1000)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=16)
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    reset(db)
+    load(db, Dataset(args.users))
+    rng = random.Random(1)
+
+    # Most /status traffic comes from a small set of active users
+    hot = max(1, args.users // 10)
+    user_ids = [rng.randint(1, hot) if rng.random() < 0.8 else rng.randint(1, args.users)
+                for _ in range(int(args.rate * args.seconds))]
+
+    def uncached(user_id):
+        with db.session_scope() as session:
+            return load_status(session, user_id)
+
+    cache = StatusCache(db.session_scope)
+    for name, lookup in (('database', uncached), ('cached', cache.get)):
+        latencies = drive(lookup, user_ids, args.rate, args.workers)
+        print(f"{name:>8}: {len(latencies)} requests at {args.rate:.0f}/s, "
+              f"p50={percentile(latencies, 0.5) * 1000:.2f}ms p99={percentile(latencies, 0.99) * 1000:.2f}ms "
+              f"max={max(latencies) * 1000:.2f}ms")
+    print(f"cache: {cache.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,401 @@
+"""
+End-to-end benchmark suite for both bot front-ends.
+
+Runs synthetic traffic mixes through the real handlers of bot.py (against the
+fake Bot API) and telethon_bot.py (against the stub Telethon client) on a
+fresh copy of the synthetic dataset from benchmarks/dataset.py, and reports
+throughput and p50/p99 latency per handler. Results are written as JSON so
+runs can be compared commit to commit.
+
+    python -m benchmarks.suite
+    python -m benchmarks.suite --frontend telebot --scenario mixed --ops 5000 --concurrency 32
+    python -m benchmarks.suite --db postgresql://localhost/bench --api-latency 0.05 --output after.json --compare before.json
+
+The outbound dispatcher's rate limits default to values high enough to stay
+out of the way, so the numbers show the bot rather than Telegram's limits;
+pass --global-rate 30 --per-chat-rate 1 to run with the production limits.
+
+Scenarios:
+    start_storm   /start from new and returning users
+    subscribe     /subscribe, plan choice and direct payment callbacks
+    receipts      receipt photos for pending payments, fanned out to the admins
+    approvals     admin approvals of receipts
+    redemptions   code redemptions
+    mixed         all of the above plus /status
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+from sqlalchemy import or_
+
+# modules.params reads the token once on import and bot.py builds its TeleBot from it,
+# so a dummy one has to be in place before the first project import
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:bench')
+
+from benchmarks.dataset import ADMIN_BASE, PLANS, Dataset, load, reset
+from modules import callbacks
+from modules.database import get_database
+from modules.dispatcher import RateLimiter
+from modules.metrics import counting_queries, watch_engine
+from modules.models import Payment, Code
+
+# Share of each kind of operation per scenario
+SCENARIOS = {
+    'start_storm': {'start': 1.0},
+    'subscribe': {'subscribe': 1.0},
+    'receipts': {'receipt': 1.0},
+    'approvals': {'approval': 1.0},
+    'redemptions': {'redemption': 1.0},
+    'mixed': {'start': 0.25, 'status': 0.3, 'subscribe': 0.15, 'receipt': 0.1, 'approval': 0.05, 'redemption': 0.15},
+}
+
+BOT_TOKEN = os.environ['TELEGRAM_TOKEN']
+PLAN_IDS = tuple(plan['plan_id'] for plan in PLANS)
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+def seed(db, args):
+    """
+    Load the synthetic dataset with enough pending payments and codes for --ops
+    operations of each kind, and return what the operations draw from: users
+    with a pending payment awaiting a receipt, payments awaiting approval and
+    redeemable codes.
+    """
+    reset(db)
+    today = date.today()
+    load(db, Dataset(args.users, codes=args.ops * 3 // 2 + 10, admins=args.admins, seed=args.seed, today=today,
+                     pending_share=min(1.0, 2.5 * args.ops / args.users)))
+    with db.session_scope() as session:
+        pending = session.query(Payment.payment_id, Payment.user_id, Payment.receipt_message_id) \
+            .filter_by(payment_status='pending').order_by(Payment.payment_id).limit(args.ops * 5).all()
+        codes = [code for code, in session.query(Code.code)
+                 .filter(Code.used_status.is_(False), or_(Code.expiry_date.is_(None), Code.expiry_date >= today))
+                 .order_by(Code.code).limit(args.ops)]
+    return {'receipt_users': [user_id for _, user_id, receipt in pending if receipt is None][:args.ops],
+            'approvals': [(payment_id, user_id) for payment_id, user_id, receipt in pending if receipt is not None][:args.ops],
+            'codes': codes}
+
+
+def plan_operations(scenario, count, users, resources, rng):
+    """(kind, arguments) for every operation, in the order they are issued."""
+    weights = SCENARIOS[scenario]
+    taken = Counter()
+    operations = []
+    for kind in rng.choices(list(weights), weights=list(weights.values()), k=count):
+        index = taken[kind]
+        taken[kind] += 1
+        if kind == 'start':
+            # Half of the storm are new users registering
+            user_id = users + index + 1 if index % 2 == 0 else rng.randint(1, users)
+            operations.append((kind, (user_id,)))
+        elif kind in ('status', 'subscribe'):
+            operations.append((kind, (rng.randint(1, users),)))
+        elif kind == 'receipt':
+            operations.append((kind, (resources['receipt_users'][index % len(resources['receipt_users'])],)))
+        elif kind == 'approval':
+            # A shortfall wraps around, the repeated decisions take the already-decided path
+            payment_id, user_id = resources['approvals'][index % len(resources['approvals'])]
+            operations.append((kind, (ADMIN_BASE, user_id, payment_id)))
+        elif kind == 'redemption':
+            operations.append((kind, (resources['codes'][index % len(resources['codes'])], rng.randint(1, users))))
+    return operations
+
+
+class TelebotFrontend:
+    """Drives bot.py's handlers with telebot Updates on a thread pool; the Bot API is the fake server."""
+
+    name = 'telebot'
+
+    def __init__(self, db_url, api_latency, limiter):
+        import telebot
+        from benchmarks.fake_bot_api import FakeBotApi
+        from bot import Bot
+        self.types = telebot.types
+        self.api = FakeBotApi(latency=api_latency).start()
+        telebot.apihelper.API_URL = self.api.api_url
+        self.bot = Bot(bot=telebot.TeleBot(BOT_TOKEN), db_uri=db_url)
+        self.bot.outbox.limiter = limiter
+        self.bot.setup_handlers()
+        # Handle each update inline on the calling thread, like one shard does
+        self.process = self.bot.update_scheduler.process
+        self.update_ids = itertools.count(1)
+
+    def message(self, user_id, text=None, photo=False):
+        payload = {'message_id': next(self.update_ids), 'date': int(time.time()),
+                   'chat': {'id': user_id, 'type': 'private'},
+                   'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}}
+        if photo:
+            payload['photo'] = [{'file_id': f'receipt{user_id}', 'file_unique_id': f'r{user_id}', 'width': 800, 'height': 600}]
+        else:
+            payload['text'] = text
+            if text.startswith('/'):
+                payload['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return self.types.Update.de_json({'update_id': next(self.update_ids), 'message': payload})
+
+    def callback(self, user_id, data):
+        return self.types.Update.de_json({'update_id': next(self.update_ids), 'callback_query': {
+            'id': str(next(self.update_ids)), 'chat_instance': 'bench', 'data': data,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'message': {'message_id': 1, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'}}}})
+
+    def steps(self, kind, arguments):
+        """(handler, update) pairs making up one operation."""
+        encode = self.bot.callbacks.encode
+        if kind == 'start':
+            return [('send_welcome', self.message(arguments[0], '/start'))]
+        if kind == 'status':
+            return [('check_status', self.message(arguments[0], '/status'))]
+        if kind == 'subscribe':
+            user_id, plan_id = arguments[0], PLAN_IDS[arguments[0] % len(PLAN_IDS)]
+            return [('subscribe', self.message(user_id, '/subscribe')),
+                    ('subscribe_callback', self.callback(user_id, encode(callbacks.SUBSCRIBE, plan_id))),
+                    ('payment_method_callback', self.callback(user_id, encode(callbacks.PAY_DIRECT, plan_id)))]
+        if kind == 'receipt':
+            return [('handle_photo', self.message(arguments[0], photo=True))]
+        if kind == 'approval':
+            admin_id, user_id, payment_id = arguments
+            return [('handle_admin_decision', self.callback(admin_id, encode(callbacks.APPROVE, user_id, payment_id)))]
+        if kind == 'redemption':
+            code, user_id = arguments
+            return [('redeem_code', self.message(user_id, '/redeem')), ('process_redeem_code', self.message(user_id, code))]
+
+    def run(self, operations, concurrency, record):
+        def run_operation(operation):
+            for handler, update in self.steps(*operation):
+                with counting_queries() as queries:
+                    started = time.perf_counter()
+                    try:
+                        self.process([update])
+                        error = None
+                    except Exception as e:
+                        error = e
+                    record(handler, time.perf_counter() - started, queries[0], error)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(run_operation, operations))
+        self.bot.outbox.shutdown(wait=True)
+
+    def api_calls(self):
+        return dict(self.api.calls)
+
+    def close(self):
+        self.bot.update_scheduler.stop()
+        self.api.stop()
+
+
+class TelethonFrontend:
+    """Drives telethon_bot.py's handlers with stub events on one event loop; the client is the stub."""
+
+    name = 'telethon'
+
+    def __init__(self, db_url, api_latency, limiter):
+        from benchmarks.fake_telethon import StubTelegramClient, StubEvent
+        from telethon_bot import Bot
+        self.client = StubTelegramClient(latency=api_latency)
+        self.event = StubEvent
+        self.bot = Bot(api_id=1, api_hash='bench', token=BOT_TOKEN, db_uri=db_url, client=self.client)
+        self.bot.outbox.limiter = limiter
+        self.message_ids = itertools.count(1)
+
+    def make_event(self, user_id, **kwargs):
+        return self.event(self.client, user_id, message_id=next(self.message_ids), **kwargs)
+
+    def steps(self, kind, arguments):
+        """(handler, coroutine function, event) triples making up one operation."""
+        bot, encode = self.bot, self.bot.callbacks.encode
+        if kind == 'start':
+            return [('send_welcome', bot.send_welcome, self.make_event(arguments[0], raw_text='/start'))]
+        if kind == 'status':
+            return [('check_status', bot.handle_check_status, self.make_event(arguments[0], raw_text='/status'))]
+        if kind == 'subscribe':
+            user_id, plan_id = arguments[0], PLAN_IDS[arguments[0] % len(PLAN_IDS)]
+            return [('subscribe', bot.handle_subscribe, self.make_event(user_id, raw_text='/subscribe')),
+                    ('subscribe_callback', bot.handle_callback_query, self.make_event(user_id, data=encode(callbacks.SUBSCRIBE, plan_id))),
+                    ('payment_method_callback', bot.handle_callback_query, self.make_event(user_id, data=encode(callbacks.PAY_DIRECT, plan_id)))]
+        if kind == 'receipt':
+            return [('handle_photo', bot.handle_receipt_photo, self.make_event(arguments[0], media=object()))]
+        if kind == 'approval':
+            admin_id, user_id, payment_id = arguments
+            return [('handle_admin_decision', bot.handle_callback_query,
+                     self.make_event(admin_id, data=encode(callbacks.APPROVE, user_id, payment_id)))]
+        if kind == 'redemption':
+            code, user_id = arguments
+            return [('redeem_code', bot.redeem_code, self.make_event(user_id, raw_text=f'/redeem {code}'))]
+
+    def run(self, operations, concurrency, record):
+        async def drive():
+            pending = iter(operations)
+
+            async def worker():
+                for operation in pending:
+                    for handler, coroutine, event in self.steps(*operation):
+                        with counting_queries() as queries:
+                            started = time.perf_counter()
+                            try:
+                                await coroutine(event)
+                                error = None
+                            except Exception as e:
+                                error = e
+                            record(handler, time.perf_counter() - started, queries[0], error)
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            # Let background sends such as the receipt fan-out finish
+            background = asyncio.all_tasks() - {asyncio.current_task()}
+            await asyncio.gather(*background, return_exceptions=True)
+
+        asyncio.run(drive())
+
+    def api_calls(self):
+        return dict(self.client.calls)
+
+    def close(self):
+        self.bot.adb.shutdown(wait=True)
+
+
+FRONTENDS = {'telebot': TelebotFrontend, 'telethon': TelethonFrontend}
+
+
+def run_scenario(frontend_name, scenario, args):
+    rng = random.Random(args.seed)
+    db = get_database(args.db)
+    watch_engine(db.engine)
+    resources = seed(db, args)
+    operations = plan_operations(scenario, args.ops, args.users, resources, rng)
+    limiter = RateLimiter(global_rate=args.global_rate, per_chat_rate=args.per_chat_rate)
+    frontend = FRONTENDS[frontend_name](args.db, args.api_latency, limiter)
+
+    latencies = defaultdict(list)
+    queries = Counter()
+    errors = Counter()
+    lock = threading.Lock()
+
+    def record(handler, seconds, statements, error):
+        with lock:
+            latencies[handler].append(seconds)
+            queries[handler] += statements
+            if error is not None:
+                errors[handler] += 1
+                if errors[handler] == 1:
+                    logging.error(f"{frontend_name} {handler} failed: {error!r}")
+
+    started = time.perf_counter()
+    try:
+        frontend.run(operations, args.concurrency, record)
+    finally:
+        elapsed = time.perf_counter() - started
+        api_calls = frontend.api_calls()
+        frontend.close()
+
+    handlers = {}
+    for handler, values in sorted(latencies.items()):
+        handlers[handler] = {
+            'count': len(values),
+            'errors': errors[handler],
+            'throughput': len(values) / elapsed,
+            'p50_ms': percentile(values, 0.5) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+            'max_ms': max(values) * 1000,
+            'db_queries_per_update': queries[handler] / len(values),
+        }
+    return {
+        'frontend': frontend_name,
+        'scenario': scenario,
+        'operations': len(operations),
+        'updates': sum(len(values) for values in latencies.values()),
+        'elapsed_s': elapsed,
+        'throughput': len(operations) / elapsed,
+        'errors': sum(errors.values()),
+        'handlers': handlers,
+        'api_calls': api_calls,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result):
+    print(f"\n{result['frontend']} / {result['scenario']}: {result['operations']} operations, {result['updates']} updates "
+          f"in {result['elapsed_s']:.2f}s ({result['throughput']:.0f} ops/s), {result['errors']} errors")
+    print(f"  {'handler':<26} {'count':>7} {'upd/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'queries':>8}")
+    for handler, stats in result['handlers'].items():
+        print(f"  {handler:<26} {stats['count']:>7} {stats['throughput']:>9.0f} {stats['p50_ms']:>9.2f} {stats['p99_ms']:>9.2f} "
+              f"{stats['max_ms']:>9.2f} {stats['db_queries_per_update']:>8.1f}")
+
+
+def compare(previous, current):
+    """Print throughput and p99 changes against an earlier results file."""
+    before = {(run['frontend'], run['scenario']): run for run in previous['runs']}
+    print(f"\nChanges against {previous.get('commit') or 'the previous run'}:")
+    for run in current['runs']:
+        old = before.get((run['frontend'], run['scenario']))
+        if old is None:
+            continue
+        print(f"  {run['frontend']} / {run['scenario']}: throughput {_change(old['throughput'], run['throughput'])}")
+        for handler, stats in run['handlers'].items():
+            if handler in old['handlers']:
+                old_stats = old['handlers'][handler]
+                print(f"    {handler:<26} p50 {_change(old_stats['p50_ms'], stats['p50_ms']):>8}  "
+                      f"p99 {_change(old_stats['p99_ms'], stats['p99_ms']):>8}")
+
+
+def _change(old, new):
+    return f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='sqlite:///bench_suite.db')
+    parser.add_argument('--frontend', choices=('telebot', 'telethon', 'both'), default='both')
+    parser.add_argument('--scenario', choices=tuple(SCENARIOS) + ('all',), default='all')
+    parser.add_argument('--ops', type=int, default=1000, help="Operations per scenario, a subscribe is three updates")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--admins', type=int, default=3)
+    parser.add_argument('--api-latency', type=float, default=0.0, help="Seconds every Telegram call takes")
+    parser.add_argument('--global-rate', type=float, default=100000, help="Outbound messages per second")
+    parser.add_argument('--per-chat-rate', type=float, default=100000, help="Outbound messages per second to one chat")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    frontends = ('telebot', 'telethon') if args.frontend == 'both' else (args.frontend,)
+    scenarios = tuple(SCENARIOS) if args.scenario == 'all' else (args.scenario,)
+    results = {'commit': git_commit(), 'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+               'python': sys.version.split()[0], 'args': vars(args), 'runs': []}
+    for frontend in frontends:
+        for scenario in scenarios:
+            result = run_scenario(frontend, scenario, args)
+            print_result(result)
+            results['runs'].append(result)
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(json.load(previous), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Update latency of the Telethon bot's database access under concurrent load.
+
+Compares running queries inline on the event loop (the old behaviour) with
+running them on AsyncDatabase's executor. A fraction of the updates hit a slow
+query; inline, every other update waits behind it.
+
+    python -m benchmarks.telethon_db_latency --updates 2000 --rate 500
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from sqlalchemy import event, text
+
+from modules.database import Database, AsyncDatabase
+from modules.models import Base, User
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def load_status(session, user_id, slow_ms):
+    if slow_ms:
+        session.execute(text("SELECT sleep_ms(:ms)"), {'ms': slow_ms})
+    user = session.query(User).filter_by(user_id=user_id).first()
+    return user.subscription_status if user else None
+
+
+async def drive(args, handle):
+    latencies = []
+
+    async def update(user_id, slow_ms):
+        started = time.perf_counter()
+        await handle(user_id, slow_ms)
+        # Stand-in for event.respond()
+        await asyncio.sleep(0.002)
+        latencies.append((time.perf_counter() - started, bool(slow_ms)))
+
+    tasks = []
+    for _ in range(args.updates):
+        slow_ms = args.slow_ms if random.random() < args.slow_fraction else 0
+        tasks.append(asyncio.ensure_future(update(random.randint(1, args.users), slow_ms)))
+        await asyncio.sleep(1 / args.rate)
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='sqlite:///bench_telethon.db')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=500, help="Updates per second")
+    parser.add_argument('--slow-fraction', type=float, default=0.02)
+    parser.add_argument('--slow-ms', type=int, default=100)
+    args = parser.parse_args()
+
+    db = Database(args.db)
+
+    @event.listens_for(db.engine, 'connect')
+    def add_sleep_function(connection, record):
+        connection.create_function('sleep_ms', 1, lambda ms: time.sleep(ms / 1000) or 0)
+
+    Base.metadata.drop_all(db.engine)
+    Base.metadata.create_all(db.engine)
+    with db.session_scope() as session:
+        session.bulk_insert_mappings(User, [{'user_id': user_id, 'subscription_status': 'active'}
+                                            for user_id in range(1, args.users + 1)])
+        session.commit()
+
+    adb = AsyncDatabase(db)
+
+    async def inline(user_id, slow_ms):
+        with db.session_scope() as session:
+            load_status(session, user_id, slow_ms)
+
+    async def executor(user_id, slow_ms):
+        await adb.run(load_status, user_id, slow_ms)
+
+    for name, handle in (('inline', inline), ('executor', executor)):
+        random.seed(1)
+        started = time.perf_counter()
+        samples = asyncio.run(drive(args, handle))
+        elapsed = time.perf_counter() - started
+        # Fast updates are the ones that suffer when a slow query blocks the loop
+        fast = [latency for latency, slow in samples if not slow]
+        print(f"{name:>8}: fast p50={percentile(fast, 0.5) * 1000:.1f}ms fast p99={percentile(fast, 0.99) * 1000:.1f}ms "
+              f"max={max(latency for latency, slow in samples) * 1000:.1f}ms "
+              f"throughput={len(samples) / elapsed:.0f} updates/s")
+    adb.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Update throughput of bot.py with long polling versus the webhook server.
+
+Both modes run the real Bot handlers against the fake Bot API, which serves
+the polled updates and answers the replies with --latency of delay.
+
+    python -m benchmarks.webhook_throughput --updates 2000 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import threading
+import time
+
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:benchmark')
+
+import aiohttp
+import telebot
+from aiohttp import web
+
+from benchmarks.fake_bot_api import FakeBotApi
+from modules.models import Base, User
+
+
+def make_update(update_id, user_id, text='/start'):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}],
+        },
+    }
+
+
+def make_bot(args):
+    from bot import Bot
+    my_bot = Bot(bot=telebot.TeleBot(os.environ['TELEGRAM_TOKEN']), db_uri=args.db)
+    my_bot.setup_handlers()
+    return my_bot
+
+
+def wait_for_replies(api, expected, timeout=600):
+    deadline = time.monotonic() + timeout
+    while api.calls.get('sendMessage', 0) < expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def run_polling(args, api, updates):
+    my_bot = make_bot(args)
+    api.calls.clear()
+    thread = threading.Thread(target=my_bot.bot.infinity_polling, kwargs={'timeout': 1, 'long_polling_timeout': 1},
+                              daemon=True)
+    started = time.perf_counter()
+    api.add_updates(updates)
+    thread.start()
+    wait_for_replies(api, len(updates))
+    elapsed = time.perf_counter() - started
+    my_bot.bot.stop_polling()
+    return elapsed
+
+
+def run_webhook(args, api, updates):
+    from modules.webhook import WebhookServer
+    my_bot = make_bot(args)
+    api.calls.clear()
+
+    async def main():
+        server = WebhookServer(my_bot.accept_update, path='/webhook', secret_token='bench')
+        runner = web.AppRunner(server.make_app())
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        # Telegram keeps up to max_connections requests in flight
+        semaphore = asyncio.Semaphore(args.connections)
+        started = time.perf_counter()
+        async with aiohttp.ClientSession(headers={'X-Telegram-Bot-Api-Secret-Token': 'bench'}) as client:
+            async def post(update):
+                async with semaphore:
+                    async with client.post(f'http://127.0.0.1:{port}/webhook', json=update) as response:
+                        assert response.status == 200, response.status
+
+            await asyncio.gather(*(post(update) for update in updates))
+            await asyncio.get_running_loop().run_in_executor(None, wait_for_replies, api, len(updates))
+        elapsed = time.perf_counter() - started
+        await runner.cleanup()
+        return elapsed
+
+    return asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='sqlite:///bench_webhook.db')
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.05, help="Fake API round-trip in seconds")
+    parser.add_argument('--connections', type=int, default=100, help="Concurrent webhook deliveries")
+    args = parser.parse_args()
+
+    from modules.database import get_database
+    db = get_database(args.db)
+    Base.metadata.drop_all(db.engine)
+    Base.metadata.create_all(db.engine)
+    with db.session_scope() as session:
+        session.bulk_insert_mappings(User, [{'user_id': user_id, 'first_name': f'user{user_id}', 'subscription_status': 'inactive'}
+                                            for user_id in range(1, args.updates + 1)])
+        session.commit()
+
+    api = FakeBotApi(latency=args.latency).start()
+    telebot.apihelper.API_URL = api.api_url
+
+    polling = run_polling(args, api, [make_update(update_id, update_id) for update_id in range(1, args.updates + 1)])
+    webhook = run_webhook(args, api, [make_update(update_id, update_id) for update_id in range(1, args.updates + 1)])
+    api.stop()
+
+    print(f"polling: {args.updates / polling:.0f} updates/s ({polling:.1f}s)")
+    print(f"webhook: {args.updates / webhook:.0f} updates/s ({webhook:.1f}s), {webhook and polling / webhook:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,31 @@
 import logging
+import threading
+from functools import partial
 import telebot
-import random
-import string
 from telebot import types
-from modules.models import session, User, Subscription, Admin, Payment, Code, Session, SubscriptionPlan, Base, db_url
+from modules.models import User, Subscription, Admin, Payment, Code, SubscriptionPlan, Base
+from modules.database import get_database
 from decimal import Decimal
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
-from contextlib import contextmanager
-from modules.params import TELEGRAM_TOKEN, DB_URL
-from apscheduler.schedulers.background import BackgroundScheduler
+from modules.params import TELEGRAM_TOKEN, DB_URL, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET, CHANNEL_ID, SWEEP_CRON, CLEANUP_CRON, REMINDER_CRON, CALLBACK_SECRET, METRICS_PORT, PLAN_CACHE_TTL, BROADCAST_RESUME_CRON
+from modules.sweep import ExpirySweep
+from modules.enforcement import ChannelEnforcer
+from modules.scheduler import JobScheduler
+from modules.reminders import ReminderQueue
+from modules.admin_fanout import AdminFanout
+from modules.approvals import ApprovalPipeline, attach_receipt, conflict_reply
+from modules.callbacks import CallbackRouter
+from modules.dispatcher import OutboundDispatcher
+from modules.broadcast import BroadcastEngine
+from modules.admin_cache import AdminRegistry
+from modules.plan_catalogue import PlanCatalogue
+from modules.status_cache import StatusCache, status_reply
+from modules.webhook import WebhookServer
+from modules.update_scheduler import ShardedUpdateScheduler
+from modules.update_dedup import make_deduplicator
+from modules.metrics import REGISTRY, MetricsServer, instrumented, watch_engine
+from modules.conversation_state import make_state_store
+from modules import subscriptions, codes, callbacks
 
 logging.basicConfig(level=logging.INFO)
 
@@ -23,56 +38,186 @@ class Bot:
                 #  menu=MainMenu(), 
                  db_uri=DB_URL):
         self.bot = bot
-        self.engine = create_engine(db_uri, echo=True, pool_size=10, max_overflow=20)
-        self.SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=self.engine))
+        # Updates are sharded by chat: parallel across chats, strictly ordered within one.
+        # telebot calls process_new_updates for every batch it polls, so route it through the shards
+        # and run handlers inline on the shard threads instead of telebot's unordered worker pool.
+        # Redelivered updates (webhook retries, restarts) are dropped before they reach a shard. A polled
+        # update only counts towards the persisted high-water mark once its shard has handled it
+        self.dedup = make_deduplicator()
+        self.update_scheduler = ShardedUpdateScheduler(self.bot.process_new_updates,
+                                                       on_done=lambda update: self.dedup.done(update.update_id))
+        self.bot.process_new_updates = lambda updates: self.update_scheduler.dispatch(self.dedup.filter(updates))
+        self.bot.threaded = False
+        # One engine and pool per process, shared with everything else using this database
+        self.db = get_database(db_uri)
+        self.engine = self.db.engine
+        self.SessionLocal = self.db.SessionLocal
         Base.metadata.create_all(bind=self.engine)
-        self.user_plan_choice = {} 
+        # Pending next steps and plan choices per chat. With a SQLite or Redis store they survive
+        # restarts and are shared by every bot process, see CONVERSATION_STORE_URL.
+        self.conversations = make_state_store()
+        self.steps = {
+            'code_duration': self.ask_for_code_duration,
+            'redeem_code': self.process_redeem_code,
+            'add_admin': self.process_add_admin,
+            'add_plan': self.process_add_plan,
+            'mass_message': self.process_mass_message,
+        }
+        self.outbox = OutboundDispatcher()
+        self.admins = AdminRegistry(self.get_db_session)
+        self.plans = PlanCatalogue(self.get_db_session, ttl=PLAN_CACHE_TTL)
+        self.status = StatusCache(self.get_db_session)
+        self.broadcasts = BroadcastEngine(self.get_db_session, self.outbox, self.bot.send_message)
+        self.enforcer = ChannelEnforcer(self.get_db_session)
+        self.reminders = ReminderQueue(self.get_db_session)
+        self.fanout = AdminFanout(self.get_db_session, self.outbox, late_edit=self.edit_late_receipt_copy)
+        self.approvals = ApprovalPipeline(self.get_db_session)
+        # Inline buttons carry signed, packed data and are dispatched by action tag, see modules/callbacks.py
+        self.callbacks = CallbackRouter(CALLBACK_SECRET or self.bot.token)
+        self.callbacks.register(callbacks.SUBSCRIBE, 'i', self.subscribe_callback)
+        self.callbacks.register(callbacks.PAY_ONLINE, 'i', partial(self.payment_method_callback, payment_method='online'))
+        self.callbacks.register(callbacks.PAY_DIRECT, 'i', partial(self.payment_method_callback, payment_method='direct'))
+        self.callbacks.register(callbacks.APPROVE, 'qq', partial(self.handle_admin_decision, decision='approve'))
+        self.callbacks.register(callbacks.DENY, 'qq', partial(self.handle_admin_decision, decision='deny'))
+        self.callbacks.register(callbacks.DELETE_PLAN, 'i', self.delete_plan_callback)
 
 
-    @contextmanager
     def get_db_session(self):
         """Provide a transactional scope around a series of operations."""
-        db = self.SessionLocal()
-        try:
-            yield db
-        except Exception as e:
-            db.rollback()  # Roll back the transaction in case of error
-            raise e
-        finally:
-            db.close()
+        return self.db.session_scope()
+
+    def update_conversation(self, chat_id, **values):
+        state = self.conversations.get(str(chat_id)) or {}
+        state.update(values)
+        self.conversations.set(str(chat_id), state)
+
+    def expect_reply(self, chat_id, step):
+        """Route the chat's next text message to the given step, one of self.steps."""
+        self.update_conversation(chat_id, step=step)
+
+    def run_pending_step(self, message):
+        """Hand the message to the step the chat is waiting on, if any. Returns True when handled."""
+        # Not instrumented itself: each step handler is, so its metrics carry the step's name
+        key = str(message.chat.id)
+        state = self.conversations.get(key)
+        step = state.pop('step', None) if state else None
+        if step not in self.steps:
+            return False
+        if state:
+            self.conversations.set(key, state)
+        else:
+            self.conversations.delete(key)
+        self.steps[step](message)
+        return True
+
+    def queue_message(self, chat_id, text, **kwargs):
+        """Send a message through the rate-limited outbound queue without blocking the caller."""
+        return self.outbox.submit(chat_id, self.bot.send_message, chat_id, text, **kwargs)
+
+    def start_polling(self):
+        # Start the bot and run it until it is stopped
+        self.bot.remove_webhook()
+        self.bot.infinity_polling()
+
+    def start_webhook(self, url=WEBHOOK_URL, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+        # Several processes can run behind a load balancer, Telegram only needs the public URL.
+        # All of them check the same WEBHOOK_SECRET, the server refuses to start without one.
+        server = WebhookServer(self.accept_update, secret_token=WEBHOOK_SECRET)
+        REGISTRY.add_stats('webhook', server.stats)
+        # Let Telegram open as many parallel connections as it allows, the server queues them
+        self.bot.set_webhook(url=url.rstrip('/') + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET, max_connections=100)
+        server.run(host, port)
+
+    def accept_update(self, update):
+        """
+        Take one webhook update on the server's event loop, in arrival order.
 
-    async def start_polling(self):
-        # Start the bot and run it until it is disconnected
-        await self.client.run_until_disconnected()
+        A full shard refuses the update before it is marked as seen, so the
+        retry Telegram sends after the 503 is not dropped as a duplicate.
+        """
+        if self.update_scheduler.is_full(update):
+            return False
+        # The event loop is the only producer in webhook mode, so the shard still has room. Webhook
+        # updates are not ordered by update_id, so only the window of recent ids catches duplicates
+        self.update_scheduler.dispatch(self.dedup.filter([update], ordered=False))
+        return True
+
+    def start_metrics(self, port=METRICS_PORT):
+        # Local /metrics endpoint for Prometheus, see modules/metrics.py
+        if not port:
+            return
+        watch_engine(self.engine)
+        REGISTRY.add_stats('outbound', self.outbox.metrics.snapshot)
+        REGISTRY.add_stats('update_shards', lambda: {'queue_depth': sum(self.update_scheduler.queue_lengths()),
+                                                     'max_queue_depth': max(self.update_scheduler.queue_lengths())})
+        REGISTRY.add_stats('db_pool', self.db.pool_stats)
+        REGISTRY.add_stats('admin_cache', self.admins.stats)
+        REGISTRY.add_stats('status_cache', self.status.stats)
+        REGISTRY.add_stats('approvals', self.approvals.stats)
+        REGISTRY.add_stats('dedup', self.dedup.stats)
+        self.metrics_server = MetricsServer(port=port).start()
 
     def start_scheduler(self):
-        self.scheduler = BackgroundScheduler()
-        self.scheduler.add_job(self.check_subscriptions, 'interval', hours=24)  # Run daily
+        # Jobs live in the scheduled_jobs table; with several replicas each run happens on exactly one of them
+        self.scheduler = JobScheduler(self.get_db_session)
+        self.scheduler.add_job('expiry_reminders', REMINDER_CRON, self.send_reminders)
+        if CHANNEL_ID:
+            # Enforcement removes and marks expired users itself, the sweep would have nothing to do
+            self.scheduler.add_job('channel_enforcement', SWEEP_CRON, self.enforce_channel)
+        else:
+            self.scheduler.add_job('expiry_sweep', SWEEP_CRON, self.check_subscriptions)
+        # Every replica looks for broadcasts whose sender stopped, the lease lets only one take each over
+        self.scheduler.add_local_job('broadcast_resume', BROADCAST_RESUME_CRON, self.resume_broadcasts)
+        # The conversation store may be this process's memory, so every replica purges its own
+        self.scheduler.add_local_job('conversation_cleanup', CLEANUP_CRON, self.conversations.purge_expired)
         self.scheduler.start()
     
     def check_subscriptions(self):
-        with self.get_db_session() as session:
-            current_date = datetime.utcnow()
-            users = session.query(User).all()
-            for user in users:
-                if user.subscription_expiry and user.subscription_expiry < current_date:
-                    # Notify admins to remove the user
-                    self.notify_admins_for_removal(user.user_id, user.first_name, user.username)
-                elif user.subscription_expiry and user.subscription_expiry - timedelta(days=3) <= current_date:
-                    # Notify users about upcoming expiry
-                    self.notify_admins_for_expiry(user.user_id, user.first_name, user.username)
-                    self.bot.send_message(user.user_id, "Your subscription is about to expire in 3 days.")
+        # Expiring users are reminded from the reminder queue, the sweep only visits expired ones
+        sweep = ExpirySweep(self.get_db_session)
+        return sweep.run(on_expired=self.handle_expired_user, on_expiring=None)
+
+    def send_reminders(self):
+        return self.reminders.run(self.handle_expiring_user)
+
+    def enforce_channel(self):
+        report = self.enforcer.run(self.outbox, self.remove_user_from_channel, calls=2)
+        if report.removed or report.skipped:
+            for admin_id in self.get_all_admins():
+                self.queue_message(admin_id, f"Removed {report.removed} expired users from the channel in {report.elapsed:.1f}s "
+                                             f"({report.rate:.1f}/s), {report.failed} failed and will be retried, "
+                                             f"{report.skipped} could not be removed and need a manual check.")
+        return report
+
+    def remove_user_from_channel(self, user_id):
+        # Ban and lift the ban right away: the user is removed but can rejoin after renewing
+        self.bot.ban_chat_member(CHANNEL_ID, user_id)
+        self.bot.unban_chat_member(CHANNEL_ID, user_id, only_if_banned=True)
+
+    def handle_expired_user(self, user):
+        # Removal is automatic when the channel is configured
+        if not CHANNEL_ID:
+            # Notify admins to remove the user
+            self.notify_admins_for_removal(user.user_id, user.first_name, user.username)
+
+    def handle_expiring_user(self, user):
+        # Notify user and admins if subscription is about to expire. Returns the user's send,
+        # so the reminder queue retries the reminder if it fails
+        sent = self.queue_message(user.user_id, f"Your subscription is about to expire on {user.subscription_expiry.strftime('%Y-%m-%d')}.")
+        self.notify_admins_for_renewal(user.user_id)
+        return sent
 
     def notify_admins_for_expiry(self, user_id, first_name, user_name):
         admins = self.get_all_admins()
         for admin_id in admins:
-            self.bot.send_message(admin_id, f"User {user_id}'s with username: {user_name} and name: {first_name} subscription has 3 days to be expired.")
+            self.queue_message(admin_id, f"User {user_id}'s with username: {user_name} and name: {first_name} subscription has 3 days to be expired.")
 
     def notify_admins_for_removal(self, user_id, first_name, user_name):
         admins = self.get_all_admins()
         for admin_id in admins:
-            self.bot.send_message(admin_id, f"User {user_id}'s with username: {user_name} and name: {first_name} subscription has expired. Consider removing them from the channel.")
+            self.queue_message(admin_id, f"User {user_id}'s with username: {user_name} and name: {first_name} subscription has expired. Consider removing them from the channel.")
 
+    @instrumented
     def send_welcome(self, message):
         # Extract user data from the message
         user_id = message.from_user.id
@@ -81,7 +226,7 @@ class Bot:
         username = message.from_user.username  # Some users might not have a username
 
         # Start a new database session
-        with Session() as session:
+        with self.get_db_session() as session:
             # Check if the user already exists in the database
             existing_user = session.query(User).filter_by(user_id=user_id).first()
 
@@ -99,118 +244,96 @@ class Bot:
                 )
                 session.add(new_user)
                 session.commit()
+                self.status.invalidate(user_id)
                 reply = "Welcome to the Subscription Manager Bot! You have been registered. Use /subscribe to choose a subscription plan."
 
             # Send the welcome message
             self.bot.reply_to(message, reply)
 
+    @instrumented
     def channel_id_check(self, message):
         if message.forward_from_chat:
             channel_id = message.forward_from_chat.id
             self.bot.send_message(message.chat.id, f"Channel ID: {channel_id}")
             print("Channel ID:", channel_id)
 
+    @instrumented
     def check_status(self, message):
         chat_id = message.chat.id
-        print(f"Received /status command from {chat_id}.")  # Debug print
         try:
-            print("Attempting to create a session...")  # Debug print
-            with Session() as session:
-                print("Session created, querying the user...")  # Debug print
-                user = session.query(User).filter_by(user_id=chat_id).first()
-                if user:
-                    if user.subscription_status == 'active':
-                        expiry = user.subscription_expiry.strftime("%Y-%m-%d %H:%M:%S") if user.subscription_expiry else "an unknown time"
-                        reply = f"Your subscription is active until {expiry}."
-                    else:
-                        reply = "You do not have an active subscription."
-                else:
-                    reply = "You are not registered in our database."
-                print(f"Replying with: {reply}")  # Debug print
-            self.bot.reply_to(message, reply)
+            # Served from the status cache, a miss is one covering-index lookup
+            reply = status_reply(self.status.get(chat_id))
         except Exception as e:
-            print(f"An error occurred: {e}")
-            self.bot.reply_to(message, "An error occurred while checking your status.")
-
-    def check_subscriptions(self):
-        with self.get_db_session() as session:
-            # Fetch all users
-            users = session.query(User).all()
-            for user in users:
-                if user.subscription_expiry and user.subscription_expiry <= datetime.utcnow():
-                    # Remove user from the channel if subscription expired
-                    self.remove_user_from_channel(user.user_id)
-                elif user.subscription_expiry and datetime.utcnow() + timedelta(days=3) >= user.subscription_expiry:
-                    # Notify user and admins if subscription is about to expire
-                    self.bot.send_message(user.user_id, "Your subscription is about to expire in 3 days.")
-                    self.notify_admins_for_renewal(user.user_id)
+            logging.error(f"An error occurred while checking the status of {chat_id}: {e}")
+            reply = "An error occurred while checking your status."
+        self.bot.reply_to(message, reply)
 
     def notify_admins_for_renewal(self, user_id):
         admins = self.get_all_admins()
         notification_message = f"User {user_id}'s subscription is about to expire."
         for admin_id in admins:
-            self.bot.send_message(admin_id, notification_message)
+            self.queue_message(admin_id, notification_message)
+
+    def build_subscribe_markup(self, plans):
+        markup = types.InlineKeyboardMarkup()
+        for plan in plans:
+            button_text = f"{plan.name} - ${plan.price} for {plan.duration_days} days"
+            markup.add(types.InlineKeyboardButton(button_text, callback_data=self.callbacks.encode(callbacks.SUBSCRIBE, plan.plan_id)))
+        # Keep the serialized form, telebot sends strings as-is
+        return markup.to_json()
+
+    def build_payment_method_markup(self, plan_id):
+        markup = types.InlineKeyboardMarkup()
+        markup.add(types.InlineKeyboardButton("Pay Online", callback_data=self.callbacks.encode(callbacks.PAY_ONLINE, plan_id)))
+        markup.add(types.InlineKeyboardButton("Direct Payment", callback_data=self.callbacks.encode(callbacks.PAY_DIRECT, plan_id)))
+        return markup.to_json()
 
+    @instrumented
     def subscribe(self, message):
         chat_id = message.chat.id
-        with Session() as session:
-            plans = session.query(SubscriptionPlan).all()
-            if plans:
-                markup = types.InlineKeyboardMarkup()
-                for plan in plans:
-                    button_text = f"{plan.name} - ${plan.price} for {plan.duration_days} days"
-                    markup.add(types.InlineKeyboardButton(button_text, callback_data=f"subscribe_{plan.plan_id}"))
-                self.bot.send_message(chat_id, "Please choose a subscription plan:", reply_markup=markup)
-            else:
-                self.bot.send_message(chat_id, "There are currently no subscription plans available.")
+        # Plans and their keyboard come from the in-memory catalogue
+        if self.plans.plans():
+            markup = self.plans.keyboard('subscribe', self.build_subscribe_markup)
+            self.bot.send_message(chat_id, "Please choose a subscription plan:", reply_markup=markup)
+        else:
+            self.bot.send_message(chat_id, "There are currently no subscription plans available.")
 
-    def callback_query(self, call):
+    def callback_query(self, call, plan_id):
         chat_id = call.message.chat.id
-        plan_id = int(call.data.split('_')[1])  # This extracts the plan ID from the callback data
-        print(f'THIS IS PLAN IDDDDD: {plan_id}')
-        # Retrieve the selected plan details from the database
-        with Session() as session:
-            selected_plan = session.query(SubscriptionPlan).filter_by(plan_id=plan_id).first()
-            print(f'SELECTED PLAN: {selected_plan}')
-            if selected_plan:
-                # Proceed to payment method selection
-                markup = types.InlineKeyboardMarkup()
-                # Assuming you have two payment methods: 'online' and 'direct'
-                markup.add(types.InlineKeyboardButton("Pay Online", callback_data=f"pay_online_{plan_id}"))
-                markup.add(types.InlineKeyboardButton("Direct Payment", callback_data=f"direct_payment_{plan_id}"))
-                self.bot.send_message(chat_id, f"You have selected the {selected_plan.name} plan. Please choose your payment method:", reply_markup=markup)
-            else:
-                self.bot.send_message(chat_id, "The selected plan does not exist.")
+        selected_plan = self.plans.get(plan_id)
+        if selected_plan:
+            # Proceed to payment method selection
+            markup = self.plans.keyboard(f'payment_method_{plan_id}', lambda plans: self.build_payment_method_markup(plan_id))
+            self.bot.send_message(chat_id, f"You have selected the {selected_plan.name} plan. Please choose your payment method:", reply_markup=markup)
+        else:
+            self.bot.send_message(chat_id, "The selected plan does not exist.")
 
         # Make sure to answer the callback query
         self.bot.answer_callback_query(call.id)
 
-    def subscribe_callback(self, call):
+    @instrumented
+    def subscribe_callback(self, call, plan_id):
         chat_id = call.message.chat.id
-        plan_id = int(call.data.split('_')[1])  # Extracts the plan ID from the callback data
 
         # Store the user's choice temporarily
-        self.user_plan_choice[chat_id] = plan_id
+        self.update_conversation(chat_id, plan_id=plan_id)
 
         # Proceed to payment method selection
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton("Pay Online", callback_data=f"pay_online_{plan_id}"))
-        markup.add(types.InlineKeyboardButton("Direct Payment", callback_data=f"pay_direct_{plan_id}"))
+        markup = self.plans.keyboard(f'payment_method_{plan_id}', lambda plans: self.build_payment_method_markup(plan_id))
         self.bot.send_message(chat_id, "Please choose your payment method:", reply_markup=markup)
 
         # Make sure to answer the callback query
         self.bot.answer_callback_query(call.id)
 
-    def payment_method_callback(self, call):
+    @instrumented
+    def payment_method_callback(self, call, plan_id, payment_method):
         chat_id = call.message.chat.id
-        payment_method, plan_id = call.data.split('_')[1:]
-        print(payment_method)
 
         if payment_method == 'online':
             # Online payment handling code goes here
             pass
         elif payment_method == 'direct':
-            self.handle_direct_payment(chat_id, int(plan_id))
+            self.handle_direct_payment(chat_id, plan_id)
         else:
             self.bot.send_message(chat_id, "Unrecognized payment method.")
 
@@ -218,9 +341,8 @@ class Bot:
         self.bot.answer_callback_query(call.id)
 
     def handle_direct_payment(self, chat_id, plan_id):
-        # Retrieve the selected plan details from the database
+        selected_plan = self.plans.get(plan_id)
         with self.get_db_session() as session:
-            selected_plan = session.query(SubscriptionPlan).filter_by(plan_id=plan_id).first()
             if selected_plan:
                 # Create a new payment record
                 new_payment = Payment(
@@ -238,142 +360,98 @@ class Bot:
             else:
                 self.bot.send_message(chat_id, "The selected plan does not exist.")
 
+    @instrumented
     def handle_photo(self, message):
         chat_id = message.chat.id
         with self.get_db_session() as session:
-            # Assuming that there is a Payment record with 'pending' status for the user
-            payment = session.query(Payment).filter_by(user_id=chat_id, payment_status='pending').first()
-            if payment:
-                # Forward the photo to each admin
-                admins = session.query(Admin).all()
-                for admin in admins:
-                    self.bot.forward_message(admin.admin_id, chat_id, message.message_id)
-                    # Send the inline buttons for approval or denial to each admin
-                    markup = types.InlineKeyboardMarkup()
-                    markup.add(types.InlineKeyboardButton("Approve", callback_data=f"approve_{chat_id}_{payment.payment_id}"),
-                            types.InlineKeyboardButton("Deny", callback_data=f"deny_{chat_id}_{payment.payment_id}"))
-                    self.bot.send_message(admin.admin_id, "Please approve or deny the payment:", reply_markup=markup)
-                # Update the payment record with receipt information
-                payment.receipt_message_id = message.message_id
-                session.commit()
-            else:
-                self.bot.send_message(chat_id, "No pending payment found or you've already submitted a receipt.")
+            # Store the receipt on the user's latest pending payment
+            payment_id = attach_receipt(session, chat_id, message.message_id)
+            session.commit()
+        if not payment_id:
+            self.bot.send_message(chat_id, "No pending payment found or you've already submitted a receipt.")
+            return
+
+        # Acknowledge right away, the admins are notified in parallel in the background
+        self.queue_message(chat_id, "Your receipt has been sent to the admins for review.")
+        self.notify_admins_of_receipt(message, payment_id)
 
     def handle_messages(self, message):
         if message.content_type == 'photo':
-            chat_id = message.chat.id
-            with self.get_db_session() as session:
-                # Fetch the latest pending payment for the user
-                payment = session.query(Payment).filter_by(user_id=chat_id, payment_status='pending').order_by(Payment.payment_date.desc()).first()
-                if payment:
-                    # Update the payment record with the receipt message ID
-                    payment.receipt_message_id = message.message_id
-                    session.commit()
+            self.handle_photo(message)
 
-                    # Forward the receipt photo to all admins and ask for approval
-                    admins = session.query(Admin).all()  # Replace with your method of retrieving admin IDs
-                    for admin in admins:
-                        forwarded_message = self.bot.forward_message(admin.admin_id, chat_id, message.message_id)
-                        # Prepare inline buttons for approval or denial
-                        markup = types.InlineKeyboardMarkup()
-                        markup.row(
-                            types.InlineKeyboardButton("Approve", callback_data=f"approve_{chat_id}_{payment.payment_id}"),
-                            types.InlineKeyboardButton("Deny", callback_data=f"deny_{chat_id}_{payment.payment_id}")
-                        )
-                        # Send the inline buttons to each admin
-                        self.bot.send_message(admin.admin_id, "Please approve or deny the payment:", reply_markup=markup)
-                else:
-                    # Notify the user if no pending payment is found
-                    self.bot.send_message(chat_id, "No pending payment found or you've already submitted a receipt.")
+    def notify_admins_of_receipt(self, message, payment_id):
+        chat_id = message.chat.id
+        user = message.from_user
+        # One photo message per admin carrying the receipt, the payment details and the buttons
+        markup = types.InlineKeyboardMarkup()
+        markup.row(
+            types.InlineKeyboardButton("Approve", callback_data=self.callbacks.encode(callbacks.APPROVE, chat_id, payment_id)),
+            types.InlineKeyboardButton("Deny", callback_data=self.callbacks.encode(callbacks.DENY, chat_id, payment_id))
+        )
+        caption = (f"Receipt from {user.first_name} (@{user.username}, ID {chat_id}) for payment {payment_id}.\n"
+                   f"Please approve or deny the payment:")
+        self.fanout.send(payment_id, self.get_all_admins(), self.bot.send_photo, message.photo[-1].file_id,
+                         caption=caption, reply_markup=markup)
+
+    @instrumented
+    def handle_admin_decision(self, call, user_id, payment_id, decision):
+        if not self.is_admin(call.from_user.id):
+            self.bot.answer_callback_query(call.id, "You are not authorized to review payments.")
+            return
 
-    def handle_admin_decision(self, call):
-        call_data = call.data.split('_')
-        decision = call_data[0]
-        user_id = int(call_data[1])
-        payment_id = int(call_data[2])
+        # One transition per payment: double taps, other admins and redelivered callbacks are turned away
+        result = self.approvals.decide(payment_id, decision)
+        if not result.applied:
+            self.bot.answer_callback_query(call.id, conflict_reply(result))
+            return
+        self.bot.answer_callback_query(call.id)
 
         if decision == 'approve':
-            self.process_approval(user_id, call.from_user.id, payment_id)
+            self.process_approval(result)
         elif decision == 'deny':
-            self.process_denial(user_id, call.from_user.id, payment_id)
+            self.process_denial(result)
 
-        # Update the admin's message to reflect the decision
-        self.bot.edit_message_text(chat_id=call.from_user.id, message_id=call.message.message_id, text=f"Payment {'approved' if decision == 'approve' else 'denied'}", reply_markup=None)
+        # Update every admin's copy of the receipt to reflect the decision, not just this one
+        verdict = 'approved' if decision == 'approve' else 'denied'
+        caption = f"Payment {payment_id} {verdict} by {call.from_user.first_name} (ID {call.from_user.id})."
+        if not self.fanout.edit_all(payment_id, partial(self.edit_receipt_copy, caption=caption)):
+            # Receipts sent before the copies were recorded only have this message to update
+            self.bot.edit_message_text(chat_id=call.from_user.id, message_id=call.message.message_id, text=f"Payment {verdict}", reply_markup=None)
 
-    def process_approval(self, user_id, admin_id, payment_id):
-        with self.get_db_session() as session:
-            payment = session.query(Payment).filter_by(payment_id=payment_id).first()
-            if payment:
-                payment.payment_status = 'confirmed'
-                session.commit()
-                self.update_user_subscription(user_id, payment_id)
-                # self.bot.send_message(user_id, "Your payment has been approved. Your subscription has been updated.")
-            else:
-                print(f"No payment found for payment ID {payment_id}.")
-
-    def process_denial(self, user_id, admin_id, message_id):
-        # Handle payment denial
-        with self.get_db_session() as session:
-            payment = self.find_payment_by_message_id(message_id, session)
-            if payment:
-                payment.payment_status = 'denied'
-                session.commit()
-        self.bot.send_message(user_id, "Your payment was not accepted. Please contact support for more information.")
-
-    def find_payment_by_message_id(self, message_id, session):
-        """
-        Finds a payment record associated with a given message ID.
+    def edit_receipt_copy(self, admin_id, message_id, caption):
+        self.bot.edit_message_caption(caption, chat_id=admin_id, message_id=message_id, reply_markup=None)
 
-        :param message_id: The ID of the message (e.g., receipt image) sent by the user.
-        :param session: The database session.
-        :return: The Payment object or None if not found.
-        """
-        return session.query(Payment).filter_by(receipt_message_id=message_id).first()
+    def edit_late_receipt_copy(self, admin_id, message_id, payment_id, status):
+        # A copy delivered after the decision was made and the other copies edited
+        verdict = 'approved' if status == 'confirmed' else status
+        self.edit_receipt_copy(admin_id, message_id, f"Payment {payment_id} {verdict}.")
 
-    def update_user_subscription(self, user_id, payment_id=None, additional_days=None):
-        with self.get_db_session() as session:
-            if payment_id:
-                payment = session.query(Payment).filter_by(payment_id=payment_id).first()
-                if payment:
-                    payment.payment_status = 'confirmed'
-                    selected_plan = session.query(SubscriptionPlan).filter_by(plan_id=payment.plan_id).first()
-                    if selected_plan:
-                        additional_days = selected_plan.duration_days
-
-            user = session.query(User).filter_by(user_id=user_id).first()
-            if user:
-                # Determine the new expiry date
-                new_expiry_date = user.subscription_expiry + timedelta(days=additional_days) if user.subscription_expiry else datetime.utcnow() + timedelta(days=additional_days)
-
-                user.subscription_expiry = new_expiry_date
-                user.subscription_status = 'active'  # Update subscription status as active
-                session.commit()
+    def process_approval(self, result):
+        # The payment is confirmed and the subscription extended already, see modules/approvals.py
+        self.status.invalidate(result.user_id)
+        self.queue_message(result.user_id, f"Your payment has been approved. Your subscription is active until {result.expiry.strftime('%Y-%m-%d')}.")
 
-                self.bot.send_message(user_id, "Your subscription has been updated.")
+    def process_denial(self, result):
+        self.queue_message(result.user_id, "Your payment was not accepted. Please contact support for more information.")
 
     def is_admin(self, user_id):
-        with self.get_db_session() as session:
-            # Query the Admin table to check if the user_id exists there
-            admin = session.query(Admin).filter_by(admin_id=user_id).first()
-            return admin is not None
+        # Served from the admin snapshot once it is at most auth_ttl old, see AdminRegistry.check
+        return self.admins.check(user_id)
         
     def get_all_admins(self):
-        with self.get_db_session() as session:
-            # Query the Admin table to get all admin records
-            admins = session.query(Admin).all()
-            # Extract the admin_id from each admin record
-            admin_ids = [admin.admin_id for admin in admins]
-            return admin_ids
+        return self.admins.admin_ids()
 
+    @instrumented
     def generate_redemption_code(self, message):
         if not self.is_admin(message.from_user.id):
             self.bot.reply_to(message, "You are not authorized to generate codes.")
             return
 
         # Ask the admin for the duration of the code
-        msg = self.bot.reply_to(message, "Enter the duration in days for the redemption code:")
-        self.bot.register_next_step_handler(msg, self.ask_for_code_duration)
+        self.bot.reply_to(message, "Enter the duration in days for the redemption code:")
+        self.expect_reply(message.chat.id, 'code_duration')
 
+    @instrumented
     def ask_for_code_duration(self, message):
         try:
             duration = int(message.text.strip())
@@ -397,26 +475,56 @@ class Bot:
         self.bot.send_message(message.chat.id, f"Generated code: {code} for {duration} days")
 
     def create_unique_code(self):
-        return ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+        return codes.new_code()
+
+    @instrumented
+    def generate_code_batch(self, message):
+        if not self.is_admin(message.from_user.id):
+            self.bot.reply_to(message, "You are not authorized to generate codes.")
+            return
+        try:
+            batch = codes.parse_batch_command(message.text)
+        except ValueError as e:
+            self.bot.reply_to(message, str(e))
+            return
+
+        campaign = batch.template['campaign']
+        chat_id = message.chat.id
+
+        # Run the insert off the update shard, a large batch would hold up every chat hashed to it
+        def run():
+            try:
+                with self.get_db_session() as session:
+                    stored = batch.insert(session)
+            except Exception as e:
+                logging.error(f"Generating codes for campaign {campaign} failed: {e}")
+                self.queue_message(chat_id, f"Generating codes for campaign {campaign} failed.")
+                return
+            self.outbox.submit(chat_id, self.bot.send_document, chat_id, batch.export(),
+                               visible_file_name=f"codes_{campaign}.csv",
+                               caption=f"Generated {stored} codes for campaign {campaign}.")
+
+        threading.Thread(target=run, name=f"codes-{campaign}", daemon=True).start()
+        self.bot.reply_to(message, f"Generating {batch.count} codes for campaign {campaign}, the CSV will follow.")
 
+    @instrumented
     def redeem_code(self, message):
-        sent = self.bot.reply_to(message, "Please enter your redemption code.")
-        self.bot.register_next_step_handler(sent, self.process_redeem_code)
+        self.bot.reply_to(message, "Please enter your redemption code.")
+        self.expect_reply(message.chat.id, 'redeem_code')
 
+    @instrumented
     def process_redeem_code(self, message):
         code_text = message.text.strip().upper()  # Assuming codes are uppercase
         user_id = message.from_user.id
 
+        # Claiming the code and extending the subscription is one atomic transaction
         with self.get_db_session() as session:
-            code = session.query(Code).filter_by(code=code_text, used_status=False).first()
-            if code:
-                code.used_status = True
-                associated_days = code.associated_days  # Get the number of days from the code
-                session.commit()
-                self.update_user_subscription(user_id, additional_days=associated_days)  # Pass only additional_days
-                self.bot.send_message(user_id, f"Your code has been redeemed successfully. Subscription extended by {associated_days} days.")
-            else:
-                self.bot.send_message(user_id, "The code is invalid or has already been used.")
+            redemption = subscriptions.redeem_code(session, code_text, user_id)
+        if redemption:
+            self.status.invalidate(user_id)
+            self.bot.send_message(user_id, f"Your code has been redeemed successfully. Subscription extended by {redemption.days} days.")
+        else:
+            self.bot.send_message(user_id, "The code is invalid or has already been used.")
 
 #########################################
 #########################################
@@ -424,29 +532,57 @@ class Bot:
 #########################################
 #########################################
 
+    @instrumented
     def add_admin_command(self, message):
         chat_id = message.chat.id
         # Check if the user is a superuser
-        admin = session.query(Admin).filter_by(admin_id=chat_id, is_superuser=True).first()
-        if admin:
+        if self.admins.check(chat_id, superuser=True):
             # Provide instructions on how to add an admin
-            reply = "Please send the user ID of the person you want to make an admin."
+            self.bot.reply_to(message, "Please send the user ID of the person you want to make an admin.")
             # Proceed with the next step of adding an admin
+            self.expect_reply(chat_id, 'add_admin')
         else:
-            reply = "You do not have permission to add admins."
+            self.bot.reply_to(message, "You do not have permission to add admins.")
+
+    @instrumented
+    def process_add_admin(self, message):
+        try:
+            admin_id = int(message.text.strip())
+        except (AttributeError, ValueError):
+            self.bot.reply_to(message, "Invalid user ID. Please enter a numerical ID.")
+            return
+
+        with self.get_db_session() as session:
+            if session.query(Admin).filter_by(admin_id=admin_id).first():
+                reply = f"User {admin_id} is already an admin."
+            else:
+                user = session.query(User).filter_by(user_id=admin_id).first()
+                session.add(Admin(
+                    admin_id=admin_id,
+                    username=user.username if user else None,
+                    first_name=user.first_name if user else None,
+                    last_name=user.last_name if user else None,
+                    is_superuser=False
+                ))
+                session.commit()
+                reply = f"User {admin_id} is now an admin."
+        # Make the new admin visible to the cached lookups right away
+        self.admins.invalidate()
         self.bot.reply_to(message, reply)
 
+    @instrumented
     def add_plan_command(self, message):
         if self.is_admin(message.from_user.id):
             try:
-                msg = self.bot.reply_to(message, "Enter the new plan details in the format: name, price, duration_days")
-                self.bot.register_next_step_handler(msg, self.process_add_plan)
+                self.bot.reply_to(message, "Enter the new plan details in the format: name, price, duration_days")
+                self.expect_reply(message.chat.id, 'add_plan')
             except Exception as e:
                 logging.error(f"Error in add_plan_command: {e}")
                 self.bot.reply_to(message, "An error occurred while processing your request.")
         else:
             self.bot.reply_to(message, "You are not authorized to add plans.")
 
+    @instrumented
     def process_add_plan(self, message):
         try:
             plan_data = message.text.split(',')
@@ -463,6 +599,7 @@ class Bot:
             with self.get_db_session() as session:
                 session.add(new_plan)
                 session.commit()
+            self.plans.invalidate()
 
             # Inform the user that the plan has been added successfully
             self.bot.reply_to(message, f"New plan added: {name}, price: {price}, duration: {duration_days} days")
@@ -475,37 +612,39 @@ class Bot:
             logging.error(f"Unexpected error in process_add_plan: {e}")
             self.bot.reply_to(message, "An unexpected error occurred.")
 
+    @instrumented
     def delete_plan_command(self, message):
         if self.is_admin(message.from_user.id):
-            with self.get_db_session() as session:
-                # Fetch plans from the database and order them by price descending
-                plans = session.query(SubscriptionPlan).order_by(SubscriptionPlan.price.desc()).all()
-                if plans:
-                    # Create inline keyboard
-                    markup = types.InlineKeyboardMarkup()
-                    for plan in plans:
-                        # Button text contains plan name and price
-                        button_text = f"{plan.name} - ${plan.price}"
-                        # Callback data contains a unique identifier, e.g., "delete_1"
-                        markup.add(types.InlineKeyboardButton(button_text, callback_data=f"delete_{plan.plan_id}"))
-                    self.bot.send_message(message.chat.id, "Select a plan to delete:", reply_markup=markup)
-                else:
-                    self.bot.send_message(message.chat.id, "No subscription plans found.")
+            if self.plans.plans():
+                markup = self.plans.keyboard('delete', self.build_delete_plan_markup)
+                self.bot.send_message(message.chat.id, "Select a plan to delete:", reply_markup=markup)
+            else:
+                self.bot.send_message(message.chat.id, "No subscription plans found.")
         else:
             self.bot.reply_to(message, "You are not authorized to delete plans.")
 
+    def build_delete_plan_markup(self, plans):
+        markup = types.InlineKeyboardMarkup()
+        # Order plans by price descending
+        for plan in sorted(plans, key=lambda plan: plan.price, reverse=True):
+            # Button text contains plan name and price
+            button_text = f"{plan.name} - ${plan.price}"
+            markup.add(types.InlineKeyboardButton(button_text, callback_data=self.callbacks.encode(callbacks.DELETE_PLAN, plan.plan_id)))
+        return markup.to_json()
+
     def process_delete_plan(self, message):
         try:
             # Assuming the plan ID is an integer
             plan_id = int(message.text.strip())
             
-            with Session() as session:
+            with self.get_db_session() as session:
                 # Look up the plan by ID
                 plan_to_delete = session.query(SubscriptionPlan).filter_by(plan_id=plan_id).first()
                 if plan_to_delete:
                     # Delete the plan from the database
                     session.delete(plan_to_delete)
                     session.commit()
+                    self.plans.invalidate()
                     reply = f"Plan with ID {plan_id} has been deleted."
                 else:
                     # If the plan is not found, inform the user
@@ -521,15 +660,23 @@ class Bot:
             logging.error(f"Error in process_delete_plan: {e}")
             self.bot.reply_to(message, "An unexpected error occurred while attempting to delete the plan.")
 
+    @instrumented
+    def delete_plan_callback(self, call, plan_id):
+        if self.is_admin(call.from_user.id):
+            self.delete_plan_by_id(call.message, plan_id)
+        self.bot.answer_callback_query(call.id)
+
     def delete_plan_by_id(self, message, plan_id):
         try:
             with self.get_db_session() as session:
                 # Look up the plan by ID and delete it
                 plan_to_delete = session.query(SubscriptionPlan).filter_by(plan_id=plan_id).first()
                 if plan_to_delete:
+                    name = plan_to_delete.name
                     session.delete(plan_to_delete)
                     session.commit()
-                    reply = f"Plan '{plan_to_delete.name}' has been deleted."
+                    self.plans.invalidate()
+                    reply = f"Plan '{name}' has been deleted."
                 else:
                     reply = "Plan not found."
             self.bot.edit_message_text(chat_id=message.chat.id, message_id=message.message_id, text=reply)
@@ -537,6 +684,37 @@ class Bot:
             logging.error(f"Error in delete_plan_by_id: {e}")
             self.bot.answer_callback_query(message.id, "An error occurred while attempting to delete the plan.")
 
+    @instrumented
+    def send_mass_message_command(self, message):
+        if self.is_admin(message.from_user.id):
+            self.bot.reply_to(message, "Send the message you want to broadcast to all users.")
+            self.expect_reply(message.chat.id, 'mass_message')
+        else:
+            self.bot.reply_to(message, "You are not authorized to send mass messages.")
+
+    @instrumented
+    def process_mass_message(self, message):
+        broadcast_id = self.broadcasts.create(message.text, created_by=message.from_user.id)
+        self.bot.reply_to(message, f"Broadcast {broadcast_id} started.")
+        self.start_broadcast(broadcast_id, notify_chat_id=message.chat.id)
+
+    def start_broadcast(self, broadcast_id, notify_chat_id=None):
+        # Run the broadcast off the handler thread, it can take a long time
+        def run():
+            try:
+                report = self.broadcasts.run(broadcast_id)
+                if notify_chat_id:
+                    self.queue_message(notify_chat_id, f"Broadcast {broadcast_id} finished: {report.sent} sent, {report.failed} failed.")
+            except Exception as e:
+                logging.error(f"Broadcast {broadcast_id} stopped: {e}")
+
+        threading.Thread(target=run, name=f"broadcast-{broadcast_id}", daemon=True).start()
+
+    def resume_broadcasts(self):
+        for broadcast_id in self.broadcasts.unfinished():
+            logging.info(f"Resuming broadcast {broadcast_id}")
+            self.start_broadcast(broadcast_id)
+
 #########################################
 #########################################
 ################HANDLERS#################
@@ -568,6 +746,10 @@ class Bot:
         def handle_generate_code(message):
             self.generate_redemption_code(message)
 
+        @self.bot.message_handler(commands=['generate_codes'])
+        def handle_generate_codes(message):
+            self.generate_code_batch(message)
+
         # Redeem code
         @self.bot.message_handler(commands=['redeem'])
         def handle_redeem(message):
@@ -585,29 +767,35 @@ class Bot:
         @self.bot.message_handler(commands=['delete_plan'])
         def handle_delete_plan(message):
             self.delete_plan_command(message)
+
+        @self.bot.message_handler(commands=['send_message'])
+        def handle_send_message(message):
+            self.send_mass_message_command(message)
         
         @self.bot.message_handler(content_types=['text'])
         def handle_text_message(message):
-            self.channel_id_check(message)
+            if not self.run_pending_step(message):
+                self.channel_id_check(message)
 
         # Handle callback queries for payment
         @self.bot.callback_query_handler(func=lambda call: True)
         def handle_callback_query(call):
-            if call.data.startswith('subscribe_'):
-                self.subscribe_callback(call)
-            elif call.data.startswith('pay_online_') or call.data.startswith('pay_direct_'):
-                self.payment_method_callback(call)
-            elif call.data.startswith('approve_') or call.data.startswith('deny_'):
-                self.handle_admin_decision(call)
-            # ... (handle other callback queries or provide a default response)
-            else:
+            # Unknown, outdated or forged button data is rejected by the router
+            if not self.callbacks.dispatch(call.data, call):
                 self.bot.answer_callback_query(call.id, "Action not recognized.")
 
 
         # ... (register other command handlers)
 
 
-my_bot = Bot()
-my_bot.setup_handlers()
-my_bot.start_polling()
+if __name__ == '__main__':
+    my_bot = Bot()
+    my_bot.setup_handlers()
+    my_bot.start_metrics()
+    my_bot.resume_broadcasts()
+    my_bot.start_scheduler()
+    if WEBHOOK_URL:
+        my_bot.start_webhook()
+    else:
+        my_bot.start_polling()
 
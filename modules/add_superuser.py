@@ -1,4 +1,5 @@
-from models import Admin, Base, engine, Session
+from modules.database import get_database
+from modules.models import Admin, Base
 
 # Replace with your actual details
 SUPERUSER_ID =  89779164 # Your Telegram user ID
@@ -6,8 +7,12 @@ USERNAME = 'aaghania'
 FIRST_NAME = 'Arman'
 LAST_NAME = 'Aghania'
 
+# Run from the project root with: python -m modules.add_superuser
+db = get_database()
+Base.metadata.create_all(db.engine)
+
 # Create the session and add the superuser
-with Session() as session:
+with db.session_scope() as session:
     superuser = Admin(
         admin_id=SUPERUSER_ID,
         username=USERNAME,
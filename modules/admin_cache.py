@@ -0,0 +1,73 @@
+import threading
+import time
+
+from .models import Admin
+from .params import ADMIN_CACHE_TTL, ADMIN_AUTH_TTL
+
+
+class AdminRegistry:
+    """
+    In-memory copy of the admins table with a TTL.
+
+    Lookups are served from a frozen snapshot and only hit the database when the
+    snapshot is older than ttl seconds or after invalidate() was called, e.g.
+    when an admin is added. Admins added by another process (such as
+    modules/add_superuser.py) are picked up once the TTL runs out.
+
+    invalidate() only reaches this process, so check(), which authorizes admin
+    actions, accepts a snapshot no older than auth_ttl: a change made by another
+    process takes at most that long to be enforced here.
+    """
+
+    def __init__(self, session_factory, ttl=ADMIN_CACHE_TTL, auth_ttl=ADMIN_AUTH_TTL):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.auth_ttl = min(auth_ttl, ttl)
+        self.lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.admins = None  # admin_id -> is_superuser
+        self.loaded_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def is_fresh(self, max_age=None):
+        return self.admins is not None and time.monotonic() - self.loaded_at < (max_age or self.ttl)
+
+    def _snapshot(self, max_age=None):
+        admins = self.admins
+        if admins is not None and time.monotonic() - self.loaded_at < (max_age or self.ttl):
+            with self.stats_lock:
+                self.hits += 1
+            return admins
+        return self.refresh(max_age)
+
+    def refresh(self, max_age=None):
+        """Reload the admins table unless another thread just did."""
+        with self.lock:
+            if self.is_fresh(max_age):
+                with self.stats_lock:
+                    self.hits += 1
+                return self.admins
+            with self.stats_lock:
+                self.misses += 1
+            with self.session_factory() as session:
+                rows = session.query(Admin.admin_id, Admin.is_superuser).all()
+            self.admins = {row.admin_id: bool(row.is_superuser) for row in rows}
+            self.loaded_at = time.monotonic()
+            return self.admins
+
+    def check(self, user_id, superuser=False):
+        """Whether user_id may perform an admin (or superuser) action, from a snapshot at most auth_ttl old."""
+        is_superuser = self._snapshot(self.auth_ttl).get(user_id)
+        return is_superuser is not None and (not superuser or is_superuser)
+
+    def admin_ids(self):
+        return list(self._snapshot())
+
+    def invalidate(self):
+        with self.lock:
+            self.admins = None
+
+    def stats(self):
+        with self.stats_lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.admins or ())}
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from datetime import datetime
+from functools import partial
+
+from .models import AdminNotification, Payment
+
+
+def message_id_of(message):
+    # telebot messages carry message_id, Telethon messages id
+    return getattr(message, 'message_id', None) or message.id
+
+
+class AdminFanout:
+    """
+    Sends a payment's receipt to every admin at once and keeps track of the copies.
+
+    Each admin gets one message, submitted to the outbound dispatcher in parallel.
+    The message id of every copy is stored in admin_notifications, so once an admin
+    decides, all copies can be edited and nobody acts on a stale one. A copy can
+    complete after an admin already decided on another one and edit_all ran;
+    such late copies are handed to late_edit.
+    """
+
+    def __init__(self, session_scope, outbox, late_edit=None):
+        """
+        :param session_scope: Context manager factory yielding a database session.
+        :param outbox: An OutboundDispatcher (threads) or AsyncOutboundDispatcher (asyncio).
+        :param late_edit: Called through the outbox as late_edit(admin_id, message_id, payment_id, status)
+                          for a copy recorded after the payment left 'pending'. A coroutine function
+                          with the asyncio dispatcher.
+        """
+        self.session_scope = session_scope
+        self.outbox = outbox
+        self.late_edit = late_edit
+        self.tasks = set()
+
+    def record(self, payment_id, copies):
+        """
+        Store the (admin_id, message_id) pairs sent for a payment and return the
+        payment's status read after they were committed.
+
+        A decision committed before that read is seen here, and one committed
+        after it finds the copies in edit_all, so no copy is missed by both.
+        """
+        if not copies:
+            return None
+        now = datetime.utcnow()
+        with self.session_scope() as session:
+            for admin_id, message_id in copies:
+                session.merge(AdminNotification(payment_id=payment_id, admin_id=admin_id, message_id=message_id, sent_at=now))
+            session.commit()
+            return session.query(Payment.payment_status).filter_by(payment_id=payment_id).scalar()
+
+    def copies(self, payment_id):
+        with self.session_scope() as session:
+            return [(row.admin_id, row.message_id) for row in
+                    session.query(AdminNotification.admin_id, AdminNotification.message_id).filter_by(payment_id=payment_id)]
+
+    def _recorded(self, payment_id, admin_id, future):
+        # Failed sends are already logged by the dispatcher
+        if future.exception() is not None:
+            return
+        message_id = message_id_of(future.result())
+        status = self.record(payment_id, [(admin_id, message_id)])
+        if status != 'pending' and self.late_edit:
+            self.outbox.submit(admin_id, self.late_edit, admin_id, message_id, payment_id, status)
+
+    def send(self, payment_id, admin_ids, send, *args, **kwargs):
+        """
+        Submit send(admin_id, *args, **kwargs) for every admin without waiting.
+
+        Each copy is recorded as soon as its send completes, and edited right
+        away when the payment was decided meanwhile. Returns the futures.
+        """
+        futures = []
+        for admin_id in admin_ids:
+            future = self.outbox.submit(admin_id, send, admin_id, *args, **kwargs)
+            future.add_done_callback(partial(self._recorded, payment_id, admin_id))
+            futures.append(future)
+        return futures
+
+    def edit_all(self, payment_id, edit):
+        """Submit edit(admin_id, message_id) for every recorded copy. Returns the number of copies."""
+        copies = self.copies(payment_id)
+        for admin_id, message_id in copies:
+            self.outbox.submit(admin_id, edit, admin_id, message_id)
+        return len(copies)
+
+    async def send_async(self, adb, payment_id, admin_ids, send, *args, **kwargs):
+        """Await send(admin_id, *args, **kwargs) for every admin concurrently and record the copies."""
+        results = await asyncio.gather(*(self.outbox.send(admin_id, send, admin_id, *args, **kwargs) for admin_id in admin_ids),
+                                       return_exceptions=True)
+        copies = [(admin_id, message_id_of(result)) for admin_id, result in zip(admin_ids, results)
+                  if not isinstance(result, Exception)]
+        if len(copies) < len(admin_ids):
+            logging.warning(f"Receipt for payment {payment_id} reached {len(copies)} of {len(admin_ids)} admins")
+        status = await adb.call(self.record, payment_id, copies)
+        if copies and status != 'pending' and self.late_edit:
+            await asyncio.gather(*(self.outbox.send(admin_id, self.late_edit, admin_id, message_id, payment_id, status)
+                                   for admin_id, message_id in copies), return_exceptions=True)
+        return copies
+
+    def submit_async(self, adb, payment_id, admin_ids, send, *args, **kwargs):
+        """Run send_async in the background and return the task, which is kept until it finishes."""
+        task = asyncio.ensure_future(self.send_async(adb, payment_id, admin_ids, send, *args, **kwargs))
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Receipt fan-out failed: {task.exception()}")
+
+    async def edit_all_async(self, adb, payment_id, edit):
+        """Await edit(admin_id, message_id) for every recorded copy concurrently."""
+        copies = await adb.call(self.copies, payment_id)
+        await asyncio.gather(*(self.outbox.send(admin_id, edit, admin_id, message_id) for admin_id, message_id in copies),
+                             return_exceptions=True)
+        return len(copies)
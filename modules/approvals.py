@@ -0,0 +1,136 @@
+import logging
+import threading
+from collections import namedtuple, OrderedDict
+
+from sqlalchemy import update
+
+from .models import Payment, SubscriptionPlan
+from .params import DECIDED_PAYMENTS_CACHE_SIZE
+from .subscriptions import extend_subscription
+
+PaymentDecision = namedtuple('PaymentDecision', ['payment_id', 'user_id', 'status', 'applied', 'expiry'])
+
+# A payment leaves 'pending' exactly once, through one of these transitions
+TRANSITIONS = {'approve': 'confirmed', 'deny': 'denied'}
+
+
+def attach_receipt(session, user_id, message_id):
+    """
+    Store a receipt message on the user's latest pending payment.
+
+    Returns the payment id, or None when the user has no pending payment.
+    Does not commit.
+    """
+    payment = session.query(Payment).filter_by(user_id=user_id, payment_status='pending') \
+        .order_by(Payment.payment_date.desc()).first()
+    if not payment:
+        return None
+    payment.receipt_message_id = message_id
+    return payment.payment_id
+
+
+def decide_payment(session, payment_id, decision, today=None):
+    """
+    Move a pending payment to confirmed or denied, once.
+
+    The transition is a conditional UPDATE on payment_status = 'pending', so of
+    any number of concurrent or repeated decisions exactly one matches the row.
+    An approval extends the subscription in the same transaction; if that is
+    not possible (the user or plan is gone) everything is rolled back and the
+    payment stays pending. Commits when the transition applies.
+    """
+    status = TRANSITIONS[decision]
+    claim = (
+        update(Payment)
+        .where(Payment.payment_id == payment_id, Payment.payment_status == 'pending')
+        .values(payment_status=status)
+    )
+    if session.bind.dialect.update_returning:
+        row = session.execute(claim.returning(Payment.user_id, Payment.plan_id)).first()
+    else:
+        row = session.query(Payment.user_id, Payment.plan_id).filter_by(payment_id=payment_id).first() \
+            if session.execute(claim).rowcount == 1 else None
+    if row is None:
+        # Already decided, or no such payment
+        session.rollback()
+        current = session.query(Payment.user_id, Payment.payment_status).filter_by(payment_id=payment_id).first()
+        return PaymentDecision(payment_id, current and current.user_id, current and current.payment_status, False, None)
+
+    expiry = None
+    if status == 'confirmed':
+        plan = session.query(SubscriptionPlan.name, SubscriptionPlan.duration_days).filter_by(plan_id=row.plan_id).first()
+        if plan:
+            expiry = extend_subscription(session, row.user_id, plan.duration_days, today=today,
+                                         plan_type=plan.name, payment_status='confirmed')
+        if expiry is None:
+            session.rollback()
+            logging.error(f"Payment {payment_id} left pending: user {row.user_id} or plan {row.plan_id} no longer exists")
+            return PaymentDecision(payment_id, row.user_id, 'pending', False, None)
+    session.commit()
+    return PaymentDecision(payment_id, row.user_id, status, True, expiry)
+
+
+def conflict_reply(result):
+    """What to tell an admin whose decision did not apply."""
+    if result.status in TRANSITIONS.values():
+        return f"This payment was already {result.status}."
+    if result.status is None:
+        return "This payment no longer exists."
+    return "This payment is being processed or could not be updated, please try again later."
+
+
+class ApprovalPipeline:
+    """
+    Exactly-once admin decisions on payments.
+
+    decide_payment guarantees a single transition across processes. In front of
+    it, payments this process has seen decided are remembered in a bounded LRU
+    and payments being decided right now are tracked, so double taps, a second
+    admin on the same process and redelivered callbacks are turned away without
+    touching the database.
+    """
+
+    def __init__(self, session_scope, max_entries=DECIDED_PAYMENTS_CACHE_SIZE):
+        self.session_scope = session_scope
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.decided = OrderedDict()  # payment_id -> final status
+        self.in_flight = set()
+        self.applied = 0
+        self.rejected = 0  # refused by the database, decided elsewhere
+        self.turned_away = 0  # refused here without a query
+
+    def _remember(self, payment_id, status):
+        with self.lock:
+            self.decided[payment_id] = status
+            self.decided.move_to_end(payment_id)
+            while len(self.decided) > self.max_entries:
+                self.decided.popitem(last=False)
+
+    def decide(self, payment_id, decision, today=None):
+        """Apply an admin's decision and return a PaymentDecision. Blocking, call it off the event loop."""
+        with self.lock:
+            status = self.decided.get(payment_id)
+            if status is not None or payment_id in self.in_flight:
+                self.turned_away += 1
+                return PaymentDecision(payment_id, None, status or 'pending', False, None)
+            self.in_flight.add(payment_id)
+        try:
+            with self.session_scope() as session:
+                result = decide_payment(session, payment_id, decision, today=today)
+        finally:
+            with self.lock:
+                self.in_flight.discard(payment_id)
+
+        if result.status in TRANSITIONS.values():
+            self._remember(payment_id, result.status)
+        with self.lock:
+            if result.applied:
+                self.applied += 1
+            else:
+                self.rejected += 1
+        return result
+
+    def stats(self):
+        return {'applied': self.applied, 'rejected': self.rejected, 'turned_away': self.turned_away,
+                'remembered': len(self.decided)}
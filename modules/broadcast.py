@@ -0,0 +1,188 @@
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import update, or_
+
+from .models import User, Broadcast, BroadcastDelivery
+from .params import BROADCAST_PAGE_SIZE, BROADCAST_LEASE_SECONDS
+
+
+class BroadcastReport:
+    """Counters for a single run of a broadcast."""
+
+    def __init__(self, broadcast_id):
+        self.broadcast_id = broadcast_id
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        return (self.sent + self.failed) / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"broadcast={self.broadcast_id} sent={self.sent} failed={self.failed} "
+                f"skipped={self.skipped} elapsed={self.elapsed:.1f}s rate={self.rate:.1f}/s")
+
+
+class BroadcastEngine:
+    """
+    Sends one message to every user, resumably.
+
+    Recipients are read in user_id keyset pages. Each page is pushed through the
+    outbound dispatcher, then its delivery rows and the broadcast cursor are
+    written in one transaction. A restarted broadcast continues after the cursor
+    and skips recipients already recorded as sent, so at most one page worth of
+    messages can be repeated after a crash.
+
+    A replica sends a broadcast only while it holds its lease, taken with a
+    conditional UPDATE like JobScheduler.claim and renewed before every page.
+    Other replicas resume a running broadcast only once its lease has expired,
+    so two of them never send the same broadcast at once.
+    """
+
+    def __init__(self, session_scope, outbox, send, page_size=BROADCAST_PAGE_SIZE, owner=None,
+                 lease_seconds=BROADCAST_LEASE_SECONDS):
+        """
+        :param session_scope: Context manager factory yielding a database session.
+        :param outbox: An OutboundDispatcher used to rate-limit and parallelize the sends.
+        :param send: Callable taking (chat_id, text), e.g. TeleBot.send_message.
+        :param page_size: Number of recipients read and recorded per transaction.
+        :param owner: Name of this replica in the lease, defaults to host:pid.
+        :param lease_seconds: How long a lease lasts without renewal.
+        """
+        self.session_scope = session_scope
+        self.outbox = outbox
+        self.send = send
+        self.page_size = page_size
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease = timedelta(seconds=lease_seconds)
+
+    def create(self, text, created_by=None):
+        with self.session_scope() as session:
+            broadcast = Broadcast(text=text, status='running', sent_count=0, failed_count=0,
+                                  created_by=created_by, created_at=datetime.utcnow())
+            session.add(broadcast)
+            session.commit()
+            return broadcast.broadcast_id
+
+    def unfinished(self):
+        """Running broadcasts no replica holds a lease on, i.e. whose sender stopped."""
+        now = datetime.utcnow()
+        with self.session_scope() as session:
+            return [row.broadcast_id for row in
+                    session.query(Broadcast.broadcast_id)
+                    .filter(Broadcast.status == 'running',
+                            or_(Broadcast.locked_until.is_(None), Broadcast.locked_until < now))
+                    .order_by(Broadcast.broadcast_id)]
+
+    def claim(self, broadcast_id):
+        """Take the lease on a running broadcast. Returns False when another replica holds it."""
+        now = datetime.utcnow()
+        with self.session_scope() as session:
+            claimed = session.execute(
+                update(Broadcast)
+                .where(Broadcast.broadcast_id == broadcast_id, Broadcast.status == 'running',
+                       or_(Broadcast.locked_until.is_(None), Broadcast.locked_until < now))
+                .values(locked_by=self.owner, locked_until=now + self.lease)
+            ).rowcount
+            session.commit()
+        return claimed == 1
+
+    def renew(self, broadcast_id):
+        """Extend this replica's lease. Returns False when it was lost."""
+        with self.session_scope() as session:
+            renewed = session.execute(
+                update(Broadcast)
+                .where(Broadcast.broadcast_id == broadcast_id, Broadcast.locked_by == self.owner)
+                .values(locked_until=datetime.utcnow() + self.lease)
+            ).rowcount
+            session.commit()
+        return renewed == 1
+
+    def next_page(self, broadcast_id, cursor):
+        """Return the next page of recipient ids and those of them already delivered."""
+        with self.session_scope() as session:
+            query = session.query(User.user_id)
+            if cursor is not None:
+                query = query.filter(User.user_id > cursor)
+            recipients = [row.user_id for row in query.order_by(User.user_id).limit(self.page_size)]
+            if not recipients:
+                return [], {}
+            previous = session.query(BroadcastDelivery.user_id, BroadcastDelivery.status) \
+                .filter(BroadcastDelivery.broadcast_id == broadcast_id,
+                        BroadcastDelivery.user_id.in_(recipients)).all()
+            return recipients, {row.user_id: row.status for row in previous}
+
+    def run(self, broadcast_id):
+        report = BroadcastReport(broadcast_id)
+        started = time.perf_counter()
+        if not self.claim(broadcast_id):
+            logging.info(f"Broadcast {broadcast_id} is finished or being sent by another replica")
+            return report
+
+        with self.session_scope() as session:
+            broadcast = session.query(Broadcast).filter_by(broadcast_id=broadcast_id).first()
+            if not broadcast or broadcast.status != 'running':
+                return report
+            text, cursor = broadcast.text, broadcast.cursor_user_id
+
+        while True:
+            recipients, previous = self.next_page(broadcast_id, cursor)
+            if not recipients:
+                break
+            if not self.renew(broadcast_id):
+                logging.warning(f"Lost the lease on broadcast {broadcast_id}, another replica continues it")
+                report.elapsed = time.perf_counter() - started
+                return report
+
+            pending = [user_id for user_id in recipients if previous.get(user_id) != 'sent']
+            report.skipped += len(recipients) - len(pending)
+            futures = [(user_id, self.outbox.submit(user_id, self.send, user_id, text)) for user_id in pending]
+
+            deliveries = []
+            attempted_at = datetime.utcnow()
+            for user_id, future in futures:
+                try:
+                    future.result()
+                    status, error = 'sent', None
+                    report.sent += 1
+                except Exception as e:
+                    status, error = 'failed', str(e)[:255]
+                    report.failed += 1
+                deliveries.append({'broadcast_id': broadcast_id, 'user_id': user_id, 'status': status,
+                                   'error': error, 'attempted_at': attempted_at})
+
+            cursor = recipients[-1]
+            self.record_page(broadcast_id, deliveries, previous, cursor)
+
+        with self.session_scope() as session:
+            session.query(Broadcast).filter_by(broadcast_id=broadcast_id, locked_by=self.owner) \
+                .update({'status': 'finished', 'finished_at': datetime.utcnow(), 'locked_by': None, 'locked_until': None})
+            session.commit()
+
+        report.elapsed = time.perf_counter() - started
+        logging.info(f"Broadcast finished: {report}")
+        return report
+
+    def record_page(self, broadcast_id, deliveries, previous, cursor):
+        """Store the page's delivery outcomes and advance the cursor in one transaction."""
+        inserts = [row for row in deliveries if row['user_id'] not in previous]
+        updates = [row for row in deliveries if row['user_id'] in previous]
+        sent = sum(1 for row in deliveries if row['status'] == 'sent')
+
+        with self.session_scope() as session:
+            if inserts:
+                session.bulk_insert_mappings(BroadcastDelivery, inserts)
+            if updates:
+                session.bulk_update_mappings(BroadcastDelivery, updates)
+            session.query(Broadcast).filter_by(broadcast_id=broadcast_id).update({
+                'cursor_user_id': cursor,
+                'sent_count': Broadcast.sent_count + sent,
+                'failed_count': Broadcast.failed_count + len(deliveries) - sent,
+            })
+            session.commit()
@@ -0,0 +1,158 @@
+import csv
+import io
+import secrets
+import string
+import tempfile
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from .models import Code
+from .params import CODE_LENGTH, CODE_BATCH_LIMIT, CODE_BATCH_CHUNK
+
+CODE_ALPHABET = string.ascii_uppercase + string.digits
+UNBIASED_LIMIT = 256 - 256 % len(CODE_ALPHABET)
+CSV_COLUMNS = ['code', 'campaign', 'code_type', 'associated_days', 'discount_amount', 'expiry_date']
+EXPORT_SPOOL_SIZE = 4 * 1024 * 1024  # bytes of CSV kept in memory before the export moves to disk
+
+
+def new_code(length=CODE_LENGTH):
+    """A single random code from the OS CSPRNG."""
+    return ''.join(secrets.choice(CODE_ALPHABET) for _ in range(length))
+
+
+def generate_codes(count, length=CODE_LENGTH, taken=()):
+    """Return count distinct codes, none of them in taken."""
+    taken = set(taken)
+    codes = set()
+    while len(codes) < count:
+        # Draw random bytes in bulk and keep those below a multiple of the alphabet size so every
+        # character stays uniformly distributed (rejection sampling)
+        raw = secrets.token_bytes((count - len(codes)) * length * 2)
+        chars = ''.join(CODE_ALPHABET[byte % len(CODE_ALPHABET)] for byte in raw if byte < UNBIASED_LIMIT)
+        for start in range(0, len(chars) - length + 1, length):
+            code = chars[start:start + length]
+            if code not in taken:
+                codes.add(code)
+                if len(codes) == count:
+                    break
+    return list(codes)
+
+
+def find_existing(session, codes, chunk_size=1000):
+    """The subset of codes already stored, looked up through the primary key."""
+    existing = set()
+    for start in range(0, len(codes), chunk_size):
+        chunk = codes[start:start + chunk_size]
+        existing.update(code for code, in session.query(Code.code).filter(Code.code.in_(chunk)))
+    return existing
+
+
+def iter_csv(rows, header=True):
+    """Yield the CSV export of code rows line by line, header first unless header is False."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(CSV_COLUMNS)
+    for row in rows:
+        writer.writerow(['' if row.get(column) is None else row[column] for column in CSV_COLUMNS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+
+class CodeBatch:
+    """
+    Bulk generation of redemption codes for a campaign.
+
+    Codes are generated, checked and written chunk_size at a time in a single
+    transaction: each chunk comes from the secrets module, is made unique
+    against the stored codes (which include the chunks already written), goes
+    out in one multi-row insert (COPY on PostgreSQL through psycopg2) and is
+    appended to the CSV export, which is spooled to disk once it outgrows
+    memory. Only one chunk of rows is ever held in memory.
+    """
+
+    def __init__(self, count, days=None, campaign=None, code_type=None, discount_amount=None, expiry_date=None,
+                 length=CODE_LENGTH, chunk_size=CODE_BATCH_CHUNK):
+        self.count = count
+        self.length = length
+        self.chunk_size = chunk_size
+        self.template = {
+            'campaign': campaign,
+            'code_type': code_type,
+            'associated_days': days,
+            'discount_amount': discount_amount,
+            'expiry_date': expiry_date,
+            'used_status': False,
+        }
+        self.document = None
+        self.stored = 0
+
+    def generate(self, session, count):
+        """Rows for count new codes, none of them stored yet."""
+        codes = generate_codes(count, self.length)
+        # Collisions with stored codes are astronomically rare, but a clash would fail the whole insert
+        existing = find_existing(session, codes)
+        while existing:
+            codes = [code for code in codes if code not in existing]
+            extra = generate_codes(count - len(codes), self.length, taken=codes)
+            existing = find_existing(session, extra)
+            codes.extend(extra)
+        return [dict(self.template, code=code) for code in codes]
+
+    def insert(self, session):
+        """Generate, store and export the codes in one transaction. Returns the number stored."""
+        self.document = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+        self.stored = 0
+        while self.stored < self.count:
+            rows = self.generate(session, min(self.chunk_size, self.count - self.stored))
+            self.store(session, rows)
+            for chunk in iter_csv(rows, header=not self.stored):
+                self.document.write(chunk.encode())
+            self.stored += len(rows)
+        session.commit()
+        return self.stored
+
+    def store(self, session, rows):
+        if session.bind.dialect.driver == 'psycopg2':
+            self.copy(session, rows)
+        else:
+            session.bulk_insert_mappings(Code, rows)
+
+    def copy(self, session, rows):
+        columns = CSV_COLUMNS + ['used_status']
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(['' if row[column] is None else row[column] for column in columns])
+        buffer.seek(0)
+        cursor = session.connection().connection.cursor()
+        cursor.copy_expert(f"COPY codes ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    def export(self):
+        """The CSV file written by insert(), rewound."""
+        self.document.seek(0)
+        return self.document
+
+
+def parse_batch_command(text, limit=CODE_BATCH_LIMIT):
+    """
+    Build a CodeBatch from "/generate_codes <count> <days> <campaign> [expiry YYYY-MM-DD] [discount]".
+
+    Raises ValueError with a message for the admin when the arguments are wrong.
+    """
+    parts = text.split()[1:]
+    if len(parts) < 3:
+        raise ValueError("Usage: /generate_codes <count> <days> <campaign> [expiry YYYY-MM-DD] [discount]")
+    try:
+        count, days = int(parts[0]), int(parts[1])
+        expiry_date = date.fromisoformat(parts[3]) if len(parts) > 3 else None
+        discount_amount = Decimal(parts[4]) if len(parts) > 4 else None
+    except (ValueError, InvalidOperation):
+        raise ValueError("Count and days must be numbers, expiry a YYYY-MM-DD date and discount an amount.")
+    if not 0 < count <= limit or days <= 0:
+        raise ValueError(f"Count must be between 1 and {limit} and days positive.")
+    return CodeBatch(count, days=days, campaign=parts[2], code_type='campaign',
+                     discount_amount=discount_amount, expiry_date=expiry_date)
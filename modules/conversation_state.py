@@ -0,0 +1,136 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .params import CONVERSATION_STORE_URL, CONVERSATION_TTL, CONVERSATION_MAX_ENTRIES
+
+
+class MemoryStateStore:
+    """
+    Per-process conversation state with TTL eviction and an LRU bound.
+
+    Fast and simple, but the state is lost on restart and is not shared between
+    processes; use the SQLite or Redis store for that.
+    """
+
+    def __init__(self, ttl=CONVERSATION_TTL, max_entries=CONVERSATION_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return dict(entry[1])
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + (ttl or self.ttl), dict(value))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self.lock:
+            expired = [key for key, (expires_at, _) in self.entries.items() if expires_at <= now]
+            for key in expired:
+                del self.entries[key]
+        return len(expired)
+
+
+class SQLiteStateStore:
+    """
+    Conversation state in a SQLite file, shared by every bot process on the host.
+
+    Lookups go through the primary key; expired rows are ignored on read and
+    deleted in batches every purge_every writes.
+    """
+
+    def __init__(self, path, ttl=CONVERSATION_TTL, purge_every=1000):
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_state (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM conversation_state WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO conversation_state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + (ttl or self.ttl)))
+            self.writes += 1
+            purge = self.writes % self.purge_every == 0
+        if purge:
+            self.purge_expired()
+
+    def delete(self, key):
+        with self.lock:
+            self.connection.execute("DELETE FROM conversation_state WHERE key = ?", (key,))
+
+    def purge_expired(self):
+        with self.lock:
+            return self.connection.execute("DELETE FROM conversation_state WHERE expires_at <= ?", (time.time(),)).rowcount
+
+
+class RedisStateStore:
+    """
+    Conversation state in Redis, shared by every bot process.
+
+    Works with any client exposing redis-py's get/set/delete, so a local
+    stand-in such as fakeredis can replace the server. Redis expires the keys
+    itself.
+    """
+
+    def __init__(self, client, ttl=CONVERSATION_TTL, prefix='conversation:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl or self.ttl)))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def purge_expired(self):
+        return 0
+
+
+def make_state_store(url=CONVERSATION_STORE_URL, ttl=CONVERSATION_TTL):
+    """Build the conversation store described by url (memory://, sqlite:///path or redis://...)."""
+    if url.startswith('memory://'):
+        return MemoryStateStore(ttl=ttl)
+    if url.startswith('sqlite:///'):
+        return SQLiteStateStore(url[len('sqlite:///'):], ttl=ttl)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        # Optional dependency, only needed when Redis is configured
+        import redis
+        return RedisStateStore(redis.Redis.from_url(url), ttl=ttl)
+    raise ValueError(f"Unsupported conversation store URL: {url}")
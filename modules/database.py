@@ -0,0 +1,173 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from .params import DB_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_EXECUTOR_WORKERS, SQL_ECHO
+from .sql_instrumentation import SQLInstrumentation
+
+
+class PoolWaitStats:
+    """How often and how long callers waited for a pooled connection."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def observe(self, seconds, timed_out=False):
+        with self.lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_avg': self.wait_total / self.checkouts if self.checkouts else 0.0,
+                'wait_max': self.wait_max,
+            }
+
+
+def timed_pool_class(stats):
+    """QueuePool subclass that records checkout wait times into stats."""
+
+    class TimedQueuePool(QueuePool):
+        # recreate() instantiates self.__class__, so the stats survive pool resets
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except Exception:
+                stats.observe(time.perf_counter() - started, timed_out=True)
+                raise
+            stats.observe(time.perf_counter() - started)
+            return connection
+
+    return TimedQueuePool
+
+
+class Database:
+    """
+    The engine and session registry shared by the bots and the scripts.
+
+    Sessions are scoped to the current thread and removed at the end of the
+    outermost session_scope(), so each update handled by telebot's worker
+    threads gets its own session and connections go back to the pool right
+    away. A scope opened inside another one on the same thread (e.g. a cache
+    reload in the middle of a handler) shares the outer session and leaves it
+    open.
+    """
+
+    def __init__(self, url=DB_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                 pool_timeout=DB_POOL_TIMEOUT, pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=DB_POOL_PRE_PING, echo=SQL_ECHO,
+                 instrumentation=None):
+        self.url = url
+        self.wait_stats = PoolWaitStats()
+        options = {'pool_pre_ping': pool_pre_ping, 'echo': echo}
+        if not url.startswith('sqlite'):
+            # SQLite picks its own pool class, the sizing options only apply to server databases
+            options.update(poolclass=timed_pool_class(self.wait_stats), pool_size=pool_size, max_overflow=max_overflow,
+                           pool_timeout=pool_timeout, pool_recycle=pool_recycle)
+        self.engine = create_engine(url, **options)
+        self.sql = instrumentation or SQLInstrumentation()
+        self.sql.attach(self.engine)
+        self.SessionLocal = scoped_session(sessionmaker(autoflush=False, bind=self.engine))
+        self.depth = threading.local()
+
+    @contextmanager
+    def session_scope(self):
+        """Provide a session for one unit of work and release it afterwards."""
+        session = self.SessionLocal()
+        self.depth.value = getattr(self.depth, 'value', 0) + 1
+        try:
+            yield session
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            self.depth.value -= 1
+            if not self.depth.value:
+                self.SessionLocal.remove()
+
+    def pool_stats(self):
+        pool = self.engine.pool
+        stats = {}
+        if isinstance(pool, QueuePool):
+            stats.update({
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': pool.overflow(),
+            })
+        stats.update(self.wait_stats.snapshot())
+        return stats
+
+
+class AsyncDatabase:
+    """
+    Runs blocking database work for asyncio code on a dedicated thread pool.
+
+    The pool is sized like the connection pool, so queries queue for a thread
+    instead of for a connection and the event loop never blocks on either.
+    """
+
+    def __init__(self, database, max_workers=DB_EXECUTOR_WORKERS):
+        self.database = database
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db')
+        self.waiting = 0
+        self.lock = threading.Lock()
+
+    async def _submit(self, work):
+        def start():
+            with self.lock:
+                self.waiting -= 1
+            return work()
+        with self.lock:
+            self.waiting += 1
+        # Carry the caller's context over, e.g. the per-update statement counter in modules/metrics.py
+        return await asyncio.get_running_loop().run_in_executor(self.executor, contextvars.copy_context().run, start)
+
+    async def run(self, func, *args, **kwargs):
+        """Call func(session, *args, **kwargs) in a worker thread inside a session scope."""
+        def work():
+            with self.database.session_scope() as session:
+                return func(session, *args, **kwargs)
+        return await self._submit(work)
+
+    async def call(self, func, *args, **kwargs):
+        """Call a blocking func(*args, **kwargs) that manages its own sessions, e.g. a cache reload."""
+        return await self._submit(functools.partial(func, *args, **kwargs))
+
+    def queue_depth(self):
+        """Number of calls waiting for a free worker thread."""
+        with self.lock:
+            return self.waiting
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(url=None, **options):
+    """Return the process-wide Database for url, creating it with options on first use."""
+    url = url or DB_URL
+    with _databases_lock:
+        if url not in _databases:
+            _databases[url] = Database(url, **options)
+        return _databases[url]
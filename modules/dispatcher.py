@@ -0,0 +1,340 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .metrics import OUTBOUND_DURATION, OUTBOUND_RATE_LIMITED, OUTBOUND_FAILED
+from .params import SEND_CONCURRENCY, SEND_GLOBAL_RATE, SEND_PER_CHAT_RATE, SEND_MAX_RETRIES
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    reserve() always takes a token and returns how long the caller has to wait
+    before using it, so the same bucket works for blocking and asyncio callers.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, tokens=1):
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= tokens
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, seconds):
+        """Make the bucket unavailable for at least the given number of seconds."""
+        with self.lock:
+            self._refill(time.monotonic())
+            # Overlapping flood waits do not add up, the longest one wins
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def is_idle(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            return self.tokens >= self.capacity
+
+
+class RateLimiter:
+    """Global and per-chat token buckets matching Telegram's outbound limits."""
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, per_chat_rate=SEND_PER_CHAT_RATE, max_chats=10000):
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.max_chats = max_chats
+        self.chat_buckets = {}
+        self.lock = threading.Lock()
+
+    def _chat_bucket(self, chat_id):
+        with self.lock:
+            bucket = self.chat_buckets.get(chat_id)
+            if bucket is None:
+                if len(self.chat_buckets) >= self.max_chats:
+                    # Drop buckets of chats that have been quiet long enough to refill
+                    for key in [key for key, value in self.chat_buckets.items() if value.is_idle()]:
+                        del self.chat_buckets[key]
+                bucket = self.chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+            return bucket
+
+    def chat_delay(self, chat_id):
+        return self._chat_bucket(chat_id).reserve()
+
+    def global_delay(self, tokens=1):
+        return self.global_bucket.reserve(tokens)
+
+    def pause(self, chat_id, seconds):
+        """
+        Honor a retry_after from Telegram. A flood wait can be global, so every
+        other chat is held back as well, not just the one that triggered it.
+        """
+        self._chat_bucket(chat_id).pause(seconds)
+        self.global_bucket.pause(seconds)
+
+
+class DispatchMetrics:
+    """Queue depth, outcome counters and a sliding window of send latencies."""
+
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.latencies = deque(maxlen=window)
+
+    def add(self, name, amount=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def observe_latency(self, seconds):
+        OUTBOUND_DURATION.observe(seconds)
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {
+                'queue_depth': self.queued,
+                'in_flight': self.in_flight,
+                'sent': self.sent,
+                'failed': self.failed,
+                'retries': self.retries,
+                'rate_limited': self.rate_limited,
+            }
+        if latencies:
+            stats['latency_p50'] = latencies[len(latencies) // 2]
+            stats['latency_p99'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            stats['latency_max'] = latencies[-1]
+        return stats
+
+
+def retry_after_of(exc):
+    """Return the flood-wait in seconds carried by a 429 error, or None for other errors."""
+    # Telethon raises FloodWaitError (and FloodPremiumWaitError) with the wait in .seconds
+    if type(exc).__name__.startswith('Flood') and getattr(exc, 'seconds', None) is not None:
+        return exc.seconds
+    # telebot raises ApiTelegramException with error_code 429 and parameters.retry_after
+    if getattr(exc, 'error_code', None) == 429:
+        result = getattr(exc, 'result_json', None) or {}
+        return result.get('parameters', {}).get('retry_after', 1)
+    return None
+
+
+class _Send:
+    __slots__ = ('chat_id', 'func', 'args', 'kwargs', 'tokens', 'future', 'attempt')
+
+    def __init__(self, chat_id, func, args, kwargs, tokens):
+        self.chat_id = chat_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.tokens = tokens
+        self.future = Future()
+        self.attempt = 0
+
+
+class OutboundDispatcher:
+    """
+    Outbound send queue for the telebot front-end.
+
+    Sends to one chat go out one at a time, in the order they were submitted.
+    The send at the head of each chat waits for its per-chat and global tokens
+    on a timer heap, and only then is handed to the bounded thread pool, so
+    the workers never sit idle on a rate limit and a chat held back by its own
+    limit or a retry_after does not delay any other chat.
+    """
+
+    def __init__(self, max_workers=SEND_CONCURRENCY, limiter=None, max_retries=SEND_MAX_RETRIES):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='outbound')
+        self.limiter = limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.metrics = DispatchMetrics()
+        self.condition = threading.Condition()
+        self.chats = {}  # chat_id -> deque of sends, the head is waiting for its tokens or in flight
+        self.timers = []  # heap of (ready_at, sequence, send, global token taken)
+        self.sequence = itertools.count()
+        self.closed = False
+        self.scheduler = threading.Thread(target=self._schedule, name='outbound-scheduler', daemon=True)
+        self.scheduler.start()
+
+    def submit(self, chat_id, func, *args, tokens=1, **kwargs):
+        """
+        Queue func(*args, **kwargs) as a send to chat_id and return its Future.
+
+        :param tokens: Global tokens the send takes, one per Bot API call func makes.
+        """
+        send = _Send(chat_id, func, args, kwargs, tokens)
+        self.metrics.add('queued')
+        with self.condition:
+            pending = self.chats.setdefault(chat_id, deque())
+            pending.append(send)
+            if len(pending) == 1:
+                self._arm(send)
+        return send.future
+
+    def _arm(self, send):
+        # Called with the condition held, for the head of a chat's queue
+        ready_at = time.monotonic() + self.limiter.chat_delay(send.chat_id)
+        heapq.heappush(self.timers, (ready_at, next(self.sequence), send, False))
+        self.condition.notify_all()
+
+    def _schedule(self):
+        with self.condition:
+            while True:
+                if not self.timers:
+                    if self.closed:
+                        return
+                    self.condition.wait()
+                    continue
+                now = time.monotonic()
+                ready_at, _, send, reserved = self.timers[0]
+                if ready_at > now:
+                    self.condition.wait(ready_at - now)
+                    continue
+                heapq.heappop(self.timers)
+                if not reserved:
+                    delay = self.limiter.global_delay(send.tokens)
+                    if delay > 0:
+                        heapq.heappush(self.timers, (now + delay, next(self.sequence), send, True))
+                        continue
+                self.executor.submit(self._run, send)
+
+    def _run(self, send):
+        self.metrics.add('queued', -1)
+        self.metrics.add('in_flight')
+        try:
+            started = time.perf_counter()
+            try:
+                result = send.func(*send.args, **send.kwargs)
+            except Exception as e:
+                retry_after = retry_after_of(e)
+                if retry_after is None or send.attempt == self.max_retries:
+                    self.metrics.add('failed')
+                    OUTBOUND_FAILED.inc()
+                    logging.error(f"Outbound send to {send.chat_id} failed: {e}")
+                    self._finish(send)
+                    send.future.set_exception(e)
+                    return
+                self.metrics.add('rate_limited')
+                OUTBOUND_RATE_LIMITED.inc()
+                self.metrics.add('retries')
+                self.metrics.add('queued')
+                self.limiter.pause(send.chat_id, retry_after)
+                send.attempt += 1
+                # The send stays at the head of its chat and waits out the pause on the heap
+                with self.condition:
+                    self._arm(send)
+                return
+            self.metrics.observe_latency(time.perf_counter() - started)
+            self.metrics.add('sent')
+            self._finish(send)
+            send.future.set_result(result)
+        finally:
+            self.metrics.add('in_flight', -1)
+
+    def _finish(self, send):
+        with self.condition:
+            pending = self.chats[send.chat_id]
+            pending.popleft()
+            if pending:
+                self._arm(pending[0])
+            else:
+                del self.chats[send.chat_id]
+                self.condition.notify_all()
+
+    def shutdown(self, wait=True):
+        with self.condition:
+            while wait and self.chats:
+                self.condition.wait()
+            if not wait:
+                self.timers.clear()
+            self.closed = True
+            self.condition.notify_all()
+        self.executor.shutdown(wait=wait)
+
+
+class AsyncOutboundDispatcher:
+    """
+    Outbound send queue for the Telethon front-end.
+
+    Shares the rate limiting and metrics of OutboundDispatcher. Sends are
+    coroutines that wait for their tokens first and only then take one of the
+    max_concurrency slots, so a send held back by a limit does not occupy a
+    slot other chats could use.
+    """
+
+    def __init__(self, max_concurrency=SEND_CONCURRENCY, limiter=None, max_retries=SEND_MAX_RETRIES):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.limiter = limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.metrics = DispatchMetrics()
+        self.tasks = set()
+
+    async def send(self, chat_id, func, *args, tokens=1, **kwargs):
+        """
+        Await func(*args, **kwargs) once the chat and global limits allow it.
+
+        :param tokens: Global tokens the send takes, one per API call func makes.
+        """
+        self.metrics.add('queued')
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(self.limiter.chat_delay(chat_id))
+            await asyncio.sleep(self.limiter.global_delay(tokens))
+            async with self.semaphore:
+                self.metrics.add('queued', -1)
+                self.metrics.add('in_flight')
+                started = time.perf_counter()
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as e:
+                    retry_after = retry_after_of(e)
+                    if retry_after is None or attempt == self.max_retries:
+                        self.metrics.add('failed')
+                        OUTBOUND_FAILED.inc()
+                        logging.error(f"Outbound send to {chat_id} failed: {e}")
+                        raise
+                    self.metrics.add('rate_limited')
+                    OUTBOUND_RATE_LIMITED.inc()
+                    self.metrics.add('retries')
+                    self.metrics.add('queued')
+                    self.limiter.pause(chat_id, retry_after)
+                    continue
+                finally:
+                    self.metrics.add('in_flight', -1)
+            self.metrics.observe_latency(time.perf_counter() - started)
+            self.metrics.add('sent')
+            return result
+
+    def submit(self, chat_id, func, *args, **kwargs):
+        """Schedule a send without waiting for it and return the task."""
+        task = asyncio.ensure_future(self.send(chat_id, func, *args, **kwargs))
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Queued outbound send failed: {task.exception()}")
+
+    async def drain(self):
+        """Wait for every submitted send to finish."""
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from datetime import datetime
+
+from sqlalchemy import and_, or_, update
+
+from .models import User
+from .params import SWEEP_PAGE_SIZE, ENFORCEMENT_WINDOW
+
+# Errors meaning the user is already out of the channel, or can never be removed
+# by the bot, so retrying on the next run would only fail again. Telethon cannot
+# address a user its session never saw, that does not change between runs either
+PERMANENT_ERRORS = ('user not found', 'usernotparticipant', 'not a member', 'participant_id_invalid',
+                    'user_id_invalid', 'useradmininvalid', 'administrator', 'chat owner',
+                    'could not find the input entity')
+
+
+def is_permanent(error):
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in PERMANENT_ERRORS)
+
+
+class EnforcementReport:
+    """Counters for one channel enforcement run."""
+
+    def __init__(self):
+        self.selected = 0
+        self.removed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.marked = 0
+        self.pages = 0
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        return self.removed / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"selected={self.selected} removed={self.removed} skipped={self.skipped} failed={self.failed} marked={self.marked} "
+                f"pages={self.pages} elapsed={self.elapsed:.1f}s rate={self.rate:.1f}/s")
+
+
+class ChannelEnforcer:
+    """
+    Removes users with an expired subscription from the channel.
+
+    Expired users are read in keyset pages over the (subscription_expiry, user_id)
+    index. Each page is removed through the rate-limited outbound dispatcher with
+    at most window removals queued at a time, so replies to users sharing the
+    dispatcher never wait behind a whole page. The users that were removed, or
+    that a permanent error shows are not in the channel, are then marked
+    'expired' in one bulk UPDATE. Marked users are skipped by later runs and
+    other failures are retried, so running the job again is safe.
+    """
+
+    def __init__(self, session_scope, page_size=SWEEP_PAGE_SIZE, window=ENFORCEMENT_WINDOW):
+        self.session_scope = session_scope
+        self.page_size = page_size
+        self.window = window
+
+    def next_page(self, cursor, today):
+        """Expired, not yet enforced users after cursor, a (subscription_expiry, user_id) pair."""
+        with self.session_scope() as session:
+            query = session.query(User.user_id, User.subscription_expiry) \
+                .filter(User.subscription_expiry < today,
+                        or_(User.subscription_status.is_(None), User.subscription_status != 'expired'))
+            if cursor:
+                query = query.filter(or_(
+                    User.subscription_expiry > cursor[0],
+                    and_(User.subscription_expiry == cursor[0], User.user_id > cursor[1]),
+                ))
+            return query.order_by(User.subscription_expiry, User.user_id).limit(self.page_size).all()
+
+    def mark_expired(self, user_ids, today):
+        """Mark users expired in one statement. Users renewed meanwhile no longer match and are left alone."""
+        if not user_ids:
+            return 0
+        with self.session_scope() as session:
+            marked = session.execute(
+                update(User)
+                .where(User.user_id.in_(user_ids), User.subscription_expiry < today)
+                .values(subscription_status='expired')
+            ).rowcount
+            session.commit()
+        return marked
+
+    def record_page(self, report, rows, results, today):
+        report.pages += 1
+        report.selected += len(rows)
+        done = []
+        for row, error in zip(rows, results):
+            if error is None:
+                report.removed += 1
+                done.append(row.user_id)
+            elif is_permanent(error):
+                report.skipped += 1
+                done.append(row.user_id)
+                logging.info(f"Not retrying removal of user {row.user_id} from the channel: {error}")
+            else:
+                report.failed += 1
+                logging.warning(f"Could not remove user {row.user_id} from the channel: {error}")
+        report.marked += self.mark_expired(done, today)
+
+    def remove_page(self, outbox, remove, rows, calls):
+        """Remove a page through the outbox, window removals at a time. Returns the error or None per row."""
+        errors = [None] * len(rows)
+        pending = {}
+        for index, row in enumerate(rows):
+            if len(pending) >= self.window:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    errors[pending.pop(future)] = future.exception()
+            # Keyed by user so the per-chat limit does not serialise removals from the one channel
+            pending[outbox.submit(row.user_id, remove, row.user_id, tokens=calls)] = index
+        for future in wait(pending).done:
+            errors[pending[future]] = future.exception()
+        return errors
+
+    def run(self, outbox, remove, calls=1, today=None):
+        """
+        Enforce from a thread.
+
+        :param outbox: OutboundDispatcher the removals are submitted to.
+        :param remove: Callable taking a user_id that removes the user from the channel.
+        :param calls: Number of API calls remove makes, each one takes a global rate limit token.
+        """
+        report = EnforcementReport()
+        started = time.perf_counter()
+        today = today or datetime.utcnow().date()
+        cursor = None
+        while True:
+            rows = self.next_page(cursor, today)
+            if not rows:
+                break
+            self.record_page(report, rows, self.remove_page(outbox, remove, rows, calls), today)
+            if len(rows) < self.page_size:
+                break
+            cursor = (rows[-1].subscription_expiry, rows[-1].user_id)
+
+        report.elapsed = time.perf_counter() - started
+        logging.info(f"Channel enforcement finished: {report}")
+        return report
+
+    async def run_async(self, adb, outbox, remove, calls=1, today=None):
+        """
+        Enforce from the event loop.
+
+        :param adb: AsyncDatabase the queries run on.
+        :param outbox: AsyncOutboundDispatcher the removals are sent through.
+        :param remove: Coroutine function taking a user_id that removes the user from the channel.
+        :param calls: Number of API calls remove makes, each one takes a global rate limit token.
+        """
+        window = asyncio.Semaphore(self.window)
+
+        async def remove_user(user_id):
+            async with window:
+                return await outbox.send(user_id, remove, user_id, tokens=calls)
+
+        report = EnforcementReport()
+        started = time.perf_counter()
+        today = today or datetime.utcnow().date()
+        cursor = None
+        while True:
+            rows = await adb.call(self.next_page, cursor, today)
+            if not rows:
+                break
+            results = await asyncio.gather(*(remove_user(row.user_id) for row in rows), return_exceptions=True)
+            errors = [result if isinstance(result, Exception) else None for result in results]
+            await adb.call(self.record_page, report, rows, errors, today)
+            if len(rows) < self.page_size:
+                break
+            cursor = (rows[-1].subscription_expiry, rows[-1].user_id)
+
+        report.elapsed = time.perf_counter() - started
+        logging.info(f"Channel enforcement finished: {report}")
+        return report
@@ -0,0 +1,307 @@
+import bisect
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import event
+
+from .params import METRICS_HOST, METRICS_PORT
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+JOB_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)  # seconds
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class CounterValue:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class GaugeValue(CounterValue):
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last bucket is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name, labels):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            yield name + '_bucket', labels + (('le', _format_value(bound)),), cumulative
+        yield name + '_sum', labels, total
+        yield name + '_count', labels, cumulative
+
+
+class MetricFamily:
+    """A named metric with one value per combination of label values."""
+
+    def __init__(self, kind, name, help, label_names, factory):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.factory = factory
+        self.lock = threading.Lock()
+        self.children = {}
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} takes labels {self.label_names}")
+            with self.lock:
+                child = self.children.setdefault(values, self.factory())
+        return child
+
+    # Shortcuts for metrics without labels
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self.children.items()):
+            for name, extra, value in child.samples(self.name, ()):
+                lines.append(f"{name}{_format_labels(self.label_names, values, extra)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    """
+    Metrics of one process in the Prometheus text format.
+
+    Counters, gauges and histograms are updated where things happen, under a
+    per-value lock. Everything that already keeps its own counters (queues,
+    caches, the connection pool) is read only when /metrics is scraped, through
+    callables registered with add_stats, so it costs nothing in between.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families = {}
+        self.stats = {}
+
+    def _family(self, kind, name, help, labels, factory):
+        with self.lock:
+            family = self.families.get(name)
+            if family is None:
+                family = self.families[name] = MetricFamily(kind, name, help, labels, factory)
+            elif family.kind != kind:
+                raise ValueError(f"Metric {name} is already registered as a {family.kind}")
+            return family
+
+    def counter(self, name, help, labels=()):
+        return self._family('counter', name, help, labels, CounterValue)
+
+    def gauge(self, name, help, labels=()):
+        return self._family('gauge', name, help, labels, GaugeValue)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._family('histogram', name, help, labels, lambda: HistogramValue(tuple(buckets)))
+
+    def add_stats(self, prefix, stats):
+        """Expose the numeric values of the dict returned by stats() as gauges named bot_<prefix>_<key>."""
+        self.stats[prefix] = stats
+
+    def render(self):
+        lines = []
+        for family in list(self.families.values()):
+            lines.extend(family.render())
+        for prefix, stats in list(self.stats.items()):
+            try:
+                values = stats()
+            except Exception as e:
+                logging.error(f"Failed to collect {prefix} metrics: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"bot_{prefix}_{key}"
+                lines.extend((f"# TYPE {name} gauge", f"{name} {_format_value(value)}"))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_DURATION = REGISTRY.histogram('bot_handler_duration_seconds', "Time spent in an update handler.", ('handler',))
+HANDLER_ERRORS = REGISTRY.counter('bot_handler_errors_total', "Update handlers that raised.", ('handler',))
+UPDATE_QUERIES = REGISTRY.histogram('bot_update_db_queries', "SQL statements executed while handling one update.",
+                                    ('handler',), buckets=COUNT_BUCKETS)
+DB_STATEMENTS = REGISTRY.counter('bot_db_statements_total', "SQL statements executed.")
+OUTBOUND_DURATION = REGISTRY.histogram('bot_outbound_request_duration_seconds',
+                                       "Latency of successful Telegram API calls made through the outbound dispatcher.")
+OUTBOUND_RATE_LIMITED = REGISTRY.counter('bot_outbound_rate_limited_total', "Telegram API calls answered with 429 or a flood wait.")
+OUTBOUND_FAILED = REGISTRY.counter('bot_outbound_failed_total', "Telegram API calls that failed for good.")
+JOB_DURATION = REGISTRY.histogram('bot_job_duration_seconds', "Run time of scheduled jobs.", ('job', 'status'),
+                                  buckets=JOB_BUCKETS)
+
+# Statement counter of the update being handled, shared by the worker threads it hands DB work to
+_update_queries = contextvars.ContextVar('update_queries', default=None)
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    DB_STATEMENTS.inc()
+    counter = _update_queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def watch_engine(engine):
+    """Count the statements run on engine, per update and in total."""
+    if not event.contains(engine, 'before_cursor_execute', _count_statement):
+        event.listen(engine, 'before_cursor_execute', _count_statement)
+
+
+@contextlib.contextmanager
+def counting_queries():
+    """
+    Count the statements run inside the block, including DB work it hands to
+    AsyncDatabase. Yields a one-item list holding the count; handlers inside
+    the block do not record their own UPDATE_QUERIES sample.
+    """
+    counter = [0]
+    token = _update_queries.set(counter)
+    try:
+        yield counter
+    finally:
+        _update_queries.reset(token)
+
+
+class _HandlerSpan:
+    __slots__ = ('token', 'counter', 'started')
+
+    def __init__(self):
+        # Only the outermost handler of an update counts its queries
+        if _update_queries.get() is None:
+            self.counter = [0]
+            self.token = _update_queries.set(self.counter)
+        else:
+            self.counter = self.token = None
+        self.started = time.perf_counter()
+
+    def finish(self, duration, queries):
+        duration.observe(time.perf_counter() - self.started)
+        if self.token is not None:
+            queries.observe(self.counter[0])
+            _update_queries.reset(self.token)
+
+
+def instrumented(func=None, name=None):
+    """Record the latency, errors and SQL statement count of an update handler, sync or async."""
+    if func is None:
+        return functools.partial(instrumented, name=name)
+    label = name or func.__name__
+    duration, errors, queries = HANDLER_DURATION.labels(label), HANDLER_ERRORS.labels(label), UPDATE_QUERIES.labels(label)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            span = _HandlerSpan()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                span.finish(duration, queries)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            span = _HandlerSpan()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                span.finish(duration, queries)
+    return wrapper
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """Serves the registry on http://host:port/metrics from a daemon thread."""
+
+    def __init__(self, registry=REGISTRY, host=METRICS_HOST, port=METRICS_PORT):
+        self.server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.registry = registry
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True).start()
+        logging.info(f"Serving metrics on port {self.port}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
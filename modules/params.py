@@ -6,4 +6,89 @@ load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 DB_URL = os.getenv("DB_URL")
 API_ID=os.getenv("API_ID")
-API_HASH=os.getenv("API_HASH")
\ No newline at end of file
+API_HASH=os.getenv("API_HASH")
+
+# Expiry sweep
+EXPIRY_NOTICE_DAYS = int(os.getenv("EXPIRY_NOTICE_DAYS", 3))
+SWEEP_PAGE_SIZE = int(os.getenv("SWEEP_PAGE_SIZE", 1000))
+
+# Expiry reminders
+REMINDER_OFFSETS = [int(days) for days in os.getenv("REMINDER_OFFSETS", "7,3,1").split(",")]  # days before expiry
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", 500))
+REMINDER_CRON = os.getenv("REMINDER_CRON", "*/15 * * * *")
+
+# Channel membership enforcement, disabled while CHANNEL_ID is unset
+CHANNEL_ID = int(os.getenv("CHANNEL_ID")) if os.getenv("CHANNEL_ID") else None
+ENFORCEMENT_WINDOW = int(os.getenv("ENFORCEMENT_WINDOW", 16))  # removals queued on the outbound dispatcher at once
+
+# Outbound message dispatcher
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", 8))
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", 30))  # messages per second across all chats
+SEND_PER_CHAT_RATE = float(os.getenv("SEND_PER_CHAT_RATE", 1))  # messages per second to a single chat
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", 3))
+
+# Broadcasts
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", 200))
+BROADCAST_LEASE_SECONDS = int(os.getenv("BROADCAST_LEASE_SECONDS", 300))  # renewed every page, must outlast sending one page
+BROADCAST_RESUME_CRON = os.getenv("BROADCAST_RESUME_CRON", "*/5 * * * *")  # how often replicas look for broadcasts to take over
+
+# Inline button callback data
+CALLBACK_SECRET = os.getenv("CALLBACK_SECRET") or TELEGRAM_TOKEN  # signs button data, must match across replicas
+CALLBACK_MAC_SIZE = int(os.getenv("CALLBACK_MAC_SIZE", 8))  # bytes of HMAC kept per button
+
+# Caches
+ADMIN_CACHE_TTL = float(os.getenv("ADMIN_CACHE_TTL", 300))  # seconds
+ADMIN_AUTH_TTL = float(os.getenv("ADMIN_AUTH_TTL", 30))  # seconds an admin change on another replica may take to be enforced
+PLAN_CACHE_TTL = float(os.getenv("PLAN_CACHE_TTL", 300))  # seconds, bounds how long plan changes take to reach other replicas
+STATUS_CACHE_TTL = float(os.getenv("STATUS_CACHE_TTL", 30))  # seconds another process's change may take to show in /status
+STATUS_CACHE_MAX_ENTRIES = int(os.getenv("STATUS_CACHE_MAX_ENTRIES", 100000))
+DECIDED_PAYMENTS_CACHE_SIZE = int(os.getenv("DECIDED_PAYMENTS_CACHE_SIZE", 10000))  # decided payments remembered to turn away repeat callbacks
+
+# Database connection pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # seconds before a connection is replaced
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", DB_POOL_SIZE))  # threads running DB work for the Telethon bot
+
+# Metrics, served at http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))  # 0 disables the endpoint
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# SQL instrumentation, everything is off unless enabled here
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() == "true"  # log every statement, for debugging only
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", 0))  # log statements slower than this, 0 disables
+SQL_STATS = os.getenv("SQL_STATS", "false").lower() == "true"  # aggregate per-statement counts and latencies
+
+# Webhook mode, used instead of long polling when WEBHOOK_URL is set
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # public base URL Telegram posts to, e.g. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # required in webhook mode, shared by every replica
+
+# Update processing
+UPDATE_SHARDS = int(os.getenv("UPDATE_SHARDS", 8))  # updates of one chat always run on the same shard, in order
+UPDATE_SHARD_QUEUE_SIZE = int(os.getenv("UPDATE_SHARD_QUEUE_SIZE", 1000))
+UPDATE_DEDUP_WINDOW = int(os.getenv("UPDATE_DEDUP_WINDOW", 100000))  # most recent updates remembered to drop redeliveries
+UPDATE_DEDUP_STORE_URL = os.getenv("UPDATE_DEDUP_STORE_URL")  # sqlite:///path or redis://..., keeps the last polled update_id across restarts
+UPDATE_DEDUP_FLOOR_TTL = int(os.getenv("UPDATE_DEDUP_FLOOR_TTL", 6 * 24 * 3600))  # Telegram renumbers updates after a week without any
+UPDATE_DEDUP_SAVE_INTERVAL = float(os.getenv("UPDATE_DEDUP_SAVE_INTERVAL", 1))  # seconds between saves of the last update_id
+
+# Conversation state (pending next steps and plan choices)
+CONVERSATION_STORE_URL = os.getenv("CONVERSATION_STORE_URL", "memory://")  # memory://, sqlite:///path or redis://host:port/db
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", 3600))  # seconds a pending conversation is kept
+CONVERSATION_MAX_ENTRIES = int(os.getenv("CONVERSATION_MAX_ENTRIES", 100000))  # memory backend only
+
+# Redemption codes
+CODE_LENGTH = int(os.getenv("CODE_LENGTH", 10))
+CODE_BATCH_LIMIT = int(os.getenv("CODE_BATCH_LIMIT", 100000))  # most codes one /generate_codes may create
+CODE_BATCH_CHUNK = int(os.getenv("CODE_BATCH_CHUNK", 5000))  # codes generated, checked and written at a time
+
+# Persistent job scheduler, cron expressions are in UTC
+SWEEP_CRON = os.getenv("SWEEP_CRON", "0 9 * * *")
+CLEANUP_CRON = os.getenv("CLEANUP_CRON", "30 3 * * *")
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 30))  # seconds between checks for due jobs
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 300))  # renewed while a job runs, a crashed replica's job is taken over after this
+JOB_MISFIRE_GRACE = int(os.getenv("JOB_MISFIRE_GRACE", 3600))  # runs later than this are skipped until the next fire time
@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import namedtuple
+
+from .models import SubscriptionPlan
+
+PlanInfo = namedtuple('PlanInfo', ['plan_id', 'name', 'price', 'duration_days'])
+
+
+class PlanCatalogue:
+    """
+    In-memory copy of the subscription plans and the keyboards built from them.
+
+    Plans are loaded once and every keyboard is built once per load, so the
+    /subscribe path does not touch the database. Anything that adds or deletes
+    a plan must call invalidate() to have both rebuilt on the next access.
+    invalidate() only reaches this process, so with more than one process a
+    ttl is needed to pick up changes made elsewhere.
+    """
+
+    def __init__(self, session_factory, ttl=None):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.loaded_at = 0.0
+        self.lock = threading.Lock()
+        # (plan_id -> PlanInfo, key -> keyboard), replaced as a whole so readers never mix generations
+        self.state = None
+
+    def is_fresh(self):
+        return self.state is not None and not self._expired()
+
+    def _load(self):
+        state = self.state
+        if state is not None and not self._expired():
+            return state
+        return self.refresh()
+
+    def refresh(self):
+        """Reload the plans unless another thread just did."""
+        with self.lock:
+            if self.state is None or self._expired():
+                with self.session_factory() as session:
+                    rows = session.query(SubscriptionPlan).order_by(SubscriptionPlan.plan_id).all()
+                    by_id = {row.plan_id: PlanInfo(row.plan_id, row.name, row.price, row.duration_days) for row in rows}
+                self.state = (by_id, {})
+                self.loaded_at = time.monotonic()
+            return self.state
+
+    def _expired(self):
+        return self.ttl is not None and time.monotonic() - self.loaded_at >= self.ttl
+
+    def plans(self):
+        return list(self._load()[0].values())
+
+    def get(self, plan_id):
+        return self._load()[0].get(plan_id)
+
+    def keyboard(self, key, build):
+        """
+        Return the keyboard cached under key, building it with build(plans) on first use.
+
+        build may return anything the front-end can send as-is, e.g. the JSON
+        string of a telebot InlineKeyboardMarkup or a list of Telethon buttons.
+        """
+        by_id, keyboards = self._load()
+        if key not in keyboards:
+            keyboards[key] = build(list(by_id.values()))
+        return keyboards[key]
+
+    def invalidate(self):
+        with self.lock:
+            self.state = None
@@ -0,0 +1,156 @@
+import logging
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta, time as day_start
+
+from sqlalchemy import update
+
+from .models import User, SubscriptionReminder
+from .params import REMINDER_OFFSETS, REMINDER_BATCH_SIZE
+
+
+def schedule_reminders(session, user_id, expiry, offsets=REMINDER_OFFSETS, now=None):
+    """
+    Replace the user's pending reminders with one per offset before the new expiry.
+
+    Call it in the transaction that changes subscription_expiry. Reminders whose
+    due time has already passed are not created. Does not commit.
+    """
+    now = now or datetime.utcnow()
+    session.query(SubscriptionReminder) \
+        .filter(SubscriptionReminder.user_id == user_id, SubscriptionReminder.sent_at.is_(None)) \
+        .delete(synchronize_session=False)
+    expires_at = datetime.combine(expiry, day_start())
+    rows = [{'user_id': user_id, 'expiry': expiry, 'offset_days': offset, 'due_at': expires_at - timedelta(days=offset)}
+            for offset in offsets if expires_at - timedelta(days=offset) > now]
+    if rows:
+        session.bulk_insert_mappings(SubscriptionReminder, rows)
+    return len(rows)
+
+
+class ReminderReport:
+    """Counters for one pass over the reminder queue."""
+
+    def __init__(self):
+        self.due = 0
+        self.sent = 0
+        self.stale = 0
+        self.failed = 0
+        self.elapsed = 0.0
+
+    def __str__(self):
+        return f"due={self.due} sent={self.sent} stale={self.stale} failed={self.failed} elapsed={self.elapsed:.3f}s"
+
+
+class ReminderQueue:
+    """
+    Delivers expiry reminders from the subscription_reminders table.
+
+    Only due, unsent rows are read, through the partial due_at index, so the
+    cost of a pass follows the number of due reminders rather than the number
+    of users. Rows are locked with FOR UPDATE SKIP LOCKED and marked sent in
+    the same transaction, so concurrent pollers never deliver the same reminder.
+    Reminders whose delivery fails are released again and retried on the next
+    pass, until the expiry they announce has passed.
+    """
+
+    def __init__(self, session_scope, batch_size=REMINDER_BATCH_SIZE):
+        self.session_scope = session_scope
+        self.batch_size = batch_size
+
+    def claim(self, now):
+        """Lock a batch of due reminders, mark them sent and return them with the user's details."""
+        with self.session_scope() as session:
+            rows = session.query(SubscriptionReminder.reminder_id, SubscriptionReminder.user_id,
+                                 SubscriptionReminder.expiry, SubscriptionReminder.offset_days,
+                                 User.first_name, User.username, User.subscription_expiry) \
+                .join(User, User.user_id == SubscriptionReminder.user_id) \
+                .filter(SubscriptionReminder.sent_at.is_(None), SubscriptionReminder.due_at <= now) \
+                .order_by(SubscriptionReminder.due_at) \
+                .limit(self.batch_size) \
+                .with_for_update(skip_locked=True, of=SubscriptionReminder) \
+                .all()
+            if rows:
+                session.execute(update(SubscriptionReminder)
+                                .where(SubscriptionReminder.reminder_id.in_([row.reminder_id for row in rows]))
+                                .values(sent_at=now))
+                session.commit()
+            return rows
+
+    def release(self, reminder_ids):
+        """Mark claimed reminders unsent again so a later pass retries them."""
+        if not reminder_ids:
+            return
+        with self.session_scope() as session:
+            session.execute(update(SubscriptionReminder)
+                            .where(SubscriptionReminder.reminder_id.in_(reminder_ids))
+                            .values(sent_at=None))
+            session.commit()
+
+    def run(self, on_due, now=None):
+        """
+        Claim every due reminder and call on_due with each row.
+
+        on_due may return a concurrent.futures.Future for a delivery it only
+        queued; the batch waits for those. Reminders whose on_due raised or
+        whose future failed are released for the next pass. Reminders for an
+        expiry the user no longer has, or that has already passed, are marked
+        sent without calling on_due.
+        """
+        report = ReminderReport()
+        started = time.perf_counter()
+        now = now or datetime.utcnow()
+        failed = []
+        while True:
+            rows = self.claim(now)
+            report.due += len(rows)
+            pending = []
+            for row in rows:
+                if row.subscription_expiry != row.expiry or row.expiry < now.date():
+                    report.stale += 1
+                    continue
+                try:
+                    pending.append((row, on_due(row)))
+                except Exception as e:
+                    logging.error(f"Could not deliver reminder {row.reminder_id} to user {row.user_id}: {e}")
+                    failed.append(row.reminder_id)
+            for row, result in pending:
+                if isinstance(result, Future) and result.exception() is not None:
+                    logging.error(f"Could not deliver reminder {row.reminder_id} to user {row.user_id}: {result.exception()}")
+                    failed.append(row.reminder_id)
+                    continue
+                report.sent += 1
+            if len(rows) < self.batch_size:
+                break
+
+        # Released only now, so this pass does not claim them again
+        self.release(failed)
+        report.failed = len(failed)
+
+        report.elapsed = time.perf_counter() - started
+        logging.info(f"Reminder queue drained: {report}")
+        return report
+
+    def backfill(self, now=None):
+        """Schedule reminders for every user with a future expiry, e.g. after the table was introduced."""
+        now = now or datetime.utcnow()
+        last_user_id, scheduled = None, 0
+        while True:
+            with self.session_scope() as session:
+                query = session.query(User.user_id, User.subscription_expiry) \
+                    .filter(User.subscription_expiry >= now.date())
+                if last_user_id is not None:
+                    query = query.filter(User.user_id > last_user_id)
+                users = query.order_by(User.user_id).limit(self.batch_size).all()
+                for user in users:
+                    scheduled += schedule_reminders(session, user.user_id, user.subscription_expiry, now=now)
+                session.commit()
+            if len(users) < self.batch_size:
+                return scheduled
+            last_user_id = users[-1].user_id
+
+
+if __name__ == '__main__':
+    # Run from the project root with: python -m modules.reminders
+    from .database import get_database
+    print(f"Scheduled {ReminderQueue(get_database().session_scope).backfill()} reminders")
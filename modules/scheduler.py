@@ -0,0 +1,234 @@
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy import update, or_
+from sqlalchemy.exc import IntegrityError
+
+from .metrics import JOB_DURATION
+from .models import ScheduledJob
+from .params import JOB_POLL_INTERVAL, JOB_LEASE_SECONDS, JOB_MISFIRE_GRACE
+
+
+class JobScheduler:
+    """
+    Cron-style jobs kept in the scheduled_jobs table and run once per fire time
+    across every replica.
+
+    Each replica polls for due jobs and claims one with a conditional UPDATE that
+    only matches while the job is due and unleased, so exactly one replica wins
+    and runs it. The runner renews the lease every third of lease_seconds while
+    the job runs, so it only expires when the runner is gone, letting another
+    replica take over. A run later than misfire_grace is skipped and missed runs
+    are coalesced: the next fire time is always computed from the current time.
+
+    Jobs added with add_local_job run in every process on their own schedule,
+    for work on state the process keeps to itself.
+    """
+
+    def __init__(self, session_scope, owner=None, poll_interval=JOB_POLL_INTERVAL, lease_seconds=JOB_LEASE_SECONDS,
+                 misfire_grace=JOB_MISFIRE_GRACE):
+        self.session_scope = session_scope
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.lease = timedelta(seconds=lease_seconds)
+        self.misfire_grace = misfire_grace
+        self.jobs = {}  # name -> (trigger, cron, func)
+        self.local_jobs = {}  # name -> [trigger, func, next run]
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def add_job(self, name, cron, func):
+        """Register func to run on the crontab expression cron (UTC)."""
+        self.jobs[name] = (CronTrigger.from_crontab(cron, timezone=timezone.utc), cron, func)
+
+    def add_local_job(self, name, cron, func):
+        """Register func to run on cron (UTC) in this process, whatever the other replicas do."""
+        trigger = CronTrigger.from_crontab(cron, timezone=timezone.utc)
+        self.local_jobs[name] = [trigger, func, self.fire_after(trigger, datetime.utcnow())]
+
+    def next_fire(self, name, after):
+        """Next fire time strictly after the naive UTC datetime after."""
+        return self.fire_after(self.jobs[name][0], after)
+
+    @staticmethod
+    def fire_after(trigger, after):
+        fire = trigger.get_next_fire_time(None, (after + timedelta(microseconds=1)).replace(tzinfo=timezone.utc))
+        return fire.astimezone(timezone.utc).replace(tzinfo=None)
+
+    def sync(self):
+        """Create rows for new jobs and reschedule jobs whose cron expression changed."""
+        now = datetime.utcnow()
+        with self.session_scope() as session:
+            rows = {job.name: job for job in session.query(ScheduledJob).filter(ScheduledJob.name.in_(self.jobs))}
+            for name, (_, cron, _) in self.jobs.items():
+                job = rows.get(name)
+                if job is None:
+                    session.add(ScheduledJob(name=name, cron=cron, next_run_at=self.next_fire(name, now),
+                                             run_count=0, failure_count=0, misfire_count=0))
+                elif job.cron != cron:
+                    job.cron = cron
+                    job.next_run_at = self.next_fire(name, now)
+            try:
+                session.commit()
+            except IntegrityError:
+                # Another replica registered the same jobs at the same time
+                session.rollback()
+
+    def due(self, now):
+        with self.session_scope() as session:
+            return [name for name, in session.query(ScheduledJob.name).filter(
+                ScheduledJob.name.in_(self.jobs),
+                ScheduledJob.next_run_at <= now,
+                or_(ScheduledJob.locked_until.is_(None), ScheduledJob.locked_until < now),
+            )]
+
+    def claim(self, name, now):
+        """
+        Take the lease on a job due at now. Returns its scheduled time, or None when another replica has it.
+
+        The lease is checked and granted at the current time rather than now, which
+        is read once per poll: an earlier job of the same poll may have run longer
+        than a lease, and a lease counted from now would then already be expired.
+        """
+        leased_at = datetime.utcnow()
+        with self.session_scope() as session:
+            claimed = session.execute(
+                update(ScheduledJob)
+                .where(ScheduledJob.name == name, ScheduledJob.next_run_at <= now,
+                       or_(ScheduledJob.locked_until.is_(None), ScheduledJob.locked_until < leased_at))
+                .values(locked_by=self.owner, locked_until=leased_at + self.lease)
+            ).rowcount
+            if claimed != 1:
+                session.rollback()
+                return None
+            scheduled = session.query(ScheduledJob.next_run_at).filter_by(name=name).scalar()
+            session.commit()
+            return scheduled
+
+    def renew(self, name):
+        """Extend the lease on a running job. Returns False when this replica no longer holds it."""
+        now = datetime.utcnow()
+        with self.session_scope() as session:
+            renewed = session.execute(
+                update(ScheduledJob)
+                .where(ScheduledJob.name == name, ScheduledJob.locked_by == self.owner)
+                .values(locked_until=now + self.lease)
+            ).rowcount
+            session.commit()
+        return renewed == 1
+
+    def heartbeat(self, name, done):
+        while not done.wait(self.lease.total_seconds() / 3):
+            try:
+                if not self.renew(name):
+                    logging.warning(f"Lost the lease on job {name} while it was running")
+                    return
+            except Exception as e:
+                logging.error(f"Could not renew the lease on job {name}: {e}")
+
+    def finish(self, name, started_at, status, duration, error=None):
+        """Record the outcome, schedule the next run and release the lease."""
+        now = datetime.utcnow()
+        values = {
+            'next_run_at': self.next_fire(name, now),
+            'locked_by': None,
+            'locked_until': None,
+            'last_status': status,
+            'last_error': error,
+        }
+        if status == 'misfired':
+            values['misfire_count'] = ScheduledJob.misfire_count + 1
+        else:
+            values.update(last_started_at=started_at, last_finished_at=now, last_duration=duration,
+                          run_count=ScheduledJob.run_count + 1)
+            if status == 'failed':
+                values['failure_count'] = ScheduledJob.failure_count + 1
+        with self.session_scope() as session:
+            finished = session.execute(update(ScheduledJob)
+                                       .where(ScheduledJob.name == name, ScheduledJob.locked_by == self.owner)
+                                       .values(**values)).rowcount
+            session.commit()
+        if finished != 1:
+            logging.warning(f"Job {name} finished after its lease was taken over, its outcome was not recorded")
+
+    def run_job(self, name, scheduled, now):
+        late = (now - scheduled).total_seconds()
+        if late > self.misfire_grace:
+            logging.warning(f"Job {name} missed its {scheduled} run by {late:.0f}s, skipping to the next fire time")
+            self.finish(name, now, 'misfired', 0.0)
+            return 'misfired'
+
+        started = time.perf_counter()
+        status, error = 'ok', None
+        done = threading.Event()
+        threading.Thread(target=self.heartbeat, args=(name, done), name=f'job-lease-{name}', daemon=True).start()
+        try:
+            self.jobs[name][2]()
+        except Exception as e:
+            status, error = 'failed', str(e)
+            logging.error(f"Job {name} failed: {e}")
+        finally:
+            done.set()
+        duration = time.perf_counter() - started
+        logging.info(f"Job {name} finished: status={status} duration={duration:.3f}s")
+        JOB_DURATION.labels(name, status).observe(duration)
+        self.finish(name, now, status, duration, error)
+        return status
+
+    def run_pending(self, now=None):
+        """Run every due job this replica manages to claim. Returns {name: status}."""
+        now = now or datetime.utcnow()
+        results = {}
+        for name in self.due(now):
+            scheduled = self.claim(name, now)
+            if scheduled is not None:
+                results[name] = self.run_job(name, scheduled, now)
+        for name, job in self.local_jobs.items():
+            trigger, func, next_run = job
+            if next_run > now:
+                continue
+            job[2] = self.fire_after(trigger, now)
+            try:
+                func()
+                results[name] = 'ok'
+            except Exception as e:
+                results[name] = 'failed'
+                logging.error(f"Local job {name} failed: {e}")
+        return results
+
+    def stats(self):
+        """Per-job runtime metrics as stored in the job table."""
+        with self.session_scope() as session:
+            return {job.name: {
+                'cron': job.cron,
+                'next_run_at': job.next_run_at,
+                'locked_by': job.locked_by,
+                'last_status': job.last_status,
+                'last_duration': job.last_duration,
+                'last_finished_at': job.last_finished_at,
+                'run_count': job.run_count,
+                'failure_count': job.failure_count,
+                'misfire_count': job.misfire_count,
+            } for job in session.query(ScheduledJob).filter(ScheduledJob.name.in_(self.jobs))}
+
+    def loop(self):
+        while not self.stopped.is_set():
+            try:
+                self.run_pending()
+            except Exception as e:
+                logging.error(f"Job scheduler poll failed: {e}")
+            self.stopped.wait(self.poll_interval)
+
+    def start(self):
+        self.sync()
+        self.thread = threading.Thread(target=self.loop, name='job-scheduler', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
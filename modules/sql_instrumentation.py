@@ -0,0 +1,95 @@
+import json
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+
+from .params import SQL_SLOW_QUERY_MS, SQL_STATS
+
+slow_query_logger = logging.getLogger('sql.slow')
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class StatementStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # last bucket is +Inf
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+                return
+        self.buckets[-1] += 1
+
+    def as_dict(self):
+        return {'count': self.count, 'total': self.total, 'max': self.max,
+                'avg': self.total / self.count if self.count else 0.0, 'buckets': list(self.buckets)}
+
+
+class SQLInstrumentation:
+    """
+    Optional engine hooks that log slow statements and aggregate statement latencies.
+
+    Nothing is attached to the engine unless slow_query_ms or collect_stats is
+    set, so the disabled mode costs nothing per statement.
+    """
+
+    def __init__(self, slow_query_ms=SQL_SLOW_QUERY_MS, collect_stats=SQL_STATS, max_statements=500):
+        self.slow_query_seconds = slow_query_ms / 1000 if slow_query_ms else None
+        self.collect_stats = collect_stats
+        self.max_statements = max_statements
+        self.lock = threading.Lock()
+        self.statements = {}
+
+    @property
+    def enabled(self):
+        return self.slow_query_seconds is not None or self.collect_stats
+
+    def attach(self, engine):
+        if not self.enabled:
+            return
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._sql_started = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._sql_started
+        if self.collect_stats:
+            self.observe(statement, elapsed)
+        if self.slow_query_seconds is not None and elapsed >= self.slow_query_seconds:
+            # Parameters are left out on purpose, they carry user data
+            slow_query_logger.warning(json.dumps({
+                'event': 'slow_query',
+                'duration_ms': round(elapsed * 1000, 2),
+                'executemany': executemany,
+                'statement': ' '.join(statement.split())[:1000],
+            }))
+
+    def observe(self, statement, seconds):
+        with self.lock:
+            stats = self.statements.get(statement)
+            if stats is None:
+                # Keep memory bounded if statements are built with inlined values
+                if len(self.statements) >= self.max_statements:
+                    statement = '<other>'
+                stats = self.statements.setdefault(statement, StatementStats())
+            stats.observe(seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {statement: stats.as_dict() for statement, stats in self.statements.items()}
+
+    def reset(self):
+        with self.lock:
+            self.statements = {}
@@ -0,0 +1,62 @@
+from datetime import date
+
+from .conversation_state import MemoryStateStore
+from .models import User
+from .params import STATUS_CACHE_TTL, STATUS_CACHE_MAX_ENTRIES
+
+
+def load_status(session, user_id):
+    """
+    The user's subscription state, or None for unknown users.
+
+    Reads only columns of the ix_users_status covering index, so it is a single
+    index lookup.
+    """
+    row = session.query(User.subscription_status, User.subscription_expiry).filter(User.user_id == user_id).first()
+    if row is None:
+        return None
+    return {'status': row.subscription_status,
+            'expiry': row.subscription_expiry.isoformat() if row.subscription_expiry else None}
+
+
+def status_reply(state, today=None):
+    if state is None:
+        return "You are not registered in our database."
+    expiry = date.fromisoformat(state['expiry']) if state['expiry'] else None
+    if state['status'] != 'active' or (expiry and expiry < (today or date.today())):
+        return "You do not have an active subscription."
+    return f"Your subscription is active until {expiry.strftime('%Y-%m-%d') if expiry else 'an unknown time'}."
+
+
+class StatusCache:
+    """
+    Read-through cache of subscription state for /status.
+
+    Entries live for ttl seconds in a bounded LRU. The process that changes a
+    subscription invalidates the entry right away; other processes see the
+    change once the entry expires.
+    """
+
+    def __init__(self, session_factory, ttl=STATUS_CACHE_TTL, max_entries=STATUS_CACHE_MAX_ENTRIES):
+        self.session_factory = session_factory
+        self.store = MemoryStateStore(ttl=ttl, max_entries=max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        entry = self.store.get(str(user_id))
+        if entry is not None:
+            self.hits += 1
+            return entry.get('state')
+        self.misses += 1
+        with self.session_factory() as session:
+            state = load_status(session, user_id)
+        # Unknown users are cached too, wrapped so they are told apart from a miss
+        self.store.set(str(user_id), {'state': state})
+        return state
+
+    def invalidate(self, user_id):
+        self.store.delete(str(user_id))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.store.entries)}
@@ -0,0 +1,69 @@
+from collections import namedtuple
+from datetime import date, timedelta
+
+from sqlalchemy import update, or_
+
+from .models import User, Code, Subscription
+from .reminders import schedule_reminders
+
+
+Redemption = namedtuple('Redemption', ['days', 'expiry'])
+
+
+def extend_subscription(session, user_id, days, today=None, plan_type=None, payment_status=None):
+    """
+    Extend a user's subscription by days inside the caller's transaction.
+
+    The user row is locked (SELECT ... FOR UPDATE where the database supports
+    it) so concurrent extensions add up instead of overwriting each other.
+    The period is recorded in the subscriptions ledger and the user's expiry
+    reminders are rescheduled in the same transaction, so users.subscription_*
+    always matches the latest ledger row.
+    Returns the new expiry date, or None when the user does not exist.
+    Does not commit.
+    """
+    today = today or date.today()
+    user = session.query(User).filter_by(user_id=user_id).with_for_update().first()
+    if not user:
+        return None
+    # Renewals continue from the current expiry, lapsed subscriptions restart today
+    start = user.subscription_expiry if user.subscription_expiry and user.subscription_expiry > today else today
+    user.subscription_expiry = start + timedelta(days=days)
+    user.subscription_status = 'active'
+    session.add(Subscription(user_id=user_id, plan_type=plan_type, start_date=start, end_date=user.subscription_expiry,
+                             payment_status=payment_status))
+    schedule_reminders(session, user_id, user.subscription_expiry)
+    return user.subscription_expiry
+
+
+def redeem_code(session, code, user_id, today=None):
+    """
+    Spend a redemption code and extend the user's subscription in one transaction.
+
+    The code is claimed with a single conditional UPDATE on used_status, so of
+    any number of concurrent redemptions exactly one matches the row. Returns a
+    Redemption, or None when the code is unknown, used, expired or the user
+    does not exist; in that case nothing is changed.
+    """
+    today = today or date.today()
+    claim = (
+        update(Code)
+        .where(Code.code == code, Code.used_status.is_(False),
+               or_(Code.expiry_date.is_(None), Code.expiry_date >= today))
+        .values(used_status=True, user_id=user_id)
+    )
+    if session.bind.dialect.update_returning:
+        days = session.execute(claim.returning(Code.associated_days)).scalar()
+    else:
+        days = session.query(Code.associated_days).filter_by(code=code).scalar() \
+            if session.execute(claim).rowcount == 1 else None
+    if not days:
+        session.rollback()
+        return None
+
+    expiry = extend_subscription(session, user_id, days, today=today, plan_type='code', payment_status='redeemed')
+    if expiry is None:
+        session.rollback()
+        return None
+    session.commit()
+    return Redemption(days, expiry)
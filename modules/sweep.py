@@ -0,0 +1,111 @@
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, update
+
+from .models import User
+from .params import EXPIRY_NOTICE_DAYS, SWEEP_PAGE_SIZE
+
+
+class SweepReport:
+    """Counters collected while running an expiry sweep."""
+
+    def __init__(self):
+        self.scanned = 0
+        self.expired = 0
+        self.expiring = 0
+        self.marked = 0
+        self.pages = 0
+        self.elapsed = 0.0
+
+    def __str__(self):
+        return (f"scanned={self.scanned} expired={self.expired} expiring={self.expiring} marked={self.marked} "
+                f"pages={self.pages} elapsed={self.elapsed:.3f}s")
+
+
+class ExpirySweep:
+    """
+    Walks users whose subscription is expired or about to expire.
+
+    The filter runs in SQL against the (subscription_expiry, user_id) index and
+    rows are fetched in keyset pages, each in its own short-lived session, so
+    memory use does not grow with the size of the users table. Expired users are
+    marked 'expired' once handled and skipped by later sweeps, so each lapse is
+    handled once and the scan does not grow with every user who ever expired.
+    """
+
+    def __init__(self, session_scope, page_size=SWEEP_PAGE_SIZE, notice_days=EXPIRY_NOTICE_DAYS):
+        self.session_scope = session_scope
+        self.page_size = page_size
+        self.notice_days = notice_days
+
+    def iter_pages(self, horizon):
+        """Yield lists of not yet expired user rows with subscription_expiry <= horizon, ordered by expiry."""
+        last_expiry, last_user_id = None, None
+        while True:
+            with self.session_scope() as session:
+                query = session.query(User.user_id, User.first_name, User.username, User.subscription_expiry) \
+                    .filter(User.subscription_expiry.isnot(None), User.subscription_expiry <= horizon,
+                            or_(User.subscription_status.is_(None), User.subscription_status != 'expired'))
+                if last_expiry is not None:
+                    # Resume strictly after the last row of the previous page
+                    query = query.filter(or_(
+                        User.subscription_expiry > last_expiry,
+                        and_(User.subscription_expiry == last_expiry, User.user_id > last_user_id),
+                    ))
+                rows = query.order_by(User.subscription_expiry, User.user_id).limit(self.page_size).all()
+
+            if not rows:
+                return
+            yield rows
+            if len(rows) < self.page_size:
+                return
+            last_expiry, last_user_id = rows[-1].subscription_expiry, rows[-1].user_id
+
+    def mark_expired(self, user_ids, today):
+        """Mark handled users expired in one statement. Users renewed meanwhile no longer match and are left alone."""
+        if not user_ids:
+            return 0
+        with self.session_scope() as session:
+            marked = session.execute(
+                update(User)
+                .where(User.user_id.in_(user_ids), User.subscription_expiry < today)
+                .values(subscription_status='expired')
+            ).rowcount
+            session.commit()
+        return marked
+
+    def run(self, on_expired, on_expiring, today=None):
+        """
+        Run the sweep and call on_expired/on_expiring for every matching user row.
+
+        :param on_expired: Called once with the row of each user whose subscription has expired,
+            who is then marked 'expired'.
+        :param on_expiring: Called with the row of each user expiring within notice_days,
+            or None to only visit expired users.
+        :param today: The reference date, defaults to the current UTC date.
+        :return: A SweepReport with the number of rows scanned and the time taken.
+        """
+        report = SweepReport()
+        started = time.perf_counter()
+        today = today or datetime.utcnow().date()
+        horizon = today + timedelta(days=self.notice_days) if on_expiring else today - timedelta(days=1)
+
+        for rows in self.iter_pages(horizon):
+            report.pages += 1
+            report.scanned += len(rows)
+            expired = []
+            for row in rows:
+                if row.subscription_expiry < today:
+                    report.expired += 1
+                    on_expired(row)
+                    expired.append(row.user_id)
+                else:
+                    report.expiring += 1
+                    on_expiring(row)
+            report.marked += self.mark_expired(expired, today)
+
+        report.elapsed = time.perf_counter() - started
+        logging.info(f"Expiry sweep finished: {report}")
+        return report
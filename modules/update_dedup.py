@@ -0,0 +1,139 @@
+import heapq
+import logging
+import threading
+import time
+from collections import deque
+
+from .conversation_state import make_state_store
+from .params import UPDATE_DEDUP_WINDOW, UPDATE_DEDUP_STORE_URL, UPDATE_DEDUP_FLOOR_TTL, UPDATE_DEDUP_SAVE_INTERVAL
+
+HIGH_WATER_MARK_KEY = 'update_high_water_mark'
+
+
+def telethon_update_key(update):
+    """A key identifying a raw Telethon update, or None for updates that are not deduplicated."""
+    query_id = getattr(update, 'query_id', None)
+    if query_id is not None:
+        return 'query', query_id
+    pts = getattr(update, 'pts', None)
+    if pts is not None:
+        # pts is a sequence per channel, and one more for private chats and groups
+        peer = getattr(getattr(update, 'message', None), 'peer_id', None)
+        return 'pts', getattr(update, 'channel_id', None) or getattr(peer, 'channel_id', None), pts
+    return None
+
+
+class UpdateDeduplicator:
+    """
+    Drops updates that were already seen, before any handler runs.
+
+    The keys of the last window updates are kept in a ring with a set for O(1)
+    lookups, so a duplicate delivered by a webhook retry or a reconnect is
+    recognized exactly; nothing new is ever dropped by mistake.
+
+    With a store, the high-water mark of polled updates is saved at most every
+    save_interval seconds: the highest update_id such that it and every polled
+    update before it has been handled, as reported through done(). After a
+    restart every polled update at or below it is dropped, which covers the
+    updates Telegram redelivers because the last getUpdates offset was never
+    confirmed, while updates that were received but not handled before a crash
+    run again. The saved value expires after
+    floor_ttl, as Telegram numbers updates randomly again after a week without any.
+    Only getUpdates hands updates to a single process in increasing order;
+    webhook deliveries arrive out of order, come back after a 503 and are spread
+    over replicas, so they are matched against the window alone.
+    """
+
+    def __init__(self, window=UPDATE_DEDUP_WINDOW, store=None, floor_ttl=UPDATE_DEDUP_FLOOR_TTL,
+                 save_interval=UPDATE_DEDUP_SAVE_INTERVAL):
+        self.window = window
+        self.store = store
+        self.floor_ttl = floor_ttl
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.ring = deque()
+        self.seen = set()
+        self.high_water_mark = None
+        self.newest = None  # Highest polled update_id received
+        self.unhandled = set()  # Polled update_ids received but not yet reported done
+        self.unhandled_heap = []  # The same ids, for finding the oldest, with lazy deletion
+        self.save_lock = threading.Lock()
+        self.saved_mark = None
+        self.saved_at = 0.0
+        self.duplicates = 0
+        state = store.get(HIGH_WATER_MARK_KEY) if store is not None else None
+        # Updates up to here were dispatched before the last restart
+        self.floor = state['update_id'] if state else None
+
+    def first_seen(self, key, sequence=None):
+        """
+        True the first time key is seen within the window, False for a duplicate.
+
+        sequence is the Bot API update_id of a polled update, compared against
+        the restored floor and tracked until done() is called for it. It is None
+        for webhook and Telethon updates.
+        """
+        with self.lock:
+            if key in self.seen or (sequence is not None and self.floor is not None and sequence <= self.floor):
+                self.duplicates += 1
+                return False
+            if len(self.ring) >= self.window:
+                self.seen.discard(self.ring.popleft())
+            self.ring.append(key)
+            self.seen.add(key)
+            if sequence is not None:
+                self.unhandled.add(sequence)
+                heapq.heappush(self.unhandled_heap, sequence)
+                if self.newest is None or sequence > self.newest:
+                    self.newest = sequence
+            return True
+
+    def done(self, sequence):
+        """Report a polled update as handled, moving the high-water mark up to the oldest one still in flight."""
+        with self.lock:
+            if sequence not in self.unhandled:
+                return
+            self.unhandled.discard(sequence)
+            heap = self.unhandled_heap
+            while heap and heap[0] not in self.unhandled:
+                heapq.heappop(heap)
+            self.high_water_mark = heap[0] - 1 if heap else self.newest
+        self.save()
+
+    def filter(self, updates, ordered=True):
+        """
+        Return the telebot Updates not seen before, in order.
+
+        ordered says the updates come from getUpdates, so their update_id is
+        checked against the floor and tracked for the high-water mark, and
+        done() must be called for each returned update once it was handled.
+        Pass False for webhook deliveries.
+        """
+        if not ordered:
+            return [update for update in updates if self.first_seen(update.update_id)]
+        return [update for update in updates if self.first_seen(update.update_id, update.update_id)]
+
+    def save(self, force=False):
+        if self.store is None or self.high_water_mark == self.saved_mark:
+            return
+        if not force and time.monotonic() - self.saved_at < self.save_interval:
+            return
+        # Shard threads report done() concurrently, an older mark must not overwrite a newer one
+        with self.save_lock:
+            mark = self.high_water_mark
+            if mark is None or mark == self.saved_mark:
+                return
+            try:
+                self.store.set(HIGH_WATER_MARK_KEY, {'update_id': mark}, ttl=self.floor_ttl)
+            except Exception as e:
+                logging.error(f"Failed to save the update high-water mark: {e}")
+                return
+            self.saved_mark, self.saved_at = mark, time.monotonic()
+
+    def stats(self):
+        return {'duplicates': self.duplicates, 'remembered': len(self.ring), 'high_water_mark': self.high_water_mark}
+
+
+def make_deduplicator(url=UPDATE_DEDUP_STORE_URL, window=UPDATE_DEDUP_WINDOW):
+    """A deduplicator that persists its high-water mark in the store at url, if one is configured."""
+    return UpdateDeduplicator(window=window, store=make_state_store(url, ttl=UPDATE_DEDUP_FLOOR_TTL) if url else None)
@@ -0,0 +1,85 @@
+import logging
+import queue
+import threading
+
+from .params import UPDATE_SHARDS, UPDATE_SHARD_QUEUE_SIZE
+
+
+def chat_id_of(update):
+    """Return the chat an incoming telebot Update belongs to, or None if it has none."""
+    message = (update.message or update.edited_message or update.channel_post or update.edited_channel_post)
+    if message is not None:
+        return message.chat.id
+    if update.callback_query is not None:
+        call = update.callback_query
+        return call.message.chat.id if call.message else call.from_user.id
+    for name in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query',
+                 'my_chat_member', 'chat_member', 'chat_join_request'):
+        event = getattr(update, name, None)
+        if event is not None:
+            chat = getattr(event, 'chat', None)
+            return chat.id if chat is not None else event.from_user.id
+    return None
+
+
+class ShardedUpdateScheduler:
+    """
+    Processes updates on a fixed number of single-threaded shards.
+
+    Every update is routed to shard chat_id % shards, so updates of different
+    chats run in parallel while the updates of one chat run one at a time in the
+    order they arrived. Conversational flows (next-step handlers, the pending
+    payment and receipt flow) rely on that ordering.
+    """
+
+    def __init__(self, process, shards=UPDATE_SHARDS, queue_size=UPDATE_SHARD_QUEUE_SIZE, on_done=None):
+        """
+        :param process: Callable taking a list of updates, e.g. the original TeleBot.process_new_updates.
+        :param on_done: Called with each update once process returned for it, whether or not it raised.
+        """
+        self.process = process
+        self.on_done = on_done
+        self.queues = [queue.Queue(queue_size) for _ in range(shards)]
+        self.threads = [threading.Thread(target=self.run_shard, args=(shard_queue,), name=f'update-shard-{index}', daemon=True)
+                        for index, shard_queue in enumerate(self.queues)]
+        for thread in self.threads:
+            thread.start()
+
+    def shard_of(self, update):
+        chat_id = chat_id_of(update)
+        # Updates without a chat have no ordering requirement, spread them by update_id
+        key = chat_id if chat_id is not None else update.update_id
+        return self.queues[key % len(self.queues)]
+
+    def dispatch(self, updates):
+        """Queue updates on their chat's shard. Blocks while that shard's queue is full."""
+        for update in updates:
+            self.shard_of(update).put(update)
+
+    def is_full(self, update):
+        """Whether the shard update would go to has no room, for callers that must not block."""
+        return self.shard_of(update).full()
+
+    def run_shard(self, shard_queue):
+        while True:
+            update = shard_queue.get()
+            if update is None:
+                return
+            try:
+                self.process([update])
+            except Exception as e:
+                logging.error(f"Failed to process update {update.update_id}: {e}")
+            if self.on_done is not None:
+                try:
+                    self.on_done(update)
+                except Exception as e:
+                    logging.error(f"Update {update.update_id} done callback failed: {e}")
+
+    def queue_lengths(self):
+        return [shard_queue.qsize() for shard_queue in self.queues]
+
+    def stop(self):
+        for shard_queue in self.queues:
+            shard_queue.put(None)
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,68 @@
+import hmac
+import logging
+
+from aiohttp import web
+from telebot import types
+
+from .params import WEBHOOK_PATH, WEBHOOK_SECRET
+
+
+class WebhookServer:
+    """
+    aiohttp endpoint that receives Telegram updates for the telebot front-end.
+
+    Requests are checked against the secret token, which is mandatory: without
+    it anyone who can reach the endpoint could post updates in any user's name,
+    superusers included. Each update is handed to accept right on the event
+    loop, in the order the requests arrive, and acknowledged straight away.
+    accept queues it on its chat's update shard without blocking, so updates of
+    one chat keep their order. When the shard is full the request is refused
+    with 503 so Telegram retries it later instead of the process buffering
+    without limit.
+    """
+
+    def __init__(self, accept, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET):
+        """
+        :param accept: Callable taking one Update, returns False when it cannot take it now. Must not block.
+        """
+        if not secret_token:
+            raise ValueError("The webhook needs a secret token, set WEBHOOK_SECRET "
+                             "(1-256 characters from A-Z, a-z, 0-9, _ and -)")
+        self.accept = accept
+        self.path = path
+        self.secret_token = secret_token
+        self.received = 0
+        self.rejected = 0
+        self.dropped = 0
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request):
+        if not hmac.compare_digest(
+                request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), self.secret_token):
+            self.rejected += 1
+            return web.Response(status=403)
+        try:
+            update = types.Update.de_json(await request.json())
+        except Exception as e:
+            self.rejected += 1
+            logging.error(f"Rejected malformed webhook update: {e}")
+            return web.Response(status=400)
+        if not self.accept(update):
+            self.dropped += 1
+            return web.Response(status=503)
+        self.received += 1
+        return web.Response()
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'rejected': self.rejected,
+            'dropped': self.dropped,
+        }
+
+    def run(self, host, port):
+        web.run_app(self.make_app(), host=host, port=port)
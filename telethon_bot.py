@@ -1,49 +1,149 @@
 from telethon import TelegramClient, events, connection, Button
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
 import asyncio
 import logging
 import telebot
-import random
-import string
 from telebot import types
-from modules.models import session, User, Subscription, Admin, Payment, Code, Session, SubscriptionPlan, Base, db_url
+from modules.models import User, Subscription, Admin, Payment, Code, SubscriptionPlan, Base
+from modules.database import get_database, AsyncDatabase
 from decimal import Decimal
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
-from contextlib import asynccontextmanager
-from modules.params import TELEGRAM_TOKEN, DB_URL, API_ID, API_HASH
-from apscheduler.schedulers.background import BackgroundScheduler
+from modules.params import TELEGRAM_TOKEN, DB_URL, API_ID, API_HASH, PLAN_CACHE_TTL, CHANNEL_ID, SWEEP_CRON, CLEANUP_CRON, REMINDER_CRON, CALLBACK_SECRET, METRICS_PORT
+from modules.dispatcher import AsyncOutboundDispatcher
+from modules.admin_cache import AdminRegistry
+from modules.plan_catalogue import PlanCatalogue
+from modules.status_cache import StatusCache, status_reply
+from modules.enforcement import ChannelEnforcer
+from modules.scheduler import JobScheduler
+from modules.reminders import ReminderQueue
+from modules.admin_fanout import AdminFanout
+from modules.approvals import ApprovalPipeline, attach_receipt, conflict_reply
+from modules.conversation_state import make_state_store
+from modules.update_dedup import UpdateDeduplicator, telethon_update_key
+from modules.metrics import REGISTRY, MetricsServer, instrumented, watch_engine
+from modules import subscriptions, codes, callbacks
+from modules.callbacks import CallbackRouter
+from functools import partial
 
 class Bot:
-    def __init__(self, api_id, api_hash, token, db_uri, connection=None, proxy=None):
+    def __init__(self, api_id, api_hash, token, db_uri, connection=None, proxy=None, client=None):
         self.token = token  # Store the token as an attribute
-        self.client = TelegramClient('bot_session', api_id, api_hash, proxy=proxy)
-        self.engine = create_engine(db_uri, echo=True, pool_size=10, max_overflow=20)
-        self.SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=self.engine))
+        # A client can be passed in, e.g. the stand-in used by the benchmarks
+        self.client = client or TelegramClient('bot_session', api_id, api_hash, proxy=proxy)
+        # One engine and pool per process, shared with everything else using this database
+        self.db = get_database(db_uri)
+        self.engine = self.db.engine
+        self.SessionLocal = self.db.SessionLocal
+        # Every query runs on this executor so a slow one never stalls the event loop
+        self.adb = AsyncDatabase(self.db)
 
         Base.metadata.create_all(bind=self.engine)
-        self.user_plan_choice = {} 
-
-    @asynccontextmanager
-    async def get_db_session(self):
-        """Provide a transactional scope around a series of operations."""
-        db = self.SessionLocal()
-        try:
-            yield db
-        except Exception as e:
-            db.rollback()  # Roll back the transaction in case of error
-            raise e
-        finally:
-            db.close()
+        # Plan choices per chat, shared with other processes when a persistent store is configured
+        self.conversations = make_state_store()
+        self.outbox = AsyncOutboundDispatcher()
+        self.admins = AdminRegistry(self.db.session_scope)
+        # Plans are edited from bot.py, so refresh them periodically
+        self.plans = PlanCatalogue(self.db.session_scope, ttl=PLAN_CACHE_TTL)
+        self.status = StatusCache(self.db.session_scope)
+        self.enforcer = ChannelEnforcer(self.db.session_scope)
+        self.reminders = ReminderQueue(self.db.session_scope)
+        self.fanout = AdminFanout(self.db.session_scope, self.outbox, late_edit=self.edit_late_receipt_copy)
+        self.approvals = ApprovalPipeline(self.db.session_scope)
+        # Telethon keeps its own update state in the session file, only in-memory deduplication is needed
+        self.dedup = UpdateDeduplicator()
+        # Inline buttons carry signed, packed data and are dispatched by action tag, see modules/callbacks.py
+        self.callbacks = CallbackRouter(CALLBACK_SECRET or token)
+        self.callbacks.register(callbacks.SUBSCRIBE, 'i', self.subscribe_callback)
+        self.callbacks.register(callbacks.PAY_ONLINE, 'i', partial(self.payment_method_callback, payment_method='online'))
+        self.callbacks.register(callbacks.PAY_DIRECT, 'i', partial(self.payment_method_callback, payment_method='direct'))
+        self.callbacks.register(callbacks.APPROVE, 'qq', partial(self.handle_admin_decision, decision='approve'))
+        self.callbacks.register(callbacks.DENY, 'qq', partial(self.handle_admin_decision, decision='deny'))
+
+    async def warm_caches(self):
+        # Reload expired caches on the DB executor instead of the event loop
+        if not self.admins.is_fresh():
+            await self.adb.call(self.admins.refresh)
+        if not self.plans.is_fresh():
+            await self.adb.call(self.plans.refresh)
+
+    def update_conversation(self, chat_id, **values):
+        # Blocking for the SQLite and Redis stores, call it through self.adb.call
+        state = self.conversations.get(str(chat_id)) or {}
+        state.update(values)
+        self.conversations.set(str(chat_id), state)
+
+    async def send_message(self, chat_id, *args, **kwargs):
+        """Send a message through the rate-limited outbound queue."""
+        return await self.outbox.send(chat_id, self.client.send_message, chat_id, *args, **kwargs)
 
     async def start(self):
         await self.client.start(bot_token=self.token)
         await self.setup_handlers()
+        self.start_metrics()
+        self.start_scheduler()
         await self.client.run_until_disconnected()
 
+    def start_metrics(self, port=METRICS_PORT):
+        # Local /metrics endpoint for Prometheus, see modules/metrics.py
+        if not port:
+            return
+        watch_engine(self.engine)
+        REGISTRY.add_stats('outbound', self.outbox.metrics.snapshot)
+        REGISTRY.add_stats('db_executor', lambda: {'queue_depth': self.adb.queue_depth()})
+        REGISTRY.add_stats('db_pool', self.db.pool_stats)
+        REGISTRY.add_stats('admin_cache', self.admins.stats)
+        REGISTRY.add_stats('status_cache', self.status.stats)
+        REGISTRY.add_stats('approvals', self.approvals.stats)
+        REGISTRY.add_stats('dedup', self.dedup.stats)
+        self.metrics_server = MetricsServer(port=port).start()
+
+    def start_scheduler(self):
+        # Shares the scheduled_jobs table with bot.py, each run happens in exactly one process
+        loop = asyncio.get_running_loop()
+        self.scheduler = JobScheduler(self.db.session_scope)
+        if CHANNEL_ID:
+            self.scheduler.add_job('channel_enforcement', SWEEP_CRON,
+                                   lambda: asyncio.run_coroutine_threadsafe(self.enforce_channel(), loop).result())
+        self.scheduler.add_job('expiry_reminders', REMINDER_CRON, lambda: self.send_reminders(loop))
+        # The conversation store may be this process's memory, so every replica purges its own
+        self.scheduler.add_local_job('conversation_cleanup', CLEANUP_CRON, self.conversations.purge_expired)
+        self.scheduler.start()
+
+    def send_reminders(self, loop):
+        # Runs on the scheduler thread; the queue waits for the sends and retries failed ones on its next pass
+        return self.reminders.run(lambda row: asyncio.run_coroutine_threadsafe(self.send_reminder(row), loop))
+
+    async def send_reminder(self, reminder):
+        # Same notifications as bot.py, whichever front-end wins the job. Only the user's message
+        # decides whether the reminder is retried, the admin notices are queued
+        await self.send_message(reminder.user_id, f"Your subscription is about to expire on {reminder.expiry.strftime('%Y-%m-%d')}.")
+        for admin_id in await self.get_all_admins():
+            self.outbox.submit(admin_id, self.client.send_message, admin_id, f"User {reminder.user_id}'s subscription is about to expire.")
+
+    async def enforce_channel(self):
+        # kick_participant bans and then lifts the ban, two requests
+        report = await self.enforcer.run_async(self.adb, self.outbox, self.remove_user_from_channel, calls=2)
+        if report.removed or report.skipped:
+            for admin_id in await self.get_all_admins():
+                await self.send_message(admin_id, f"Removed {report.removed} expired users from the channel in {report.elapsed:.1f}s "
+                                                  f"({report.rate:.1f}/s), {report.failed} failed and will be retried, "
+                                                  f"{report.skipped} could not be removed and need a manual check.")
+        return report
+
+    async def remove_user_from_channel(self, user_id):
+        # Resolved from the session cache first: a bare id only works for users this session has seen,
+        # others raise "Could not find the input entity", which the enforcer does not retry
+        user = await self.client.get_input_entity(user_id)
+        # Kicks without a lasting ban, so the user can rejoin after renewing
+        await self.client.kick_participant(CHANNEL_ID, user)
+
     async def setup_handlers(self):
+        # Registered first so duplicates never reach the handlers below
+        @self.client.on(events.Raw)
+        async def drop_duplicates(update):
+            key = telethon_update_key(update)
+            if key is not None and not self.dedup.first_seen(key):
+                raise events.StopPropagation
+
         @self.client.on(events.NewMessage(pattern='/start'))
         async def start(event):
             await self.send_welcome(event)
@@ -56,10 +156,14 @@ class Bot:
         async def subscribe(event):
             await self.handle_subscribe(event)
 
-        @self.client.on(events.NewMessage(pattern='/generate_code'))
+        @self.client.on(events.NewMessage(pattern=r'/generate_code(\s|$)'))
         async def generate_code(event):
             await self.generate_redemption_code(event)
 
+        @self.client.on(events.NewMessage(pattern='/generate_codes'))
+        async def generate_codes(event):
+            await self.generate_code_batch(event)
+
         @self.client.on(events.NewMessage(pattern='/redeem'))
         async def redeem(event):
             await self.redeem_code(event)
@@ -72,41 +176,32 @@ class Bot:
         async def callback_query(event):
             await self.handle_callback_query(event)
 
+    @instrumented
     async def handle_callback_query(self, event):
-        data = event.data.decode('utf-8')
-        chat_id = event.sender_id
-
-        if data.startswith('subscribe_'):
-            await self.subscribe_callback(chat_id, data)
-        elif data.startswith('pay_online_') or data.startswith('pay_direct_'):
-            await self.payment_method_callback(chat_id, data)
-        elif data.startswith('approve_') or data.startswith('deny_'):
-            await self.handle_admin_decision(event)
-
-        # ... more conditions based on the callback data ...
+        # Unknown, outdated or forged button data is rejected by the router
+        route = self.callbacks.resolve(event.data)
+        if route is None:
+            await event.answer("Action not recognized.")
+            return
+        handler, args = route
+        await handler(event, *args)
 
         # Make sure to answer the callback query
         await event.answer()
 
+    @instrumented
     async def handle_check_status(self, event):
         chat_id = event.sender_id
+
         try:
-            async with self.get_db_session() as session:
-                user = session.query(User).filter_by(user_id=chat_id).first()
-                if user:
-                    if user.subscription_status == 'active':
-                        expiry = user.subscription_expiry.strftime("%Y-%m-%d") if user.subscription_expiry else "an unknown time"
-                        reply = f"Your subscription is active until {expiry}."
-                    else:
-                        reply = "You do not have an active subscription."
-                else:
-                    reply = "You are not registered in our database."
-            
+            # Served from the status cache, a miss is one covering-index lookup on the DB executor
+            reply = status_reply(await self.adb.call(self.status.get, chat_id))
             await event.respond(reply)
         except Exception as e:
             logging.error(f"An error occurred: {e}")
             await event.respond("An error occurred while checking your status.")
 
+    @instrumented
     async def send_welcome(self, event):
         # Extract user data from the event
         user_id = event.sender_id
@@ -114,76 +209,84 @@ class Bot:
         # last_name = ... # Telethon does not directly provide last name, it depends on how you retrieve the user's full name
         username = event.chat.username
 
-        # Start a new database session
-        async with self.get_db_session() as session:
+        def register_user(session):
             # Check if the user already exists in the database
             existing_user = session.query(User).filter_by(user_id=user_id).first()
 
             if existing_user:
-                reply = f"Welcome back {existing_user.first_name}! Use /subscribe to manage your subscription or /status to check your current subscription status."
-            else:
-                # Create a new user in the database
-                new_user = User(
-                    user_id=user_id,
-                    username=username,
-                    first_name=first_name,
-                    last_name='?',  # Update accordingly
-                    subscription_status='inactive',
-                )
-                session.add(new_user)
-                await session.commit()
-                reply = "Welcome to the Subscription Manager Bot! You have been registered. Use /subscribe to choose a subscription plan."
+                return f"Welcome back {existing_user.first_name}! Use /subscribe to manage your subscription or /status to check your current subscription status."
+            # Create a new user in the database
+            new_user = User(
+                user_id=user_id,
+                username=username,
+                first_name=first_name,
+                last_name='?',  # Update accordingly
+                subscription_status='inactive',
+            )
+            session.add(new_user)
+            session.commit()
+            return "Welcome to the Subscription Manager Bot! You have been registered. Use /subscribe to choose a subscription plan."
 
-            # Send the welcome message
-            await event.respond(reply)
+        reply = await self.adb.run(register_user)
+        self.status.invalidate(user_id)
+        # Send the welcome message
+        await event.respond(reply)
 
+    @instrumented
     async def handle_subscribe(self, event):
         chat_id = event.sender_id
         try:
-            async with self.get_db_session() as session:
-                plans = session.query(SubscriptionPlan).all()
-                if plans:
-                    buttons = [
-                        [Button.inline(f"{plan.name} - ${plan.price} for {plan.duration_days} days", data=f"subscribe_{plan.plan_id}")]
-                        for plan in plans
-                    ]
-                    await event.respond("Please choose a subscription plan:", buttons=buttons)
-                else:
-                    await event.respond("There are currently no subscription plans available.")
+            await self.warm_caches()
+            if self.plans.plans():
+                buttons = self.plans.keyboard('subscribe', self.build_subscribe_buttons)
+                await event.respond("Please choose a subscription plan:", buttons=buttons)
+            else:
+                await event.respond("There are currently no subscription plans available.")
         except Exception as e:
             logging.error(f"An error occurred: {e}")
             await event.respond("An error occurred while processing your request.")
 
-    async def subscribe_callback(self, chat_id, data):
-        # Extract the plan ID from the callback data
-        plan_id = int(data.split('_')[1])
-
-        # Retrieve the selected plan details from the database
-        async with self.get_db_session() as session:
-            selected_plan = session.query(SubscriptionPlan).filter_by(plan_id=plan_id).first()
-            if selected_plan:
-                buttons = [
-                    [Button.inline("Pay Online", data=f"pay_online_{plan_id}")],
-                    [Button.inline("Direct Payment", data=f"pay_direct_{plan_id}")]
-                ]
-                await self.client.send_message(chat_id, f"You have selected the {selected_plan.name} plan. Please choose your payment method:", buttons=buttons)
-            else:
-                await self.client.send_message(chat_id, "The selected plan does not exist.")
+    def build_subscribe_buttons(self, plans):
+        return [
+            [Button.inline(f"{plan.name} - ${plan.price} for {plan.duration_days} days", data=self.callbacks.encode(callbacks.SUBSCRIBE, plan.plan_id))]
+            for plan in plans
+        ]
+
+    def build_payment_method_buttons(self, plan_id):
+        return [
+            [Button.inline("Pay Online", data=self.callbacks.encode(callbacks.PAY_ONLINE, plan_id))],
+            [Button.inline("Direct Payment", data=self.callbacks.encode(callbacks.PAY_DIRECT, plan_id))]
+        ]
 
-    async def payment_method_callback(self, chat_id, data):
-        payment_method, plan_id = data.split('_')[1:]
+    @instrumented
+    async def subscribe_callback(self, event, plan_id):
+        chat_id = event.sender_id
+
+        await self.warm_caches()
+        selected_plan = self.plans.get(plan_id)
+        if selected_plan:
+            await self.adb.call(self.update_conversation, chat_id, plan_id=plan_id)
+            buttons = self.plans.keyboard(f'payment_method_{plan_id}', lambda plans: self.build_payment_method_buttons(plan_id))
+            await self.send_message(chat_id, f"You have selected the {selected_plan.name} plan. Please choose your payment method:", buttons=buttons)
+        else:
+            await self.send_message(chat_id, "The selected plan does not exist.")
+
+    @instrumented
+    async def payment_method_callback(self, event, plan_id, payment_method):
+        chat_id = event.sender_id
         if payment_method == 'online':
             # Online payment handling logic goes here
             pass
         elif payment_method == 'direct':
-            await self.handle_direct_payment(chat_id, int(plan_id))
+            await self.handle_direct_payment(chat_id, plan_id)
         else:
-            await self.client.send_message(chat_id, "Unrecognized payment method.")
+            await self.send_message(chat_id, "Unrecognized payment method.")
 
     async def handle_direct_payment(self, chat_id, plan_id):
-        async with self.get_db_session() as session:
-            selected_plan = session.query(SubscriptionPlan).filter_by(plan_id=plan_id).first()
-            if selected_plan:
+        await self.warm_caches()
+        selected_plan = self.plans.get(plan_id)
+        if selected_plan:
+            def create_payment(session):
                 # Create a new payment record
                 new_payment = Payment(
                     user_id=chat_id,
@@ -194,70 +297,80 @@ class Bot:
                     payment_date=datetime.utcnow()
                 )
                 session.add(new_payment)
-                session.commit()  # Removed 'await' here
+                session.commit()
 
-                await self.client.send_message(chat_id, "To complete your subscription via direct payment, please transfer the payment to our account and provide us with the receipt number.")
-            else:
-                await self.client.send_message(chat_id, "The selected plan does not exist.")
+            await self.adb.run(create_payment)
+            await self.send_message(chat_id, "To complete your subscription via direct payment, please transfer the payment to our account and provide us with the receipt number.")
+        else:
+            await self.send_message(chat_id, "The selected plan does not exist.")
 
+    @instrumented
     async def handle_receipt_photo(self, event):
         chat_id = event.sender_id
-        async with self.get_db_session() as session:
-            # Assuming that there is a Payment record with 'pending' status for the user
-            payment = session.query(Payment).filter_by(user_id=chat_id, payment_status='pending').first()
-            if payment:
-                # Forward the photo to each admin
-                admins = await self.get_all_admins(session)
-                for admin_id in admins:
-                    await event.forward_to(admin_id)
-                    # Create inline buttons for approval or denial
-                    approve_button = Button.inline("Approve", data=f"approve_{chat_id}_{payment.payment_id}")
-                    deny_button = Button.inline("Deny", data=f"deny_{chat_id}_{payment.payment_id}")
-                    await self.client.send_message(admin_id, "Please approve or deny the payment:", buttons=[approve_button, deny_button])
-                # Update the payment record with receipt information
-                payment.receipt_message_id = event.message.id
-                session.commit()  # Assuming this is a synchronous operation
-            else:
-                await event.respond("No pending payment found or you've already submitted a receipt.")
 
-    async def handle_admin_decision(self, event):
-        data = event.data.decode('utf-8')
-        decision, user_id, payment_id = data.split('_')
+        def store_receipt(session):
+            # Store the receipt on the user's latest pending payment
+            payment_id = attach_receipt(session, chat_id, event.message.id)
+            session.commit()
+            return payment_id
+
+        payment_id = await self.adb.run(store_receipt)
+        if payment_id:
+            # Acknowledge right away, the admins are notified in parallel in the background
+            await event.respond("Your receipt has been sent to the admins for review.")
+            # One photo message per admin carrying the receipt, the payment details and the buttons
+            buttons = [Button.inline("Approve", data=self.callbacks.encode(callbacks.APPROVE, chat_id, payment_id)),
+                       Button.inline("Deny", data=self.callbacks.encode(callbacks.DENY, chat_id, payment_id))]
+            caption = f"Receipt from user {chat_id} for payment {payment_id}.\nPlease approve or deny the payment:"
+            self.fanout.submit_async(self.adb, payment_id, await self.get_all_admins(), self.client.send_file,
+                                     event.message.media, caption=caption, buttons=buttons)
+        else:
+            await event.respond("No pending payment found or you've already submitted a receipt.")
+
+    @instrumented
+    async def handle_admin_decision(self, event, user_id, payment_id, decision):
         admin_id = event.sender_id  # Admin who made the decision
+        if not await self.is_admin(admin_id):
+            logging.warning(f"Ignored a payment decision from non-admin {admin_id}")
+            return
+
+        # One transition per payment: double taps, other admins and redelivered callbacks are turned away
+        result = await self.adb.call(self.approvals.decide, payment_id, decision)
+        if not result.applied:
+            await self.send_message(admin_id, conflict_reply(result))
+            return
 
         if decision == 'approve':
-            await self.process_approval(int(user_id), int(payment_id))
+            await self.process_approval(result)
             decision_text = "You approved this payment."
         elif decision == 'deny':
-            await self.process_denial(int(user_id), int(payment_id))
+            await self.process_denial(result)
             decision_text = "You denied this payment."
 
-        # Edit the original message sent to the admin
-        await self.client.edit_message(admin_id, event.query.msg_id, decision_text, buttons=None)
+        # Edit every admin's copy of the receipt, not just the one that was clicked
+        verdict = 'approved' if decision == 'approve' else 'denied'
+        caption = f"Payment {payment_id} {verdict} by admin {admin_id}."
+        edited = await self.fanout.edit_all_async(
+            self.adb, payment_id, lambda chat_id, message_id: self.client.edit_message(chat_id, message_id, caption, buttons=None))
+        if not edited:
+            # Receipts sent before the copies were recorded only have this message to update
+            await self.client.edit_message(admin_id, event.query.msg_id, decision_text, buttons=None)
 
 
-    async def process_approval(self, user_id, payment_id):
-        async with self.get_db_session() as session:
-            payment = session.query(Payment).filter_by(payment_id=payment_id).first()
-            if payment:
-                payment.payment_status = 'confirmed'
-                session.commit()
-                await self.update_user_subscription(user_id, payment_id)
-                await self.client.send_message(user_id, "Your payment has been approved. Your subscription has been updated.")
-            else:
-                logging.error(f"No payment found for payment ID {payment_id}.")
+    async def edit_late_receipt_copy(self, admin_id, message_id, payment_id, status):
+        # A copy delivered after the decision was made and the other copies edited
+        verdict = 'approved' if status == 'confirmed' else status
+        await self.client.edit_message(admin_id, message_id, f"Payment {payment_id} {verdict}.", buttons=None)
 
+    async def process_approval(self, result):
+        # The payment is confirmed and the subscription extended already, see modules/approvals.py
+        self.status.invalidate(result.user_id)
+        await self.send_message(result.user_id, f"Your payment has been approved. Your subscription is active until {result.expiry.strftime('%Y-%m-%d')}.")
 
-    async def process_denial(self, user_id, payment_id):
-        async with self.get_db_session() as session:
-            payment = session.query(Payment).filter_by(payment_id=payment_id).first()
-            if payment:
-                payment.payment_status = 'denied'
-                session.commit()
-                await self.client.send_message(user_id, "Your payment was not accepted. Please contact support for more information.")
-            else:
-                logging.error(f"No payment found for payment ID {payment_id}.")
+    async def process_denial(self, result):
+        await self.send_message(result.user_id, "Your payment was not accepted. Please contact support for more information.")
 
+    @instrumented
     async def generate_redemption_code(self, event):
         if not await self.is_admin(event.sender_id):
             await event.respond("You are not authorized to generate codes.")
@@ -276,29 +389,52 @@ class Bot:
 
         # Generate the code
         code = self.create_unique_code()
-        async with self.get_db_session() as session:
+
+        def add_code(session):
             new_code = Code(
                 code=code,
                 associated_days=duration,
                 used_status=False
             )
             session.add(new_code)
-            session.commit()  # Assuming synchronous operation
+            session.commit()
+
+        await self.adb.run(add_code)
 
         await event.respond(f"Generated code: {code} for {duration} days")
 
     def create_unique_code(self):
-        return ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+        return codes.new_code()
+
+    @instrumented
+    async def generate_code_batch(self, event):
+        if not await self.is_admin(event.sender_id):
+            await event.respond("You are not authorized to generate codes.")
+            return
+        try:
+            batch = codes.parse_batch_command(event.raw_text)
+        except ValueError as e:
+            await event.respond(str(e))
+            return
+
+        stored = await self.adb.run(batch.insert)
+        campaign = batch.template['campaign']
+        document = await self.adb.call(batch.export)
+        uploaded = await self.client.upload_file(document, file_name=f"codes_{campaign}.csv")
+        await self.outbox.send(event.chat_id, self.client.send_file, event.chat_id, uploaded,
+                               caption=f"Generated {stored} codes for campaign {campaign}.", force_document=True)
 
     async def is_admin(self, user_id):
-        async with self.get_db_session() as session:
-            admin = session.query(Admin).filter_by(admin_id=user_id).first()
-            return admin is not None
+        # Served from the admin snapshot once it is at most auth_ttl old, see AdminRegistry.check
+        if not self.admins.is_fresh(self.admins.auth_ttl):
+            await self.adb.call(self.admins.refresh, self.admins.auth_ttl)
+        return self.admins.check(user_id)
         
-    async def get_all_admins(self, session):
-        admins = session.query(Admin).all()
-        return [admin.admin_id for admin in admins]
+    async def get_all_admins(self):
+        await self.warm_caches()
+        return self.admins.admin_ids()
         
+    @instrumented
     async def redeem_code(self, event):
         # Extract the code from the command
         command_parts = event.raw_text.split()
@@ -309,45 +445,14 @@ class Bot:
         code_text = command_parts[1].strip().upper()
 
         user_id = event.sender_id
-        async with self.get_db_session() as session:
-            code = session.query(Code).filter_by(code=code_text, used_status=False).first()
-            if code:
-                code.used_status = True
-                associated_days = code.associated_days
-                session.commit()  # Assuming synchronous operation
-                await self.update_user_subscription(user_id, additional_days=associated_days)
-                await event.respond(f"Your code has been redeemed successfully. Subscription extended by {associated_days} days.")
-            else:
-                await event.respond("The code is invalid or has already been used.")
-
-    async def update_user_subscription(self, user_id, payment_id=None, additional_days=None):
-        async with self.get_db_session() as session:
-            # Find the user in the database
-            user = session.query(User).filter_by(user_id=user_id).first()
-            if not user:
-                await self.client.send_message(user_id, "User not found in the database.")
-                return
-
-            # If payment_id is provided, use it to find the subscription plan and calculate additional days
-            if payment_id:
-                payment = session.query(Payment).filter_by(payment_id=payment_id).first()
-                if payment and payment.payment_status == 'confirmed':
-                    selected_plan = session.query(SubscriptionPlan).filter_by(plan_id=payment.plan_id).first()
-                    if selected_plan:
-                        additional_days = selected_plan.duration_days
-                else:
-                    await self.client.send_message(user_id, "Payment not found or not confirmed.")
-                    return
-
-            # Update the user's subscription expiry and status
-            if additional_days:
-                new_expiry_date = (user.subscription_expiry + timedelta(days=additional_days)) if user.subscription_expiry else (datetime.utcnow() + timedelta(days=additional_days))
-                user.subscription_expiry = new_expiry_date
-                user.subscription_status = 'active'
-                session.commit()
-                await self.client.send_message(user_id, f"Your subscription has been updated and is active until {new_expiry_date.strftime('%Y-%m-%d %H:%M:%S')}.")
-            else:
-                await self.client.send_message(user_id, "No additional days provided for the subscription update.")
+
+        # Claiming the code and extending the subscription is one atomic transaction
+        redemption = await self.adb.run(subscriptions.redeem_code, code_text, user_id)
+        if redemption:
+            self.status.invalidate(user_id)
+            await event.respond(f"Your code has been redeemed successfully. Subscription extended by {redemption.days} days.")
+        else:
+            await event.respond("The code is invalid or has already been used.")
 
 
 if __name__ == '__main__':